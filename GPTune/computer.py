@@ -31,6 +31,93 @@ import time
 from pathlib import Path
 import importlib
 import inspect
+import atexit
+import json
+
+class CompiledConstraints(object):
+
+    """
+    The constraints of a problem prepared for repeated evaluation: string constraints are compiled once,
+    callables are resolved once (from the driver module if the problem has a driverabspath) together with their signature.
+    Everything is prepared lazily so that a faulty constraint raises when it is evaluated, as before.
+    """
+
+    driver_modules = {}   # driverabspath -> module, shared by all problems
+
+    def __init__(self, problem):
+
+        self.problem = problem
+        self.constraints = problem.constraints
+        self.names = list(problem.constraints.keys())
+        self.csts = list(problem.constraints.values())
+        self.codes = [None] * len(self.names)
+        self.funcs = [None] * len(self.names)   # (callable, parameter names)
+
+    def is_string(self, idx):
+
+        return isinstance(self.csts[idx], str)
+
+    def code(self, idx):
+
+        if (self.codes[idx] is None):
+            self.codes[idx] = compile(self.csts[idx], '<constraint %s>'%(self.names[idx]), 'eval')
+        return self.codes[idx]
+
+    # a string constraint is evaluated on whole columns only if it consists of operators on known names (no calls, attributes or subscripts, which could mean something else on arrays)
+    def vectorizable(self, idx, names):
+
+        return self.is_string(idx) and '[' not in self.csts[idx] and set(self.code(idx).co_names) <= set(names)
+
+    def func(self, idx):
+
+        if (self.funcs[idx] is None):
+            cstname = self.names[idx]
+            cst = self.csts[idx]
+            if(hasattr(self.problem, 'driverabspath')): # differentiate between Problem and TuningProblem 
+                if(self.problem.driverabspath is not None):
+                    driverabspath = self.problem.driverabspath
+                    if (driverabspath not in CompiledConstraints.driver_modules):
+                        modulename = Path(driverabspath).stem  # get the driver name excluding all directories and extensions
+                        sys.path.append(driverabspath) # add path to sys
+                        CompiledConstraints.driver_modules[driverabspath] = importlib.import_module(modulename) # import driver name as a module
+                    cst = getattr(CompiledConstraints.driver_modules[driverabspath], cstname)
+                else:
+                    raise Exception('the driverabspath is required for the constraints')
+            self.funcs[idx] = (cst, set(inspect.signature(cst).parameters))
+        return self.funcs[idx]
+
+    # returns the verdict of constraint idx on point, or None if the constraint does not apply (missing inputs)
+    def evaluate_one(self, idx, point, inputs_only = False):
+
+        cstname = self.names[idx]
+        if (self.is_string(idx)):
+            try:
+                # {} has to be the global argument to eval
+                # and point the local one, otherwise,
+                # point will be corrupted / updated by eval
+                return eval(self.code(idx), {}, point)
+            except Exception as inst:
+                if (inputs_only and isinstance(inst, NameError)):
+                    return None
+                else:
+                    raise Exception(f"Unexpected exception '{inst}' was raised while evaluating constraint '{cstname}'. Correct this constraint before calling the tuner again.")
+        else:
+            try:
+                (cst, parameters) = self.func(idx)
+                kwargs2 = {}
+                for varname in point:
+                    if (varname in parameters):
+                        kwargs2[varname] = point[varname]
+                return cst(**kwargs2)
+            except Exception as inst:
+                if (isinstance(inst, TypeError)):
+                    lst = inst.__str__().split()
+                    if (len(lst) >= 5 and lst[1] == 'missing' and lst[3] == 'required' and lst[4] == 'positional'):
+                        return None
+                    else:
+                        raise Exception(f"Unexpected exception '{inst}' was raised while evaluating constraint '{cstname}'. Correct this constraint before calling the tuner again.")
+                else:
+                    raise Exception(f"Unexpected exception '{inst}' was raised while evaluating constraint '{cstname}'. Correct this constraint before calling the tuner again.")
 
 class Computer(object):
 
@@ -42,6 +129,39 @@ class Computer(object):
         if (hosts != None and nodes != len(hosts)):
             raise Exception('The number of elements in "hosts" does not match with the number of "nodes"')
 
+        self.worker_pools = {}  # persistent spawned workers, see spawn_pool
+        self.worker_pools_atexit = False
+        self.compiled_constraints = {}  # id(problem) -> CompiledConstraints
+        self.rci_server = None  # resident RCI server, see evaluate_objective_rci_server
+
+    def __getstate__(self):
+        # intercommunicators, code objects and modules are not picklable, spawned children get a Computer without pools and caches
+        state = self.__dict__.copy()
+        state['worker_pools'] = {}
+        state['worker_pools_atexit'] = False
+        state['compiled_constraints'] = {}
+        state['rci_server'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if 'worker_pools' not in self.__dict__:
+            self.worker_pools = {}
+            self.worker_pools_atexit = False
+        if 'compiled_constraints' not in self.__dict__:
+            self.compiled_constraints = {}
+        if 'rci_server' not in self.__dict__:
+            self.rci_server = None
+
+    def constraints_of(self, problem):
+
+        # the compiled constraints are cached per problem, and rebuilt if the problem's constraints were replaced
+        cc = self.compiled_constraints.get(id(problem))
+        if (cc is None or cc.problem is not problem or cc.constraints is not problem.constraints):
+            cc = CompiledConstraints(problem)
+            self.compiled_constraints[id(problem)] = cc
+        return cc
+
     def evaluate_constraints(self, problem, point : Collection, inputs_only : bool = False, **kwargs):  # point is in the original spaces
 
 #       kwargs['constraints_evaluation_parallelism']
@@ -49,49 +169,71 @@ class Computer(object):
         # points can be either a dict or a list of dicts on which to iterate
         if(problem.constants is not None):
             point.update(problem.constants)
+        cc = self.constraints_of(problem)
         cond = True
-        for (cstname, cst) in problem.constraints.items():
-            if (isinstance(cst, str)):
-                try:
-                    # {} has to be the global argument to eval
-                    # and point the local one, otherwise,
-                    # point will be corrupted / updated by eval
-                    cond = eval(cst, {}, point)
-                except Exception as inst:
-                    if (inputs_only and isinstance(inst, NameError)):
-                        pass
-                    else:
-                        raise Exception(f"Unexpected exception '{inst}' was raised while evaluating constraint '{cstname}'. Correct this constraint before calling the tuner again.")
-            else:
-                try:
-                    if(hasattr(problem, 'driverabspath')): # differentiate between Problem and TuningProblem 
-                        if(problem.driverabspath is not None):
-                            modulename = Path(problem.driverabspath).stem  # get the driver name excluding all directories and extensions
-                            sys.path.append(problem.driverabspath) # add path to sys
-                            module = importlib.import_module(modulename) # import driver name as a module
-                            cst = getattr(module, cstname)
-                        else:
-                            raise Exception('the driverabspath is required for the constraints')        
-                    kwargs2 = {}
-                    sig = inspect.signature(cst)
-                    for varname in point:
-                        if (varname in sig.parameters):
-                            kwargs2[varname] = point[varname]
-                    cond = cst(**kwargs2)
-                except Exception as inst:
-                    if (isinstance(inst, TypeError)):
-                        lst = inst.__str__().split()
-                        if (len(lst) >= 5 and lst[1] == 'missing' and lst[3] == 'required' and lst[4] == 'positional'):
-                            pass
-                        else:
-                            raise Exception(f"Unexpected exception '{inst}' was raised while evaluating constraint '{cstname}'. Correct this constraint before calling the tuner again.")
-                    else:
-                        raise Exception(f"Unexpected exception '{inst}' was raised while evaluating constraint '{cstname}'. Correct this constraint before calling the tuner again.")
+        for idx in range(len(cc.names)):
+            cond_ = cc.evaluate_one(idx, point, inputs_only)
+            if (cond_ is not None):
+                cond = cond_
             if (not cond):
                 break
 
         return cond
 
+    def evaluate_constraints_batch(self, problem, columns : dict, point : dict = None, inputs_only : bool = False, **kwargs):  # columns and point are in the original spaces
+
+        """
+        Evaluate the constraints on a batch of points and return a boolean mask.
+        columns maps each varying parameter name to the list of its values (one per point), point holds the values shared by all the points.
+        String constraints are evaluated once on whole NumPy columns, the ones that cannot be vectorized (and the callables) point by point.
+        """
+
+        n = len(next(iter(columns.values()))) if len(columns) > 0 else 1
+        namespace = {}
+        for (name, values) in columns.items():
+            arr = np.asarray(values)
+            if (arr.dtype.kind != 'f'):   # keep the python semantics of integers (no overflow) and strings
+                arr = np.empty(n, dtype=object)
+                arr[:] = list(values)
+            namespace[name] = arr
+        if (point is not None):
+            namespace.update(point)
+        if(problem.constants is not None):
+            namespace.update(problem.constants)
+
+        cc = self.constraints_of(problem)
+        mask = np.ones(n, dtype=bool)
+        for idx in range(len(cc.names)):
+            if (not mask.any()):
+                break
+            cond = None
+            if (cc.is_string(idx)):
+                try:
+                    if (cc.vectorizable(idx, namespace)):
+                        with np.errstate(divide='raise', invalid='raise'):   # e.g. a division by zero goes point by point, to fail or raise as for a single point
+                            cond = eval(cc.code(idx), {}, dict(namespace))
+                        if (set(cc.code(idx).co_names) & set(columns)):
+                            if (not isinstance(cond, np.ndarray) or cond.shape != (n,)):
+                                raise Exception("not a column")
+                            cond = cond.astype(bool)
+                        else:   # only involves the shared values
+                            cond = np.full(n, bool(cond))
+                except Exception:
+                    cond = None
+            if (cond is None):   # point by point on the remaining candidates
+                cond = np.zeros(n, dtype=bool)
+                for i in np.nonzero(mask)[0]:
+                    point_i = {name: columns[name][i] for name in columns}
+                    if (point is not None):
+                        point_i.update(point)
+                    if(problem.constants is not None):
+                        point_i.update(problem.constants)
+                    cond_ = cc.evaluate_one(idx, point_i, inputs_only)
+                    cond[i] = True if cond_ is None else bool(cond_)
+            mask = mask & cond
+
+        return mask
+
 
     def evaluate_objective(self, problem : Problem, I : np.ndarray = None, P : Collection[np.ndarray] = None, D: Collection[dict] = None, history_db : HistoryDB = None, options: dict=None, is_pilot = False): # P and I are in the normalized space
 
@@ -153,6 +295,9 @@ class Computer(object):
                             modeling = modeling,\
                             model_class = options["model_class"])
 
+        if history_db is not None:
+            history_db.flush_func_eval()
+
         if (options['verbose'] == True):
             tt2 = time.time_ns()
             time_mla = (tt2-tt1)/1e9
@@ -227,6 +372,9 @@ class Computer(object):
                                 modeling = modeling,\
                                 model_class = options["model_class"])
 
+        if history_db is not None:
+            history_db.flush_func_eval()
+
         if(options['RCI_mode']==True):
             print('RCI: GPTune returns\n')
             exit()
@@ -235,6 +383,9 @@ class Computer(object):
 
     def evaluate_objective_onetask(self, problem : Problem, pids : Collection[int] = None, i_am_manager : bool = True, T2 : np.ndarray=None, P2 : np.ndarray=None, D2 : dict=None, history_db : HistoryDB=None, options:dict=None, is_pilot=False):  # T2 and P2 are in the normalized space
 
+        if (options['RCI_server'] is not None and i_am_manager):
+            return self.evaluate_objective_rci_server(problem=problem, pids=pids, T2=T2, P2=P2, D2=D2, history_db=history_db, options=options, is_pilot=is_pilot)
+
         I_orig = problem.IS.inverse_transform(np.array(T2, ndmin=2))[0]
 
         if(problem.driverabspath is not None and options['distributed_memory_parallelism']):
@@ -432,6 +583,96 @@ class Computer(object):
 
                 O2.append(o_eval)
 
+        if history_db is not None:
+            history_db.flush_func_eval()
+
+        return O2
+
+    def evaluate_objective_rci_server(self, problem : Problem, pids : Collection[int] = None, T2 : np.ndarray=None, P2 : np.ndarray=None, D2 : dict=None, history_db : HistoryDB=None, options:dict=None, is_pilot=False):  # T2 and P2 are in the normalized space
+
+        """
+        Evaluate the samples through the RCI driver script connected to options['RCI_server'] (see rci.py).
+        The GPTune process stays alive between samples, so its data, models and searcher are kept in memory.
+        """
+
+        from rci import RCIServer
+
+        if (self.rci_server is None or self.rci_server.socket_path != os.path.abspath(options['RCI_server'])):
+            if (self.rci_server is not None):
+                self.rci_server.close()
+            self.rci_server = RCIServer(options['RCI_server'], point_timeout=options['RCI_server_point_timeout'])
+
+        I_orig = problem.IS.inverse_transform(np.array(T2, ndmin=2))[0]
+        task_parameter = {problem.IS[k].name: I_orig[k] for k in range(problem.DI)}
+
+        if (pids is None):
+            pids = list(range(len(P2)))
+
+        points = []
+        for j in pids:
+            x_orig = problem.PS.inverse_transform(np.array(P2[j], ndmin=2))[0]
+            constants = {}
+            if(problem.constants is not None):
+                constants.update(problem.constants)
+            if D2 is not None:
+                constants.update(D2)
+            points.append(json.loads(json.dumps({"task_parameter": task_parameter,
+                "tuning_parameter": {problem.PS[k].name: x_orig[k] for k in range(problem.DP)},
+                "constants": constants}, default=lambda x: x.item() if isinstance(x, np.generic) else str(x))))
+
+        results = self.rci_server.evaluate(points, objective_names = [problem.OS[k].name for k in range(problem.DO)])
+
+        O2=[]
+        for j, result in zip(pids, results):
+            o = [result["evaluation_result"][problem.OS[k].name] for k in range(problem.DO)]
+            o_eval = []
+            for i in range(len(o)):
+                if type(o[i]) == type([]):
+                    o_eval.append(np.average(o[i]))
+                else:
+                    o_eval.append(o[i])
+            o_detail = o
+
+            if history_db is not None:
+                if is_pilot == True:
+                    modeling = "Pilot"
+                else:
+                    if options["TLA_method"] == None:
+                        if problem.DI == 1:
+                            modeling = "SLA_GP"
+                        elif problem.DI > 1:
+                            modeling = "MLA_LCM"
+                    elif options["TLA_method"] == "Regression":
+                        modeling = "TLA_RegressionSum"
+                    elif options["TLA_method"] == "Sum":
+                        modeling = "TLA_Sum"
+                    elif options["TLA_method"] == "Stacking":
+                        modeling = "TLA_Stacking"
+                    elif options["TLA_method"] == "LCM_BF":
+                        modeling = "TLA_LCM_BF"
+                    elif options["TLA_method"] == "LCM":
+                        modeling = "TLA_LCM"
+                    else:
+                        if problem.DI == 1:
+                            modeling = "SLA_GP"
+                        elif problem.DI > 1:
+                            modeling = "MLA_LCM"
+
+                history_db.store_func_eval(problem = problem,\
+                        task_parameter = T2, \
+                        tuning_parameter = [P2[j]],\
+                        evaluation_result = [o_eval], \
+                        evaluation_detail = [o_detail], \
+                        additional_output = result["additional_output"],
+                        source = "measure",\
+                        modeling = modeling,\
+                        model_class = options["model_class"])
+
+            O2.append(o_eval)
+
+        if history_db is not None:
+            history_db.flush_func_eval()
+
         return O2
 
     def model_predict_objective_onetask(self, problem : Problem, pids : Collection[int] = None, i_am_manager : bool = True, T2 : np.ndarray=None, P2 : np.ndarray=None, D2 : dict=None, history_db : HistoryDB=None, options:dict=None, model_transfer:list=None, source:str="model"):  # T2 and P2 are in the normalized space
@@ -530,6 +771,9 @@ class Computer(object):
 
                 O2.append(o_eval)
 
+        if history_db is not None:
+            history_db.flush_func_eval()
+
         return O2
 
 
@@ -556,6 +800,34 @@ class Computer(object):
         # print('manager',process_rank, process_count, process_host)
         return comm
 
+    def spawn_pool(self, executable, nproc, nthreads, npernode=None, args=None, kwargs=None):
+
+        """
+        Return a pool of workers spawned once per session and reused by later calls with the same layout.
+        The pool is a dict with the intercommunicator 'comm' and a 'state' entry the caller can use to remember what the workers currently hold (e.g. the training data).
+        The workers are expected to loop over (command, payload) broadcasts and to exit on ("shutdown", None).
+        """
+
+        key = (executable, nproc, nthreads, npernode, args)
+        if (key not in self.worker_pools):
+            comm = self.spawn(executable, nproc, nthreads, npernode=npernode, args=args, kwargs=kwargs)
+            self.worker_pools[key] = {'comm': comm, 'state': None}
+            if (self.worker_pools_atexit == False):
+                atexit.register(self.shutdown_pools)
+                self.worker_pools_atexit = True
+
+        return self.worker_pools[key]
+
+    def shutdown_pools(self):
+
+        import mpi4py
+        from mpi4py import MPI
+
+        for key in list(self.worker_pools.keys()):
+            comm = self.worker_pools.pop(key)['comm']
+            _ = comm.bcast(("shutdown", None), root=mpi4py.MPI.ROOT)
+            comm.Disconnect()
+
 
 if __name__ == '__main__':
     import mpi4py
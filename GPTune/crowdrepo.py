@@ -0,0 +1,348 @@
+# GPTune Copyright (c) 2019, The Regents of the University of California,
+# through Lawrence Berkeley National Laboratory (subject to receipt of any
+# required approvals from the U.S.Dept. of Energy) and the University of
+# California, Berkeley.  All rights reserved.
+#
+# If you have questions about your rights to use or distribute this software,
+# please contact Berkeley Lab's Intellectual Property Office at IPO@lbl.gov.
+#
+# NOTICE. This Software was developed under funding from the U.S. Department
+# of Energy and the U.S. Government consequently retains certain rights.
+# As such, the U.S. Government has been granted for itself and others acting
+# on its behalf a paid-up, nonexclusive, irrevocable, worldwide license in
+# the Software to reproduce, distribute copies to the public, prepare
+# derivative works, and perform publicly and display publicly, and to permit
+# other to do so.
+#
+
+# Communication with the GPTune crowd repository (https://gptune.lbl.gov/repo/)
+
+import json
+import os
+import time
+import random
+import threading
+import queue
+import socket
+import glob
+import atexit
+
+def process_is_alive(hostname, pid):
+    """ False only if the process is known to be gone; processes on other hosts are assumed alive """
+    if hostname != socket.gethostname():
+        return True
+    try:
+        os.kill(int(pid), 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except:
+        return True
+
+class CrowdUploadQueue(object):
+    """ Uploads function evaluation documents to the crowd repository from a background thread, so that a slow or
+        unreachable repository does not stall tuning.
+
+        Every document is first appended to a spill journal (<spill_prefix>.<host>.<pid>.upload) and marked there once
+        uploaded; documents that a previous run could not upload are picked up from the journals of dead processes.
+        Only queue_size documents are kept in memory; the rest are read back from the journal when the queue has drained. """
+
+    def __init__(self, upload_url, api_key, tuning_problem_name, tuning_problem_category, spill_prefix,
+            queue_size=1024, batch_size=1, timeout=30, max_retries=5, backoff=1.0, verify=False):
+        self.upload_url = upload_url
+        self.api_key = api_key
+        self.tuning_problem_name = tuning_problem_name
+        self.tuning_problem_category = tuning_problem_category
+        self.batch_size = batch_size # documents per request; the repository accepts a list when batch_size > 1
+        self.timeout = timeout # seconds per request
+        self.max_retries = max_retries
+        self.backoff = backoff # seconds before the first retry; doubled at every retry
+        self.verify = verify
+
+        self.spill_prefix = spill_prefix
+        self.spill_path = spill_prefix + "." + socket.gethostname() + "." + str(os.getpid()) + ".upload"
+        self.spill_lock = threading.Lock()
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.overflowed = False # some spilled documents are not in the queue
+        self.queued_uids = set() # documents in the queue or being uploaded
+        self.finished = threading.Condition()
+        self.stopping = False
+
+        self.num_uploaded = 0
+        self.num_failed_requests = 0
+
+        self.recover_spill_journals()
+
+        self.thread = threading.Thread(target=self.run, name="crowd-upload", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write_spill_journal(self, lines):
+        # the caller holds spill_lock
+        with open(self.spill_path, "a") as f_out:
+            f_out.write("".join([json.dumps(line) + "\n" for line in lines]))
+            f_out.flush()
+            os.fsync(f_out.fileno())
+
+    def remove_spill_journal(self):
+        """ Drop the spill journal once everything in it has been uploaded """
+        with self.spill_lock:
+            with self.finished:
+                if len(self.queued_uids) == 0 and not self.overflowed and os.path.exists(self.spill_path):
+                    os.remove(self.spill_path)
+
+    def read_spill_journal(self, spill_path):
+        """ Documents of a spill journal that have not been uploaded yet """
+        documents = {}
+        with open(spill_path, "r") as f_in:
+            for line in f_in:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue # torn line
+                if "document" in record:
+                    documents[record["document"]["uid"]] = record["document"]
+                elif "uploaded" in record:
+                    for uid in record["uploaded"]:
+                        documents.pop(uid, None)
+        return list(documents.values())
+
+    def recover_spill_journals(self):
+        """ Take over the not yet uploaded documents left by processes that are gone """
+        prefix = self.spill_prefix + "."
+        # a journal being taken over is renamed to <prefix>.<host>.<pid>.claimed.upload (host and pid of the claiming process),
+        # so that a claim left by a process killed in the middle is taken over in turn
+        claimed_path = self.spill_path[:-len(".upload")] + ".claimed.upload"
+        for spill_path in glob.glob(prefix + "*.upload"):
+            if spill_path == self.spill_path or spill_path == claimed_path:
+                continue
+            writer = spill_path[len(prefix):-len(".upload")]
+            if writer.endswith(".claimed"):
+                writer = writer[:-len(".claimed")]
+            hostname, pid = writer.rsplit(".", 1)
+            if process_is_alive(hostname, pid):
+                continue
+            try:
+                os.rename(spill_path, claimed_path)
+            except OSError:
+                continue # another process got it
+            documents = self.read_spill_journal(claimed_path)
+            if len(documents) > 0:
+                print ("[CrowdUpload] Resume uploading " + str(len(documents)) + " function evaluations")
+                self.put(documents) # in our own journal before the claimed one is removed
+            os.remove(claimed_path)
+
+    def put(self, documents):
+        """ Queue documents for upload; returns immediately """
+        if len(documents) == 0:
+            return
+        with self.spill_lock:
+            self.write_spill_journal([{"document":document} for document in documents])
+            self.enqueue(documents)
+
+    def enqueue(self, documents):
+        for document in documents:
+            with self.finished:
+                if document["uid"] in self.queued_uids:
+                    continue
+                try:
+                    self.queue.put_nowait(document)
+                    self.queued_uids.add(document["uid"])
+                except queue.Full:
+                    self.overflowed = True
+                    return
+
+    def post(self, documents):
+        import requests
+
+        if self.batch_size > 1:
+            data = {"tuning_problem_name":self.tuning_problem_name,
+                "tuning_problem_category":self.tuning_problem_category,
+                "function_evaluation_documents":json.dumps(documents)}
+        else:
+            data = {"tuning_problem_name":self.tuning_problem_name,
+                "tuning_problem_category":self.tuning_problem_category,
+                "function_evaluation_document":json.dumps(documents[0])}
+        r = self.session.post(url = self.upload_url,
+                headers={"x-api-key":self.api_key},
+                data=data,
+                timeout=self.timeout,
+                verify=self.verify)
+        if r.status_code != 200:
+            raise Exception(f"request status_code: {r.status_code}")
+
+    def upload(self, documents):
+        """ Upload one batch, retrying with exponential backoff; returns whether it went through """
+        for retry in range(self.max_retries):
+            try:
+                self.post(documents)
+                return True
+            except Exception as e:
+                self.num_failed_requests += 1
+                if retry == self.max_retries - 1 or self.stopping:
+                    print ("[CrowdUpload] direct upload failed: " + str(e))
+                    return False
+                delay = self.backoff * (2 ** retry)
+                time.sleep(delay + random.uniform(0, delay))
+        return False
+
+    def run(self):
+        import requests
+
+        self.session = requests.Session() # keep the connection open between requests
+        while True:
+            try:
+                documents = [self.queue.get(timeout=1.0)]
+            except queue.Empty:
+                if self.stopping:
+                    return
+                if self.overflowed:
+                    self.refill()
+                else:
+                    self.remove_spill_journal()
+                continue
+            while len(documents) < self.batch_size:
+                try:
+                    documents.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            if self.upload(documents):
+                with self.spill_lock:
+                    self.write_spill_journal([{"uploaded":[document["uid"] for document in documents]}])
+                self.num_uploaded += len(documents)
+            else:
+                # leave them in the spill journal; they are retried once the queue has drained, or by the next run
+                self.overflowed = True
+            with self.finished:
+                self.queued_uids.difference_update([document["uid"] for document in documents])
+                self.finished.notify_all()
+            if self.stopping and self.overflowed:
+                return # the repository is not reachable; do not hold up the exit
+
+    def refill(self):
+        """ Queue again the spilled documents that are neither uploaded nor queued """
+        self.overflowed = False
+        with self.spill_lock:
+            if not os.path.exists(self.spill_path):
+                return
+            documents = self.read_spill_journal(self.spill_path)
+        self.enqueue(documents)
+
+    def flush(self, timeout=None):
+        """ Wait until every queued document has been tried; returns whether the queue is empty """
+        deadline = None if timeout == None else time.time() + timeout
+        with self.finished:
+            while len(self.queued_uids) > 0 and self.thread.is_alive():
+                remaining = None if deadline == None else deadline - time.time()
+                if remaining != None and remaining <= 0:
+                    break
+                self.finished.wait(remaining)
+            return len(self.queued_uids) == 0
+
+    def close(self, timeout=10):
+        """ Give pending uploads a little time, then stop; whatever is left stays in the spill journal """
+        if not self.thread.is_alive():
+            return
+        self.flush(timeout)
+        self.stopping = True
+        self.thread.join(timeout)
+        self.remove_spill_journal()
+
+def function_evaluation_timestamp(document):
+    """ Storing time of a function evaluation document as "YYYY-MM-DD HH:MM:SS", or None """
+    if "time" not in document:
+        return None
+    t = document["time"]
+    try:
+        return "%04d-%02d-%02d %02d:%02d:%02d" % (t["tm_year"], t["tm_mon"], t["tm_mday"], t["tm_hour"], t["tm_min"], t["tm_sec"])
+    except (KeyError, TypeError):
+        return None
+
+class CrowdDownloadCache(object):
+    """ Local copy of the function evaluations downloaded from the crowd repository, one file per query in cache_path
+        (<tuning_problem_name>.crowd.<hash of the download url and query>.json). HistoryDB (query by tuning problem name
+        and category) and crowdtune (query by tuning problem name and spaces) keep their files in the same directory, but
+        since they send different queries they do not share entries.
+
+        Each file keeps a sync cursor (last seen uid and timestamp, and the ETag of the last response). A download asks
+        only for newer records (since_uid/since_time, If-None-Match), merges the reply by uid, and is skipped entirely
+        while the copy is younger than ttl seconds. The cursor moves on when the file is written, so callers that copy
+        the records elsewhere (e.g. into a HistoryDB) should merge the whole cached list by uid, not only the new records. """
+
+    def __init__(self, cache_path, download_url, api_key, ttl=600, timeout=30, verify=False):
+        self.cache_path = cache_path
+        self.download_url = download_url
+        self.api_key = api_key
+        self.ttl = ttl
+        self.timeout = timeout
+        self.verify = verify
+
+    def query_path(self, params):
+        import hashlib
+
+        query_key = hashlib.sha256(json.dumps([self.download_url, params], sort_keys=True).encode()).hexdigest()[:16]
+        return self.cache_path + "/" + str(params.get("tuning_problem_name")) + ".crowd." + query_key + ".json"
+
+    def read(self, params):
+        try:
+            with open(self.query_path(params), "r") as f_in:
+                return json.load(f_in)
+        except (OSError, ValueError):
+            return {"cursor":{"uid":None, "time":None, "etag":None}, "fetched_at":0, "perf_data":[]}
+
+    def write(self, params, cached):
+        os.makedirs(self.cache_path, exist_ok=True)
+        query_path = self.query_path(params)
+        temp_path = query_path + "." + socket.gethostname() + "." + str(os.getpid()) + ".temp"
+        with open(temp_path, "w") as f_out:
+            json.dump(cached, f_out)
+        os.replace(temp_path, query_path)
+
+    def download(self, params):
+        """ (all cached function evaluations of the query, the ones that are new since the last download) """
+        import requests
+
+        cached = self.read(params)
+        if time.time() - cached["fetched_at"] < self.ttl:
+            return (cached["perf_data"], [])
+
+        request_params = dict(params)
+        if cached["cursor"]["uid"] != None:
+            request_params["since_uid"] = cached["cursor"]["uid"]
+        if cached["cursor"]["time"] != None:
+            request_params["since_time"] = cached["cursor"]["time"]
+        headers = {"x-api-key":self.api_key}
+        if cached["cursor"]["etag"] != None:
+            headers["If-None-Match"] = cached["cursor"]["etag"]
+
+        r = requests.get(url = self.download_url,
+                headers=headers,
+                params=request_params,
+                timeout=self.timeout,
+                verify=self.verify)
+
+        new_documents = []
+        if r.status_code == 200:
+            # a repository that ignores the cursor sends everything again; keep what we do not have yet
+            known_uids = set([document.get("uid") for document in cached["perf_data"]])
+            for document in json.loads(r.text)["perf_data"]:
+                if "uid" in document and document["uid"] in known_uids:
+                    continue
+                known_uids.add(document.get("uid"))
+                new_documents.append(document)
+            cached["perf_data"] = cached["perf_data"] + new_documents
+            if len(new_documents) > 0:
+                cached["cursor"]["uid"] = new_documents[-1].get("uid")
+                timestamps = [timestamp for timestamp in [function_evaluation_timestamp(document) for document in new_documents] if timestamp != None]
+                if len(timestamps) > 0:
+                    cached["cursor"]["time"] = max(timestamps + ([cached["cursor"]["time"]] if cached["cursor"]["time"] != None else []))
+            cached["cursor"]["etag"] = r.headers.get("ETag")
+        elif r.status_code != 304: # 304: nothing new
+            raise Exception(f"request status_code: {r.status_code}")
+
+        cached["fetched_at"] = time.time()
+        self.write(params, cached)
+
+        return (cached["perf_data"], new_documents)
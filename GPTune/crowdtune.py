@@ -20,10 +20,12 @@
 def QueryFunctionEvaluations(api_key:str=None,
         tuning_problem_name:str=None,
         problem_space:dict={},
-        configuration_space:dict={}):
+        configuration_space:dict={},
+        cache_path:str="./gptune.db",
+        ttl:float=600):
 
-    import requests
     import json
+    from crowdrepo import CrowdDownloadCache
 
     # GPTune history database
     crowd_repo_download_url = "http://gptune.lbl.gov/repo/direct-download/"
@@ -32,19 +34,17 @@ def QueryFunctionEvaluations(api_key:str=None,
     #crowd_repo_download_url = "http://127.0.0.1:8000/repo/direct-download/"
     #crowd_repo_upload_url = "http://127.0.0.1:8000/repo/direct-upload/"
 
-    function_evaluations_downloaded = {}
-
-    r = requests.get(url = crowd_repo_download_url,
-            headers={"x-api-key":api_key},
-            params={"tuning_problem_name":tuning_problem_name,
-                "problem_space":json.dumps(problem_space),
-                "configuration_space":json.dumps(configuration_space)},
-            verify=False)
-
-    if r.status_code == 200:
-        function_evaluations_downloaded = json.loads(r.text)["perf_data"]
-    else:
-        print ("request status_code: ", r.status_code)
+    # on-disk cache in the HistoryDB directory, next to (but, as the query differs, not shared with) the cache of HistoryDB's crowd repository synchronization
+    crowd_download_cache = CrowdDownloadCache(cache_path, crowd_repo_download_url, api_key, ttl=ttl)
+    params = {"tuning_problem_name":tuning_problem_name,
+        "problem_space":json.dumps(problem_space),
+        "configuration_space":json.dumps(configuration_space)}
+
+    try:
+        (function_evaluations_downloaded, function_evaluations_new) = crowd_download_cache.download(params)
+    except Exception as e:
+        print ("direct download failed: " + str(e))
+        function_evaluations_downloaded = crowd_download_cache.read(params)["perf_data"]
 
     return function_evaluations_downloaded
 
@@ -53,6 +53,11 @@ class Categoricalnorm(Categorical):
     def transformed_size(self):
         return 1
 
+def point_key(x_orig):
+
+    # hashable canonical form of a point in the original space, two points are duplicates iff their keys are equal
+    return tuple(v.item() if isinstance(v, np.generic) else v for v in x_orig)
+
 class Data(object):
     # To GPTune I is 2D numpy array. To user I is a list of lists
     # To GPTune P is a list/collection of 2D numpy array with column dimension corresponding to PS dimension. To user P is a list of (list of lists)
@@ -81,6 +86,8 @@ class Data(object):
 
         self.D = D
 
+        self.P_index = None  # per task: (array of P the index was built on, set of point_key of its samples in the original space)
+
     @property
     def NI(self):
 
@@ -129,6 +136,25 @@ class Data(object):
 
         pass
 
+    def parameter_index(self, tid : int):
+
+        """
+        Return the set of point_key of the samples of task tid (self.P[tid] in the normalized space).
+        The set is built once per task and extended by merge, so that duplicate checks are O(1) per candidate.
+        """
+
+        if (getattr(self, 'P_index', None) is None or len(self.P_index) != len(self.P)):
+            self.P_index = [None] * len(self.P)
+        entry = self.P_index[tid]
+        if (entry is None or entry[0] is not self.P[tid]):   # self.P was reassigned since the index was built
+            keys = set()
+            if (len(self.P[tid]) > 0):
+                keys = set(point_key(x_orig) for x_orig in self.problem.PS.inverse_transform(np.array(self.P[tid], ndmin=2)))
+            entry = (self.P[tid], keys)
+            self.P_index[tid] = entry
+
+        return entry[1]
+
     # TODO
     def merge(self, newdata):
 
@@ -140,9 +166,22 @@ class Data(object):
         if (not np.array_equal(self.D, newdata.D)):
             raise Exception("The tasks dictionaries in the newdata should be the same as the current tasks")
 
+        P_old = self.P
         self.P = [np.concatenate((self.P[i], newdata.P[i])) for i in range(len(self.P))]
         self.O = [np.concatenate((self.O[i], newdata.O[i])) for i in range(len(self.O))]
 
+        # extend the duplicate index with the new samples only
+        if (getattr(self, 'P_index', None) is not None and len(self.P_index) == len(self.P)):
+            for i in range(len(self.P)):
+                entry = self.P_index[i]
+                if (entry is not None and entry[0] is P_old[i]):
+                    keys = entry[1]
+                    if (len(newdata.P[i]) > 0):
+                        keys.update(point_key(x_orig) for x_orig in self.problem.PS.inverse_transform(np.array(newdata.P[i], ndmin=2)))
+                    self.P_index[i] = (self.P[i], keys)
+                else:
+                    self.P_index[i] = None
+
 #    def insert(I = None: np.ndarray, P = None : Collection[np.ndarray], O = None : Collection[np.ndarray]):
 #
 #        if (I is not None):
@@ -25,9 +25,19 @@ from autotune.space import *
 from autotune.problem import TuningProblem
 import uuid
 import time
-import requests
 import os
 import subprocess
+import sqlite3
+import threading
+import atexit
+import weakref
+import socket
+import glob
+import random
+import contextlib
+import shutil
+import hashlib
+from crowdrepo import CrowdUploadQueue, CrowdDownloadCache, process_is_alive
 
 def version_number_conversion(version_split):
     strings = [str(digit) for digit in version_split]
@@ -185,6 +195,558 @@ def search_item_by_uid(dict_arr, uid):
 
     return None
 
+def canonical_parameter_value(value):
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float):
+        # same precision as search_func_eval_task_id; 5.0 and 5 must give the same key
+        value = round(value, 6)
+        if value.is_integer():
+            value = int(value)
+    return value
+
+def task_parameter_key(task_parameter : dict):
+    """ Canonical key of a task parameter dict (tla_id is internal and never part of the key) """
+    return json.dumps([[name, canonical_parameter_value(task_parameter[name])] for name in sorted(task_parameter.keys()) if name != "tla_id"])
+
+HISTORY_SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history_meta (
+    key TEXT PRIMARY KEY,
+    value TEXT);
+CREATE TABLE IF NOT EXISTS func_eval (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT UNIQUE,
+    tuning_problem_name TEXT,
+    task_key TEXT,
+    modeling TEXT,
+    model_class TEXT,
+    machine_configuration TEXT,
+    software_configuration TEXT,
+    document TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS func_eval_task ON func_eval (tuning_problem_name, task_key);
+CREATE INDEX IF NOT EXISTS func_eval_modeling ON func_eval (modeling, model_class);
+CREATE INDEX IF NOT EXISTS func_eval_configuration ON func_eval (machine_configuration, software_configuration);
+CREATE TABLE IF NOT EXISTS surrogate_model (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    uid TEXT UNIQUE,
+    objective_id INTEGER,
+    modeler TEXT,
+    log_likelihood REAL,
+    num_evals INTEGER,
+    document TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS surrogate_model_objective ON surrogate_model (objective_id, modeler);
+"""
+
+def is_sqlite_file(json_data_path):
+    return json_data_path.endswith(".sqlite") or ".sqlite." in os.path.basename(json_data_path)
+
+def connect_sqlite_file(sqlite_path):
+    # SQLite's own file locking serializes concurrent writers (MPI ranks, RCI processes); wait instead of failing
+    conn = sqlite3.connect(sqlite_path, timeout=600)
+    conn.executescript(HISTORY_SQLITE_SCHEMA)
+    return conn
+
+def insert_sqlite_documents(conn, key, documents, tuning_problem_name=None):
+    if key == "func_eval":
+        rows = [(document.get("uid"),
+            tuning_problem_name,
+            task_parameter_key(document["task_parameter"]) if "task_parameter" in document else None,
+            document.get("modeling"),
+            document.get("model_class"),
+            json.dumps(document.get("machine_configuration"), sort_keys=True),
+            json.dumps(document.get("software_configuration"), sort_keys=True),
+            json.dumps(document)) for document in documents]
+        conn.executemany("INSERT OR IGNORE INTO func_eval (uid, tuning_problem_name, task_key, modeling, model_class, machine_configuration, software_configuration, document) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    elif key == "surrogate_model":
+        rows = [(document.get("uid"),
+            document["objective"]["objective_id"] if "objective" in document else None,
+            document.get("modeler"),
+            surrogate_model_log_likelihood(document),
+            surrogate_model_num_evals(document),
+            json.dumps(document)) for document in documents]
+        conn.executemany("INSERT OR IGNORE INTO surrogate_model (uid, objective_id, modeler, log_likelihood, num_evals, document) VALUES (?, ?, ?, ?, ?, ?)", rows)
+    else:
+        raise Exception(f"unknown history record type: {key}")
+
+def surrogate_model_log_likelihood(surrogate_model : dict):
+    if "model_stats" in surrogate_model and "log_likelihood" in surrogate_model["model_stats"]:
+        return surrogate_model["model_stats"]["log_likelihood"]
+    return surrogate_model.get("log_likelihood")
+
+def surrogate_model_num_evals(surrogate_model : dict):
+    if "function_evaluations" in surrogate_model:
+        # models stored before evaluation ranges were introduced list every uid
+        return len(surrogate_model["function_evaluations"])
+    return sum([evaluation_range["stop"] - evaluation_range["start"] for evaluation_range in surrogate_model.get("function_evaluation_ranges", [])])
+
+def surrogate_model_index_entry(surrogate_model : dict, digest : str):
+    """ What the model selectors need to know about a stored surrogate model; the model itself is read only once selected """
+    return {"uid":surrogate_model.get("uid"),
+        "digest":digest,
+        "modeler":surrogate_model.get("modeler"),
+        "objective_id":surrogate_model["objective"]["objective_id"] if "objective" in surrogate_model else None,
+        "log_likelihood":surrogate_model_log_likelihood(surrogate_model),
+        "num_hyperparameters":len(surrogate_model.get("hyperparameters", [])),
+        "num_evals":surrogate_model_num_evals(surrogate_model),
+        "num_samples":surrogate_model.get("num_samples"),
+        "task_parameters":surrogate_model.get("task_parameters"),
+        "input_space":surrogate_model.get("input_space"),
+        "parameter_space":surrogate_model.get("parameter_space"),
+        "output_space":surrogate_model.get("output_space")}
+
+def write_surrogate_model_file(store_path, surrogate_model : dict):
+    """ Write a surrogate model to <store_path>/<sha256 of its canonical JSON>.json and return the digest.
+        The file is never modified afterwards, so an existing file with the same name is kept as is. """
+    text = json.dumps(surrogate_model, sort_keys=True)
+    digest = hashlib.sha256(text.encode()).hexdigest()
+    model_path = store_path + "/" + digest + ".json"
+    if not os.path.exists(model_path):
+        temp_path = model_path + "." + str(uuid.uuid1()) + ".temp"
+        with open(temp_path, "w") as f_out:
+            f_out.write(text)
+        os.replace(temp_path, model_path)
+    return digest
+
+def iterate_journal_file(jsonl_path):
+    """ Stream (record type, document) pairs from a JSON-lines history journal """
+    with open(jsonl_path, "r") as f_in:
+        for line in f_in:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # a torn line left by an interrupted append; the rest of the journal is still valid
+                print ("[HistoryDB Warning] skip a corrupted line in " + jsonl_path)
+                continue
+            yield (record["record"], record["document"])
+
+def read_journal_file(jsonl_path, offset=0):
+    """ Parse the complete lines of a JSON-lines history journal starting at a byte offset;
+        returns the (record type, document) pairs and the offset after the last complete line """
+    records = []
+    with open(jsonl_path, "rb") as f_in:
+        f_in.seek(offset)
+        for line in f_in:
+            if not line.endswith(b"\n"):
+                break # still being appended; the next read picks it up
+            offset += len(line)
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                print ("[HistoryDB Warning] skip a corrupted line in " + jsonl_path)
+                continue
+            records.append((record["record"], record["document"]))
+    return (records, offset)
+
+def is_journal_file(json_data_path):
+    # temporary copies keep the journal suffix, e.g. <problem>.jsonl.<uid>.temp
+    return json_data_path.endswith(".jsonl") or ".jsonl." in os.path.basename(json_data_path)
+
+def read_history_file(json_data_path):
+    if is_sqlite_file(json_data_path):
+        history_data = {"tuning_problem_name":None,
+            "tuning_problem_category":None,
+            "surrogate_model":[],
+            "func_eval":[]}
+        conn = connect_sqlite_file(json_data_path)
+        try:
+            for key, value in conn.execute("SELECT key, value FROM history_meta"):
+                history_data[key] = json.loads(value)
+            history_data["func_eval"] = [json.loads(row[0]) for row in conn.execute("SELECT document FROM func_eval ORDER BY seq")]
+            history_data["surrogate_model"] = [json.loads(row[0]) for row in conn.execute("SELECT document FROM surrogate_model ORDER BY seq")]
+        finally:
+            conn.close()
+        return history_data
+    elif is_journal_file(json_data_path):
+        history_data = {"tuning_problem_name":None,
+            "tuning_problem_category":None,
+            "surrogate_model":[],
+            "func_eval":[]}
+        for record_type, document in iterate_journal_file(json_data_path):
+            if record_type == "header":
+                history_data["tuning_problem_name"] = document["tuning_problem_name"]
+                history_data["tuning_problem_category"] = document["tuning_problem_category"]
+            else:
+                history_data[record_type].append(document)
+        return history_data
+    else:
+        with open(json_data_path, "r") as f_in:
+            return json.load(f_in)
+
+""" Process-level cache of parsed history database files: path -> {"fingerprint", "offset", "history_data"} """
+history_file_cache = {}
+
+def history_file_fingerprint(json_data_path):
+    st = os.stat(json_data_path)
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def read_history_file_cached(json_data_path):
+    """ read_history_file, cached on the file fingerprint (mtime, size, inode). An appended journal or SQLite database
+        is refreshed by parsing only the records added since the last read. The returned document is shared; do not modify it. """
+    fingerprint = history_file_fingerprint(json_data_path)
+    cached = history_file_cache.get(json_data_path)
+    if cached != None and cached["fingerprint"] == fingerprint:
+        return cached["history_data"]
+
+    history_data = None
+    if cached != None and cached["offset"] != None and cached["fingerprint"][2] == fingerprint[2]:
+        if is_journal_file(json_data_path) and cached["fingerprint"][1] <= fingerprint[1]:
+            records, offset = read_journal_file(json_data_path, cached["offset"])
+            history_data = dict(cached["history_data"])
+            history_data["func_eval"] = history_data["func_eval"] + [document for record_type, document in records if record_type == "func_eval"]
+            history_data["surrogate_model"] = history_data["surrogate_model"] + [document for record_type, document in records if record_type == "surrogate_model"]
+        elif is_sqlite_file(json_data_path):
+            # rows are never deleted or renumbered, so the new ones are those after the last seq we have seen
+            func_eval_seq, surrogate_model_seq = cached["offset"]
+            conn = connect_sqlite_file(json_data_path)
+            try:
+                func_eval_rows = list(conn.execute("SELECT seq, document FROM func_eval WHERE seq > ? ORDER BY seq", (func_eval_seq,)))
+                surrogate_model_rows = list(conn.execute("SELECT seq, document FROM surrogate_model WHERE seq > ? ORDER BY seq", (surrogate_model_seq,)))
+            finally:
+                conn.close()
+            history_data = dict(cached["history_data"])
+            history_data["func_eval"] = history_data["func_eval"] + [json.loads(row[1]) for row in func_eval_rows]
+            history_data["surrogate_model"] = history_data["surrogate_model"] + [json.loads(row[1]) for row in surrogate_model_rows]
+            offset = (func_eval_rows[-1][0] if len(func_eval_rows) > 0 else func_eval_seq,
+                surrogate_model_rows[-1][0] if len(surrogate_model_rows) > 0 else surrogate_model_seq)
+
+    if history_data == None:
+        if is_journal_file(json_data_path):
+            history_data = {"tuning_problem_name":None,
+                "tuning_problem_category":None,
+                "surrogate_model":[],
+                "func_eval":[]}
+            records, offset = read_journal_file(json_data_path)
+            for record_type, document in records:
+                if record_type == "header":
+                    history_data["tuning_problem_name"] = document["tuning_problem_name"]
+                    history_data["tuning_problem_category"] = document["tuning_problem_category"]
+                else:
+                    history_data[record_type].append(document)
+        elif is_sqlite_file(json_data_path):
+            history_data = read_history_file(json_data_path)
+            conn = connect_sqlite_file(json_data_path)
+            try:
+                offset = (conn.execute("SELECT IFNULL(MAX(seq), 0) FROM func_eval").fetchone()[0],
+                    conn.execute("SELECT IFNULL(MAX(seq), 0) FROM surrogate_model").fetchone()[0])
+            finally:
+                conn.close()
+        else:
+            history_data = read_history_file(json_data_path)
+            offset = None
+
+    history_file_cache[json_data_path] = {"fingerprint":fingerprint, "offset":offset, "history_data":history_data}
+
+    return history_data
+
+def journal_lines(history_data):
+    lines = [json.dumps({"record":"header", "document":{
+        "tuning_problem_name":history_data["tuning_problem_name"],
+        "tuning_problem_category":history_data["tuning_problem_category"]}})]
+    for key in ["func_eval", "surrogate_model"]:
+        for document in history_data[key]:
+            lines.append(json.dumps({"record":key, "document":document}))
+    return "\n".join(lines) + "\n"
+
+def write_history_file(json_data_path, history_data):
+    """ Write a whole history database; JSON documents and journals are written to a temporary file and renamed
+        over the destination, so concurrent readers see either the old or the new file, never a partial one """
+    if is_sqlite_file(json_data_path):
+        conn = connect_sqlite_file(json_data_path)
+        try:
+            with conn:
+                for key in ["tuning_problem_name", "tuning_problem_category"]:
+                    conn.execute("INSERT OR REPLACE INTO history_meta (key, value) VALUES (?, ?)", (key, json.dumps(history_data[key])))
+                insert_sqlite_documents(conn, "func_eval", history_data["func_eval"], history_data["tuning_problem_name"])
+                insert_sqlite_documents(conn, "surrogate_model", history_data["surrogate_model"])
+        finally:
+            conn.close()
+    else:
+        temp_path = json_data_path + "." + str(uuid.uuid1()) + ".temp"
+        with open(temp_path, "w") as f_out:
+            if is_journal_file(json_data_path):
+                f_out.write(journal_lines(history_data))
+            else:
+                json.dump(history_data, f_out, indent=2)
+        os.replace(temp_path, json_data_path)
+
+def append_journal_file(jsonl_path, key, documents):
+    if len(documents) == 0:
+        return
+    text = "".join([json.dumps({"record":key, "document":document}) + "\n" for document in documents])
+    fd = os.open(jsonl_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        # start on a fresh line if a previous append was interrupted in the middle of a record
+        size = os.fstat(fd).st_size
+        if size > 0 and os.pread(fd, 1, size-1) != b"\n":
+            text = "\n" + text
+        os.write(fd, text.encode())
+    finally:
+        os.close(fd)
+
+def compact_journal_file(jsonl_path):
+    history_data = read_history_file(jsonl_path)
+    for key in ["func_eval", "surrogate_model"]:
+        uids = set()
+        documents = []
+        for document in history_data[key]:
+            if "uid" in document:
+                if document["uid"] in uids:
+                    continue
+                uids.add(document["uid"])
+            documents.append(document)
+        history_data[key] = documents
+    write_history_file(jsonl_path, history_data)
+
+def convert_history_file(src_path, dst_path):
+    """ Convert a history database between the single-document (.json), JSON-lines journal (.jsonl) and SQLite (.sqlite) formats """
+    history_data = read_history_file(src_path)
+    if history_data["tuning_problem_name"] is None:
+        history_data["tuning_problem_name"] = os.path.basename(src_path).split(".")[0]
+    write_history_file(dst_path, history_data)
+
+def func_eval_column_values(func_eval : dict):
+    """ Flat {column name: value} view of a function evaluation, as stored by ColumnarMirror """
+    values = {}
+    for group in ["task_parameter", "tuning_parameter", "evaluation_result"]:
+        for name, value in func_eval.get(group, {}).items():
+            values[group+"/"+name] = value
+    values["modeling"] = func_eval.get("modeling")
+    values["model_class"] = func_eval.get("model_class")
+    # check_load_deps only looks at these two, so it can be evaluated once per distinct configuration
+    values["configuration"] = json.dumps({key:func_eval[key] for key in ["machine_configuration", "software_configuration"] if key in func_eval}, sort_keys=True)
+    return values
+
+def column_isin(columns : dict, name : str, values : list, count : int):
+    """ Mask of the records whose categorical column is one of the values """
+    if name not in columns or columns[name][0]["kind"] != "categorical":
+        return np.zeros(count, dtype=bool)
+    column, array = columns[name]
+    return np.isin(array, [code for code, category in enumerate(column["categories"]) if category in values])
+
+class ColumnarMirror(object):
+    """ Column-wise binary copy of the func_eval records of a history database, kept in <database>.columns/.
+        Each column is a raw float64 (numbers) or int32 (category codes, -1 if missing) file that can be memory-mapped;
+        columns.json holds the categories, the number of records and the fingerprint of the database file it mirrors. """
+
+    def __init__(self, json_data_path):
+        self.path = json_data_path + ".columns"
+
+    def read_meta(self):
+        try:
+            with open(self.path+"/columns.json", "r") as f_in:
+                return json.load(f_in)
+        except (OSError, ValueError):
+            return None
+
+    def write_meta(self, path, meta):
+        temp_path = path + "/columns.json." + str(uuid.uuid1()) + ".temp"
+        with open(temp_path, "w") as f_out:
+            json.dump(meta, f_out)
+        os.replace(temp_path, path+"/columns.json")
+
+    def is_fresh(self, fingerprint):
+        meta = self.read_meta()
+        return meta != None and meta["fingerprint"] == list(fingerprint)
+
+    def write_columns(self, path, meta, documents):
+        """ Write the documents after the meta["count"] records already in the column files; raises ValueError for values
+            that are neither numbers nor strings (the mirror is then marked unsupported) """
+        rows = [func_eval_column_values(document) for document in documents]
+        count = meta["count"]
+
+        new_columns = []
+        for row in rows:
+            for name, value in row.items():
+                if name not in meta["columns"] and value is not None:
+                    meta["columns"][name] = {"file":"c"+str(len(meta["columns"]))+".bin",
+                        "kind":"categorical" if isinstance(value, str) else "real",
+                        "categories":[]}
+                    new_columns.append(name)
+
+        arrays = {}
+        for name, column in meta["columns"].items():
+            values = [row.get(name) for row in rows]
+            if column["kind"] == "categorical":
+                codes = {category:code for code, category in enumerate(column["categories"])}
+                for i in range(len(values)):
+                    if values[i] is None:
+                        values[i] = -1
+                    elif isinstance(values[i], str):
+                        if values[i] not in codes:
+                            codes[values[i]] = len(column["categories"])
+                            column["categories"].append(values[i])
+                        values[i] = codes[values[i]]
+                    else:
+                        raise ValueError(f"{name} mixes strings and {type(values[i]).__name__}")
+                array = np.array(values, dtype=np.int32)
+                fill = np.full(count, -1, dtype=np.int32)
+            else:
+                for i in range(len(values)):
+                    if values[i] is None:
+                        values[i] = np.nan
+                    elif isinstance(values[i], (int, float, np.integer, np.floating)) and not isinstance(values[i], bool):
+                        values[i] = float(values[i])
+                    else:
+                        raise ValueError(f"{name} mixes numbers and {type(values[i]).__name__}")
+                array = np.array(values, dtype=np.float64)
+                fill = np.full(count, np.nan, dtype=np.float64)
+            if name in new_columns:
+                array = np.concatenate([fill, array])
+                arrays[name] = (0, array)
+            else:
+                arrays[name] = (count, array)
+
+        for name, (offset, array) in arrays.items():
+            column_path = path + "/" + meta["columns"][name]["file"]
+            with open(column_path, "r+b" if os.path.exists(column_path) else "w+b") as f_out:
+                # overwrite whatever an interrupted writer left after the last complete record
+                f_out.seek(offset*array.itemsize)
+                f_out.write(array.tobytes())
+                f_out.truncate()
+        meta["count"] = count + len(rows)
+
+    def rebuild(self, documents, fingerprint):
+        """ Write a new mirror of all the documents and swap it in """
+        temp_path = self.path + "." + str(uuid.uuid1()) + ".temp"
+        os.makedirs(temp_path)
+        meta = {"fingerprint":list(fingerprint), "count":0, "columns":{}}
+        try:
+            self.write_columns(temp_path, meta, documents)
+        except ValueError as e:
+            print ("[HistoryDB] The columnar mirror does not support this database (" + str(e) + ")")
+            meta = {"fingerprint":list(fingerprint), "unsupported":True}
+        self.write_meta(temp_path, meta)
+        if os.path.isdir(self.path):
+            # readers keep their mappings of the old files
+            trash_path = self.path + "." + str(uuid.uuid1()) + ".trash"
+            os.rename(self.path, trash_path)
+            shutil.rmtree(trash_path, ignore_errors=True)
+        os.rename(temp_path, self.path)
+
+    def append(self, documents, fingerprint):
+        meta = self.read_meta()
+        if meta == None:
+            return
+        if not meta.get("unsupported", False):
+            try:
+                self.write_columns(self.path, meta, documents)
+            except ValueError as e:
+                print ("[HistoryDB] The columnar mirror does not support this database (" + str(e) + ")")
+                meta = {"unsupported":True}
+        meta["fingerprint"] = list(fingerprint)
+        self.write_meta(self.path, meta)
+
+    def map_columns(self, meta):
+        """ {column name: (column meta, read-only memory-mapped array)}, or None if the column files are incomplete """
+        columns = {}
+        try:
+            for name, column in meta["columns"].items():
+                dtype = np.int32 if column["kind"] == "categorical" else np.float64
+                if meta["count"] == 0:
+                    array = np.empty(0, dtype=dtype)
+                else:
+                    array = np.memmap(self.path+"/"+column["file"], dtype=dtype, mode="r", shape=(meta["count"],))
+                columns[name] = (column, array)
+        except (OSError, ValueError):
+            return None
+        return columns
+
+class ExclusiveFileLock(object):
+    """ Lock file created with O_CREAT|O_EXCL, for file systems on which FileLock (flock) is not supported """
+
+    def __init__(self, lock_path, timeout=600, stale_timeout=600):
+        self.lock_path = lock_path
+        self.timeout = timeout # give up acquiring the lock after this many seconds
+        self.stale_timeout = stale_timeout # a lock file older than this was left by a killed process (when its writer cannot be checked)
+
+    def is_stale(self):
+        # the lock file was left by a dead process on this host, or is older than stale_timeout
+        with open(self.lock_path, "r") as f_in:
+            owner = f_in.read().split()
+        if len(owner) == 2 and not process_is_alive(owner[0], owner[1]):
+            return True
+        return time.time() - os.stat(self.lock_path).st_mtime > self.stale_timeout
+
+    def break_stale_lock(self):
+        # waiters remove a stale lock file one at a time (under a second lock file), so that the lock file that one of them just created is never removed by another one
+        break_path = self.lock_path + ".break"
+        try:
+            fd = os.open(break_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+            os.close(fd)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(break_path).st_mtime > self.stale_timeout:
+                    os.remove(break_path) # left by a waiter killed while removing a stale lock file
+            except FileNotFoundError:
+                pass
+            return False
+        try:
+            if self.is_stale():
+                print ("[HistoryDB Warning] remove a stale lock file " + self.lock_path)
+                os.remove(self.lock_path)
+                return True
+            return False
+        finally:
+            os.remove(break_path)
+
+    def __enter__(self):
+        t_start = time.time()
+        delay = 0.001
+        while True:
+            try:
+                fd = os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                os.write(fd, (socket.gethostname() + " " + str(os.getpid())).encode())
+                os.close(fd)
+                return self
+            except FileExistsError:
+                pass
+
+            try:
+                if self.break_stale_lock():
+                    continue
+            except FileNotFoundError:
+                continue # released in the meantime; retry right away
+
+            if time.time() - t_start > self.timeout:
+                raise Exception(f"[HistoryDB] unable to acquire {self.lock_path} within {self.timeout} seconds")
+            # bounded exponential backoff with jitter, so that contending writers do not retry in lockstep
+            time.sleep(delay * (0.5 + random.random()))
+            delay = min(delay * 2, 0.5)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+        return False
+
+def history_file_lock(json_data_path, file_synchronization_method):
+    if file_synchronization_method == 'filelock':
+        return FileLock(json_data_path+".lock")
+    elif file_synchronization_method == 'atomic':
+        return ExclusiveFileLock(json_data_path+".xlock")
+    else:
+        return contextlib.nullcontext()
+
+# HistoryDB objects whose buffered function evaluations are flushed at exit, by a single atexit handler per process
+history_dbs_to_flush = weakref.WeakValueDictionary()
+history_dbs_atexit = False
+
+def flush_history_dbs():
+    for history_db in list(history_dbs_to_flush.values()):
+        history_db.flush_func_eval()
+
+def flush_history_db_at_exit(history_db):
+    global history_dbs_atexit
+    history_dbs_to_flush[id(history_db)] = history_db
+    if not history_dbs_atexit:
+        atexit.register(flush_history_dbs)
+        history_dbs_atexit = True
+
 class HistoryDB(dict):
 
     def __init__(self, meta_path=None, meta_dict=None, history_db=True, **kwargs):
@@ -209,6 +771,10 @@ class HistoryDB(dict):
         #self.crowd_repo_download_url = "http://127.0.0.1:8000/repo/direct-download/" # debug
         self.crowd_repo_upload_url = "https://gptune.lbl.gov/repo/direct-upload/" # GPTune HistoryDB repo
         #self.crowd_repo_upload_url = "http://127.0.0.1:8000/repo/direct-upload/" # debug
+        self.crowd_upload_batch_size = 1 # documents per upload request
+        self.crowd_upload_timeout = 30 # seconds per upload request
+        self.crowd_upload_queue = None # started by the first upload
+        self.crowd_sync_ttl = 600 # seconds during which a crowd repository download is not repeated
 
         """ Path to JSON data files """
         self.historydb_path = "./gptune.db"
@@ -234,9 +800,30 @@ class HistoryDB(dict):
         """ File synchronization options """
         self.file_synchronization_method = 'filelock'
 
+        """ Storage backend: 'json' (single JSON document), 'jsonl' (append-only JSON-lines journal), or 'sqlite' (indexed SQLite database) """
+        self.historydb_backend = "json"
+
+        """ Buffered writes of function evaluations; Computer flushes the buffer after each evaluate_objective call """
+        self.write_buffer_size = 64 # flush when this many evaluations are pending (1: write every evaluation immediately)
+        self.write_buffer_seconds = 60 # flush when the oldest pending evaluation is older than this
+        self.write_buffer = []
+        self.write_buffer_time = None
+        self.write_buffer_lock = threading.Lock()
+
+        """ Columnar binary mirror of the function evaluations (<database>.columns/), used to load large histories quickly """
+        self.columnar_mirror = False
+
+        """ Results of check_load_deps/check_space_boundary per function evaluation uid """
+        self.load_check_cache = {}
+
         """ Process uid """
         self.process_uid = str(uuid.uuid1())
 
+        """ Function evaluations stored by this object, as ranges of (session uid, index) tags of the documents;
+            surrogate models refer to these ranges instead of listing self.uids """
+        self.session_uid = str(uuid.uuid1())
+        self.session_ranges = []
+
         """ Check machine and software configurations when loading historical data"""
         self.load_check = True
 
@@ -244,6 +831,8 @@ class HistoryDB(dict):
             ## No DB mode
             return
 
+        flush_history_db_at_exit(self)
+
         # if history database is requested by CK-GPTune
         if (os.environ.get('CKGPTUNE_HISTORY_DB') == 'yes'):
             print ("CK-GPTune History Database Init")
@@ -264,7 +853,7 @@ class HistoryDB(dict):
             self.loadable_machine_configurations = ast.literal_eval(os.environ.get('CKGPTUNE_LOADABLE_MACHINE_CONFIGURATIONS','{}'))
             self.loadable_software_configurations = ast.literal_eval(os.environ.get('CKGPTUNE_LOADABLE_SOFTWARE_CONFIGURATIONS', '{}'))
 
-            os.system("mkdir -p ./gptune.db")
+            os.makedirs("./gptune.db", exist_ok=True)
             self.historydb_path = "./gptune.db"
 
             if (os.environ.get('CKGPTUNE_LOAD_MODEL') == 'yes'):
@@ -274,9 +863,10 @@ class HistoryDB(dict):
                     #print ("[HistoryDB] use filelock for synchronization")
                     self.file_synchronization_method = 'filelock'
             except:
-                #print ("[HistoryDB] use rsync for synchronization")
-                self.file_synchronization_method = 'rsync'
-            os.system("rm -rf test.lock")
+                #print ("[HistoryDB] use lock files and atomic renames for synchronization")
+                self.file_synchronization_method = 'atomic'
+            if os.path.exists("test.lock"):
+                os.remove("test.lock")
 
         # if GPTune is called through MPI spawning or Reverse Communication Interface
         else:
@@ -323,10 +913,45 @@ class HistoryDB(dict):
             if "crowdtuning_api_key" in metadata:
                 self.crowdtuning_api_key = metadata["crowdtuning_api_key"]
 
+            if "crowd_repo_download_url" in metadata:
+                self.crowd_repo_download_url = metadata["crowd_repo_download_url"]
+
+            if "crowd_repo_upload_url" in metadata:
+                self.crowd_repo_upload_url = metadata["crowd_repo_upload_url"]
+
+            if "crowd_upload_batch_size" in metadata:
+                self.crowd_upload_batch_size = int(metadata["crowd_upload_batch_size"])
+
+            if "crowd_upload_timeout" in metadata:
+                self.crowd_upload_timeout = float(metadata["crowd_upload_timeout"])
+
+            if "crowd_sync_ttl" in metadata:
+                self.crowd_sync_ttl = float(metadata["crowd_sync_ttl"])
+
             if "historydb_path" in metadata:
                 self.historydb_path = metadata["historydb_path"]
 
-            os.system("mkdir -p " + self.historydb_path)
+            if "historydb_backend" in metadata:
+                if metadata["historydb_backend"] in ["json", "jsonl", "sqlite"]:
+                    self.historydb_backend = metadata["historydb_backend"]
+                else:
+                    print ("[HistoryDB Warning] unknown historydb_backend: " + str(metadata["historydb_backend"]) + ", use json")
+
+            os.makedirs(self.historydb_path, exist_ok=True)
+
+            if "write_buffer_size" in metadata:
+                self.write_buffer_size = int(metadata["write_buffer_size"])
+
+            if "write_buffer_seconds" in metadata:
+                self.write_buffer_seconds = float(metadata["write_buffer_seconds"])
+
+            if "columnar_mirror" in metadata:
+                if metadata["columnar_mirror"] == "yes" or metadata["columnar_mirror"] == "y":
+                    self.columnar_mirror = True
+                elif metadata["columnar_mirror"] == "no" or metadata["columnar_mirror"] == "n":
+                    self.columnar_mirror = False
+                else:
+                    self.columnar_mirror = False
 
             if "save_model" in metadata:
                 if metadata["save_model"] == "yes" or metadata["save_model"] == "y":
@@ -457,39 +1082,29 @@ class HistoryDB(dict):
                     #print ("[HistoryDB] use filelock for synchronization")
                     self.file_synchronization_method = 'filelock'
             except:
-                #print ("[HistoryDB] use rsync for synchronization")
-                self.file_synchronization_method = 'rsync'
-            os.system("rm -rf test.lock")
+                #print ("[HistoryDB] use lock files and atomic renames for synchronization")
+                self.file_synchronization_method = 'atomic'
+            if os.path.exists("test.lock"):
+                os.remove("test.lock")
 
             if self.tuning_problem_name is not None:
-                json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+                json_data_path = self.historydb_data_path()
+
+                # convert an existing single-document database when switching to another backend
+                legacy_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+                if self.historydb_backend != "json" and not os.path.exists(json_data_path) and os.path.exists(legacy_data_path):
+                    print ("[HistoryDB] Convert " + legacy_data_path + " to " + json_data_path)
+                    with history_file_lock(legacy_data_path, self.file_synchronization_method):
+                        convert_history_file(legacy_data_path, json_data_path)
 
                 create_db_file = False
                 if os.path.exists(json_data_path):
                     print ("[HistoryDB] Found a history database file")
 
-                    if self.file_synchronization_method == 'filelock':
-                        with FileLock(json_data_path+".lock"):
-                            with open(json_data_path, "r") as f_in:
-                                try:
-                                    history_data = json.load(f_in)
-                                except:
-                                    create_db_file = True
-                    elif self.file_synchronization_method == 'rsync':
-                        temp_path = json_data_path + "." + self.process_uid + ".temp"
-                        os.system("rsync -a " + json_data_path + " " + temp_path)
-                        with open(temp_path, "r") as f_in:
-                            try:
-                                history_data = json.load(f_in)
-                            except:
-                                create_db_file = True
-                        os.system("rm " + temp_path)
-                    else:
-                        with open(json_data_path, "r") as f_in:
-                            try:
-                                history_data = json.load(f_in)
-                            except:
-                                create_db_file = True
+                    try:
+                        history_data = self.read_history_data()
+                    except:
+                        create_db_file = True
                     if create_db_file == True:
                         print ("[HistoryDB Warning] the database file is invvalid. Re-initializing the file")
                 else:
@@ -498,31 +1113,367 @@ class HistoryDB(dict):
                 if create_db_file == True:
                     print ("[HistoryDB] Create a JSON file at " + json_data_path)
 
-                    if self.file_synchronization_method == 'filelock':
-                        with FileLock(json_data_path+".lock"):
-                            with open(json_data_path, "w") as f_out:
-                                json_data = {"tuning_problem_name":self.tuning_problem_name,
-                                    "tuning_problem_category":self.tuning_problem_category,
-                                    "surrogate_model":[],
-                                    "func_eval":[]}
-                                json.dump(json_data, f_out, indent=2)
-                    elif self.file_synchronization_method == 'rsync':
-                        temp_path = json_data_path + "." + self.process_uid + ".temp"
-                        with open(temp_path, "w") as f_out:
-                            json_data = {"tuning_problem_name":self.tuning_problem_name,
-                                "tuning_problem_category":self.tuning_problem_category,
-                                "surrogate_model":[],
-                                "func_eval":[]}
-                            json.dump(json_data, f_out, indent=2)
-                        os.system("rsync -u " + temp_path + " " + json_data_path)
-                        os.system("rm " + temp_path)
-                    else:
-                        with open(json_data_path, "w") as f_out:
-                            json_data = {"tuning_problem_name":self.tuning_problem_name,
-                                "tuning_problem_category":self.tuning_problem_category,
-                                "surrogate_model":[],
-                                "func_eval":[]}
-                            json.dump(json_data, f_out, indent=2)
+                    self.create_history_data()
+
+                self.recover_pending_func_eval()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # pending evaluations belong to the process that buffered them
+        state["write_buffer"] = []
+        state["write_buffer_time"] = None
+        del state["write_buffer_lock"]
+        # the upload thread stays with the process that started it
+        state["crowd_upload_queue"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.write_buffer_lock = threading.Lock()
+        # each process numbers its own evaluations, and each copy has its own side journal
+        self.session_uid = str(uuid.uuid1())
+        self.process_uid = str(uuid.uuid1())
+        if self.history_db:
+            flush_history_db_at_exit(self)
+
+    def historydb_data_path(self):
+        if self.historydb_backend == "sqlite":
+            return self.historydb_path+"/"+self.tuning_problem_name+".sqlite"
+        elif self.historydb_backend == "jsonl":
+            return self.historydb_path+"/"+self.tuning_problem_name+".jsonl"
+        else:
+            return self.historydb_path+"/"+self.tuning_problem_name+".json"
+
+    def read_history_data(self):
+        """ Read the history database as one document {"tuning_problem_name", "tuning_problem_category", "surrogate_model", "func_eval"} """
+        self.flush_func_eval()
+        json_data_path = self.historydb_data_path()
+
+        if self.file_synchronization_method == 'filelock' and self.historydb_backend != "sqlite":
+            with FileLock(json_data_path+".lock"):
+                history_data = read_history_file_cached(json_data_path)
+        else:
+            # writers replace whole files atomically and readers skip incomplete journal lines, so no lock is needed
+            history_data = read_history_file_cached(json_data_path)
+
+        return history_data
+
+    def create_history_data(self):
+        json_data_path = self.historydb_data_path()
+        json_data = {"tuning_problem_name":self.tuning_problem_name,
+            "tuning_problem_category":self.tuning_problem_category,
+            "surrogate_model":[],
+            "func_eval":[]}
+
+        if self.historydb_backend == "sqlite":
+            write_history_file(json_data_path, json_data)
+        else:
+            with history_file_lock(json_data_path, self.file_synchronization_method):
+                write_history_file(json_data_path, json_data)
+
+        if self.columnar_mirror == True:
+            with history_file_lock(json_data_path, self.file_synchronization_method):
+                ColumnarMirror(json_data_path).rebuild([], history_file_fingerprint(json_data_path))
+
+    def append_history_data(self, key, documents):
+        """ Append documents to the "func_eval" or "surrogate_model" list of the history database """
+        json_data_path = self.historydb_data_path()
+
+        update_columnar_mirror = self.columnar_mirror == True and key == "func_eval"
+
+        if self.historydb_backend == "sqlite":
+            # SQLite needs no lock of its own, but the columnar mirror must be updated along with the database
+            with history_file_lock(json_data_path, self.file_synchronization_method) if update_columnar_mirror else contextlib.nullcontext():
+                fingerprint = history_file_fingerprint(json_data_path) if update_columnar_mirror else None
+                conn = connect_sqlite_file(json_data_path)
+                try:
+                    with conn:
+                        num_changes = conn.total_changes
+                        insert_sqlite_documents(conn, key, documents, self.tuning_problem_name)
+                        num_changes = conn.total_changes - num_changes
+                finally:
+                    conn.close()
+                # duplicated uids are ignored by the database; leave the mirror stale so that it is rebuilt on the next load
+                if update_columnar_mirror and num_changes == len(documents):
+                    self.update_columnar_mirror(json_data_path, documents, fingerprint)
+        elif self.historydb_backend == "jsonl":
+            # appending to the journal is O(record)
+            with history_file_lock(json_data_path, self.file_synchronization_method):
+                fingerprint = history_file_fingerprint(json_data_path) if update_columnar_mirror else None
+                append_journal_file(json_data_path, key, documents)
+                if update_columnar_mirror:
+                    self.update_columnar_mirror(json_data_path, documents, fingerprint)
+        else:
+            with history_file_lock(json_data_path, self.file_synchronization_method):
+                fingerprint = history_file_fingerprint(json_data_path) if update_columnar_mirror else None
+                with open(json_data_path, "r") as f_in:
+                    json_data = json.load(f_in)
+                    json_data[key] += documents
+                write_history_file(json_data_path, json_data)
+                # we hold the latest document already; spare the next read from parsing it again
+                history_file_cache[json_data_path] = {"fingerprint":history_file_fingerprint(json_data_path), "offset":None, "history_data":json_data}
+                if update_columnar_mirror:
+                    self.update_columnar_mirror(json_data_path, documents, fingerprint)
+
+    def update_columnar_mirror(self, json_data_path, documents, fingerprint):
+        """ Append the documents to the columnar mirror if it was in sync with the database (fingerprint) before they were written.
+            Must be called with the database lock held. """
+        mirror = ColumnarMirror(json_data_path)
+        if mirror.is_fresh(fingerprint):
+            mirror.append(documents, history_file_fingerprint(json_data_path))
+
+    def load_columnar_mirror(self):
+        """ Memory-mapped columns of the function evaluations (see ColumnarMirror.map_columns); the mirror is rebuilt first
+            if the database was changed without it (e.g. by a process with columnar_mirror off). None if not usable. """
+        self.flush_func_eval()
+        json_data_path = self.historydb_data_path()
+        mirror = ColumnarMirror(json_data_path)
+
+        meta = mirror.read_meta()
+        if meta == None or meta["fingerprint"] != list(history_file_fingerprint(json_data_path)):
+            with history_file_lock(json_data_path, self.file_synchronization_method):
+                fingerprint = history_file_fingerprint(json_data_path)
+                if not mirror.is_fresh(fingerprint):
+                    print ("[HistoryDB] Build the columnar mirror of " + json_data_path)
+                    mirror.rebuild(read_history_file_cached(json_data_path)["func_eval"], fingerprint)
+            meta = mirror.read_meta()
+
+        if meta == None or meta.get("unsupported", False):
+            return None
+        return mirror.map_columns(meta)
+
+    def pending_journal_path(self):
+        # one journal per HistoryDB object, so that flushing one object does not remove the records of another one on the same database
+        return self.historydb_data_path() + "." + socket.gethostname() + "." + str(os.getpid()) + "." + self.process_uid + ".pending"
+
+    def buffer_func_eval(self, documents):
+        """ Queue function evaluation documents; they are also fsync'd to a per-process side journal so that a killed job keeps them """
+        if self.write_buffer_size <= 1:
+            self.append_history_data("func_eval", documents)
+            return
+
+        with self.write_buffer_lock:
+            with open(self.pending_journal_path(), "a") as f_out:
+                f_out.write("".join([json.dumps({"record":"func_eval", "document":document}) + "\n" for document in documents]))
+                f_out.flush()
+                os.fsync(f_out.fileno())
+            self.write_buffer += documents
+            if self.write_buffer_time == None:
+                self.write_buffer_time = time.time()
+            flush = len(self.write_buffer) >= self.write_buffer_size or\
+                    time.time() - self.write_buffer_time >= self.write_buffer_seconds
+
+        if flush:
+            self.flush_func_eval()
+
+    def flush_func_eval(self):
+        """ Write all buffered function evaluations with a single (locked) database update """
+        with self.write_buffer_lock:
+            if len(self.write_buffer) == 0:
+                return
+            self.append_history_data("func_eval", self.write_buffer)
+            self.write_buffer = []
+            self.write_buffer_time = None
+            pending_journal_path = self.pending_journal_path()
+            if os.path.exists(pending_journal_path):
+                os.remove(pending_journal_path)
+
+    def recover_pending_func_eval(self):
+        """ Merge side journals left by processes that died before flushing their buffer """
+        prefix = self.historydb_data_path() + "."
+        for pending_journal_path in glob.glob(prefix + "*.pending"):
+            writer = pending_journal_path[len(prefix):-len(".pending")]
+            if "-" in writer.rsplit(".", 1)[-1]:   # hostname.pid.process_uid (hostname.pid for journals of older versions)
+                writer = writer.rsplit(".", 1)[0]
+            hostname, pid = writer.rsplit(".", 1)
+            if hostname != socket.gethostname():
+                continue # we cannot tell whether the writer is still running
+            try:
+                os.kill(int(pid), 0)
+                continue # the writer is alive
+            except ProcessLookupError:
+                pass
+            except:
+                continue
+
+            # only one process gets to recover each journal
+            recovering_path = pending_journal_path + "." + self.process_uid + ".recovering"
+            try:
+                os.rename(pending_journal_path, recovering_path)
+            except OSError:
+                continue
+
+            documents = [document for record_type, document in iterate_journal_file(recovering_path)]
+            existing_uids = set([func_eval["uid"] for func_eval in self.query_func_eval(uids=[document["uid"] for document in documents])])
+            documents = [document for document in documents if document["uid"] not in existing_uids]
+            if len(documents) > 0:
+                print ("[HistoryDB] Recovered " + str(len(documents)) + " function evaluations from " + pending_journal_path)
+                self.append_history_data("func_eval", documents)
+            os.remove(recovering_path)
+
+    def compact_history_data(self):
+        """ Rewrite the journal without duplicated (by uid) or torn records """
+        if self.historydb_backend == "json" or self.tuning_problem_name is None:
+            return
+        json_data_path = self.historydb_data_path()
+        if not os.path.exists(json_data_path):
+            return
+        if self.historydb_backend == "sqlite":
+            conn = connect_sqlite_file(json_data_path)
+            conn.execute("VACUUM")
+            conn.close()
+        else:
+            with history_file_lock(json_data_path, self.file_synchronization_method):
+                compact_journal_file(json_data_path)
+
+    def query_func_eval(self, task_keys : list = None, modeling_filter : tuple = None, uids : list = None):
+        """ Function evaluations of the tuning problem, optionally restricted to the given task keys (see task_parameter_key),
+            (modeling, model_class) pair (Pilot samples always pass), and uids.
+            Only the SQLite backend uses task_keys (an index lookup); the other backends return a superset. """
+        self.flush_func_eval()
+        if self.historydb_backend != "sqlite":
+            func_evals = self.read_history_data()["func_eval"]
+            if modeling_filter != None:
+                func_evals = [func_eval for func_eval in func_evals if func_eval["modeling"] == "Pilot" or
+                    (func_eval["modeling"] == modeling_filter[0] and func_eval["model_class"] == modeling_filter[1])]
+            if uids != None:
+                uids = set(uids)
+                func_evals = [func_eval for func_eval in func_evals if func_eval["uid"] in uids]
+            return func_evals
+
+        query = "SELECT document FROM func_eval WHERE tuning_problem_name = ?"
+        params = [self.tuning_problem_name]
+        if task_keys != None:
+            task_keys = list(set(task_keys))
+            query += " AND task_key IN (" + ",".join(["?"]*len(task_keys)) + ")"
+            params += task_keys
+        if modeling_filter != None:
+            query += " AND (modeling = 'Pilot' OR (modeling = ? AND model_class = ?))"
+            params += [modeling_filter[0], modeling_filter[1]]
+
+        conn = connect_sqlite_file(self.historydb_data_path())
+        try:
+            if uids == None:
+                func_evals = [json.loads(row[0]) for row in conn.execute(query + " ORDER BY seq", params)]
+            else:
+                # chunk the uid list to stay below SQLite's host parameter limit
+                func_evals = []
+                uids = list(uids)
+                for i in range(0, len(uids), 500):
+                    uids_ = uids[i:i+500]
+                    func_evals += [json.loads(row[0]) for row in conn.execute(query + " AND uid IN (" + ",".join(["?"]*len(uids_)) + ") ORDER BY seq", params + uids_)]
+        finally:
+            conn.close()
+
+        return func_evals
+
+    def query_legacy_surrogate_models(self):
+        """ Surrogate models stored in the database itself (the "surrogate_model" list/table) """
+        if not os.path.exists(self.historydb_data_path()):
+            return []
+        if self.historydb_backend != "sqlite":
+            return self.read_history_data()["surrogate_model"]
+
+        conn = connect_sqlite_file(self.historydb_data_path())
+        try:
+            surrogate_models = [json.loads(row[0]) for row in conn.execute("SELECT document FROM surrogate_model ORDER BY seq")]
+        finally:
+            conn.close()
+
+        return surrogate_models
+
+    def surrogate_model_store_path(self):
+        return self.historydb_path+"/"+self.tuning_problem_name+".models"
+
+    def init_surrogate_model_store(self):
+        """ Create the surrogate model store (<problem>.models/: one content-addressed file per model, and index.jsonl),
+            moving in the models of the database on first use """
+        store_path = self.surrogate_model_store_path()
+        index_path = store_path + "/index.jsonl"
+        if os.path.exists(index_path):
+            return
+
+        os.makedirs(store_path, exist_ok=True)
+        with history_file_lock(index_path, self.file_synchronization_method):
+            if os.path.exists(index_path):
+                return
+            index_entries = [surrogate_model_index_entry(surrogate_model, write_surrogate_model_file(store_path, surrogate_model))
+                for surrogate_model in self.query_legacy_surrogate_models()]
+            write_history_file(index_path, {"tuning_problem_name":self.tuning_problem_name,
+                "tuning_problem_category":self.tuning_problem_category,
+                "surrogate_model":index_entries,
+                "func_eval":[]})
+
+    def store_surrogate_model(self, surrogate_model : dict):
+        self.init_surrogate_model_store()
+        store_path = self.surrogate_model_store_path()
+        digest = write_surrogate_model_file(store_path, surrogate_model)
+        with history_file_lock(store_path + "/index.jsonl", self.file_synchronization_method):
+            append_journal_file(store_path + "/index.jsonl", "surrogate_model", [surrogate_model_index_entry(surrogate_model, digest)])
+
+    def query_surrogate_model_index(self, modeler : str = None, objective : int = None):
+        """ Index entries (see surrogate_model_index_entry) of the surrogate models of the given modeler and objective id """
+        self.init_surrogate_model_store()
+        index_entries = read_history_file_cached(self.surrogate_model_store_path() + "/index.jsonl")["surrogate_model"]
+        if modeler != None:
+            index_entries = [index_entry for index_entry in index_entries if index_entry["modeler"] == modeler]
+        if objective != None:
+            index_entries = [index_entry for index_entry in index_entries if index_entry["objective_id"] == objective]
+        return index_entries
+
+    def load_surrogate_model(self, index_entry : dict):
+        with open(self.surrogate_model_store_path() + "/" + index_entry["digest"] + ".json", "r") as f_in:
+            return json.load(f_in)
+
+    def query_surrogate_models(self, modeler : str = None, objective : int = None):
+        """ Surrogate models of the given modeler and objective id """
+        return [self.load_surrogate_model(index_entry) for index_entry in self.query_surrogate_model_index(modeler=modeler, objective=objective)]
+
+    def query_latest_surrogate_model(self, problem : Problem, input_given : np.ndarray, objective : int, modeler : str):
+        """ The most recently stored surrogate model of the modeler for the same tasks (input_given, normalized), spaces and objective id, or None """
+        if self.tuning_problem_name is None:
+            return None
+        task_parameters = np.array(problem.IS.inverse_transform(np.array(input_given, ndmin=2))).tolist()
+        input_space = json.loads(json.dumps(self.problem_space_to_dict(problem.IS)))
+        parameter_space = json.loads(json.dumps(self.problem_space_to_dict(problem.PS)))
+        output_space = json.loads(json.dumps(self.problem_space_to_dict(problem.OS)))
+
+        for index_entry in reversed(self.query_surrogate_model_index(modeler=modeler, objective=objective)):
+            if index_entry["task_parameters"] == task_parameters and \
+                    index_entry["input_space"] == input_space and \
+                    index_entry["parameter_space"] == parameter_space and \
+                    index_entry["output_space"] == output_space:
+                return self.load_surrogate_model(index_entry)
+
+        return None
+
+    def query_surrogate_model_func_evals(self, surrogate_models : list):
+        """ For each surrogate model, the function evaluations it was built with, in storing order """
+        if all(["function_evaluations" in surrogate_model for surrogate_model in surrogate_models]):
+            uids = set()
+            for surrogate_model in surrogate_models:
+                uids.update(surrogate_model["function_evaluations"])
+            func_evals = self.query_func_eval(uids=uids)
+        else:
+            func_evals = self.query_func_eval()
+
+        func_evals_by_uid = {}
+        func_evals_by_session = {}
+        for func_eval in func_evals:
+            func_evals_by_uid[func_eval["uid"]] = func_eval
+            if "session" in func_eval:
+                func_evals_by_session[(func_eval["session"]["uid"], func_eval["session"]["index"])] = func_eval
+
+        # Assume that all function evaluations of the surrogate model are in the database file
+        ret = []
+        for surrogate_model in surrogate_models:
+            if "function_evaluations" in surrogate_model:
+                ret.append([func_evals_by_uid[func_eval_uid] for func_eval_uid in surrogate_model["function_evaluations"]])
+            else:
+                ret.append([func_evals_by_session[(evaluation_range["session_uid"], session_index)]
+                    for evaluation_range in surrogate_model["function_evaluation_ranges"]
+                    for session_index in range(evaluation_range["start"], evaluation_range["stop"])])
+        return ret
 
     def check_load_deps(self, func_eval):
 
@@ -677,6 +1628,43 @@ class HistoryDB(dict):
 
         return True
 
+    def load_check_signature(self, problem):
+        # everything the result of check_load_deps/check_space_boundary depends on, besides the function evaluation itself
+        return json.dumps([self.problem_space_to_dict(problem.IS),
+            self.problem_space_to_dict(problem.PS),
+            self.loadable_machine_configurations,
+            self.loadable_software_configurations], sort_keys=True, default=str)
+
+    def check_load_passed(self, problem, func_eval, load_check_signature):
+        """ check_load_deps and check_space_boundary, memoized per function evaluation uid """
+        if "uid" not in func_eval:
+            return self.check_load_deps(func_eval) and self.check_space_boundary(problem, func_eval)
+
+        load_checks = self.load_check_cache.setdefault(load_check_signature, {})
+        if func_eval["uid"] not in load_checks:
+            load_checks[func_eval["uid"]] = self.check_load_deps(func_eval) and self.check_space_boundary(problem, func_eval)
+        return load_checks[func_eval["uid"]]
+
+    def build_task_id_index(self, problem : Problem, Tgiven : np.ndarray):
+        """ Hash index from the canonical task parameter tuple to the task id in Tgiven, for lookup_task_id """
+        # The internal tla_id is not stored in the DB; when several tasks share the same task parameter (TLA_I with LCM mode),
+        # the smallest task ID (the target task) wins, as in search_func_eval_task_id
+        columns = [j for j in range(len(problem.IS)) if problem.IS[j].name != "tla_id"]
+        names = [problem.IS[j].name for j in columns]
+        index = {}
+        for i in reversed(range(len(Tgiven))):
+            index[tuple([canonical_parameter_value(Tgiven[i][j]) for j in columns])] = i
+        return (names, index)
+
+    def lookup_task_id(self, func_eval : dict, task_id_index : tuple):
+        """ O(1) equivalent of search_func_eval_task_id using an index from build_task_id_index """
+        (names, index) = task_id_index
+        try:
+            key = tuple([canonical_parameter_value(func_eval["task_parameter"][name]) for name in names])
+            return index.get(key, -1)
+        except (KeyError, TypeError):
+            return -1
+
     def search_func_eval_task_id(self, func_eval : dict, problem : Problem, Tgiven : np.ndarray):
         task_id = -1
 
@@ -715,25 +1703,13 @@ class HistoryDB(dict):
         return False
 
     def parameter_exists_in_db(self, problem : Problem, task_parameter, tuning_parameter):
-        json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+        json_data_path = self.historydb_data_path()
 
         if os.path.exists(json_data_path):
             print ("[HistoryDB] Found a history database file")
-            if self.file_synchronization_method == 'filelock':
-                with FileLock(json_data_path+".lock"):
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-            elif self.file_synchronization_method == 'rsync':
-                temp_path = json_data_path + "." + self.process_uid + ".temp"
-                os.system("rsync -a " + json_data_path + " " + temp_path)
-                with open(temp_path, "r") as f_in:
-                    history_data = json.load(f_in)
-                os.system("rm " + temp_path)
-            else:
-                with open(json_data_path, "r") as f_in:
-                    history_data = json.load(f_in)
+            task_key = task_parameter_key({problem.IS[k].name:task_parameter[k] for k in range(len(problem.IS))})
 
-            for func_eval in history_data["func_eval"]:
+            for func_eval in self.query_func_eval(task_keys=[task_key]):
 
                 task_parameter_ = []
                 for k in range(len(problem.IS)):
@@ -763,39 +1739,180 @@ class HistoryDB(dict):
 
         return False
 
+    def modeling_load_type(self, data : Data, options : dict):
+        """ Value of the "modeling" field of the function evaluations to load when model_input_separation is set """
+        modeling_load = None
+        if options["TLA_method"] == None:
+            if len(data.I) == 1:
+                modeling_load = "SLA_GP"
+            elif len(data.I) > 1:
+                modeling_load = "MLA_LCM"
+        elif options["TLA_method"] == "Regression":
+            modeling_load = "TLA_RegressionSum"
+        elif options["TLA_method"] == "Sum":
+            modeling_load = "TLA_Sum"
+        elif options["TLA_method"] == "Stacking":
+            modeling_load = "TLA_Stacking"
+        elif options["TLA_method"] == "LCM_BF":
+            modeling_load = "TLA_LCM_BF"
+        elif options["TLA_method"] == "LCM":
+            modeling_load = "TLA_LCM"
+        else:
+            if len(data.I) == 1:
+                modeling_load = "SLA_GP"
+            elif len(data.I) > 1:
+                modeling_load = "MLA_LCM"
+        return modeling_load
+
+    def columnar_space_boundary_mask(self, problem : Problem, columns : dict, count : int):
+        """ check_space_boundary on all the records of the columnar mirror at once; None if the column types do not match the spaces """
+        mask = np.ones(count, dtype=bool)
+        for group, space in [("task_parameter", problem.IS), ("tuning_parameter", problem.PS)]:
+            for space_ in self.problem_space_to_dict(space):
+                # The internal tla_id is not stored in the DB; therefore, no need to check
+                if group == "task_parameter" and space_["name"] == "tla_id":
+                    continue
+                name = group + "/" + space_["name"]
+                if name not in columns:
+                    return np.zeros(count, dtype=bool)
+                column, array = columns[name]
+                if space_["type"] == "real" or space_["type"] == "int" or space_["type"] == "integer":
+                    if column["kind"] != "real":
+                        return None
+                    # missing values (NaN) fail the comparisons
+                    mask &= (array >= space_["lower_bound"]) & (array <= space_["upper_bound"])
+                elif space_["type"] == "categorical":
+                    if column["kind"] != "categorical":
+                        return None
+                    mask &= column_isin(columns, name, space_["categories"], count)
+        return mask
+
+    def load_history_func_eval_columnar(self, data : Data, problem : Problem, Tgiven : np.ndarray, options : dict, task_id_index : tuple):
+        """ Vectorized equivalent of the record-by-record loop of load_history_func_eval, reading the columnar mirror.
+            Returns (PS_history, OS_history, num_loaded_data), or None if the mirror cannot be used for this problem. """
+        columns = self.load_columnar_mirror()
+        if columns == None:
+            return None
+
+        num_tasks = len(Tgiven)
+        PS_history = [[] for i in range(num_tasks)]
+        OS_history = [[] for i in range(num_tasks)]
+        if "configuration" not in columns:
+            return (PS_history, OS_history, 0)
+        count = len(columns["configuration"][1])
+
+        selected = np.ones(count, dtype=bool)
+
+        if options != None and options["model_input_separation"] == True:
+            modeling_load = self.modeling_load_type(data, options)
+            selected &= column_isin(columns, "modeling", ["Pilot"], count) |\
+                (column_isin(columns, "modeling", [modeling_load], count) & column_isin(columns, "model_class", [options["model_class"]], count))
+
+        if self.load_check == True:
+            # check_load_deps once per distinct machine/software configuration
+            column, array = columns["configuration"]
+            loadable = [code for code, configuration in enumerate(column["categories"]) if self.check_load_deps(json.loads(configuration))]
+            selected &= np.isin(array, loadable)
+            boundary_mask = self.columnar_space_boundary_mask(problem, columns, count)
+            if boundary_mask is None:
+                return None
+            selected &= boundary_mask
+
+        # task ids: lookup_task_id once per distinct task parameter
+        (names, index) = task_id_index
+        rows = np.nonzero(selected)[0]
+        if any(["task_parameter/"+name not in columns for name in names]):
+            return (PS_history, OS_history, 0)
+        if len(names) == 0:
+            task_ids = np.full(len(rows), index.get((), -1))
+        else:
+            keys = np.stack([np.asarray(columns["task_parameter/"+name][1][rows], dtype=np.float64) for name in names], axis=1)
+            unique_keys, inverse = np.unique(keys, axis=0, return_inverse=True)
+            unique_task_ids = []
+            for unique_key in unique_keys:
+                key = []
+                for name, value in zip(names, unique_key):
+                    column = columns["task_parameter/"+name][0]
+                    if column["kind"] == "categorical":
+                        key.append(column["categories"][int(value)] if value >= 0 else None)
+                    else:
+                        key.append(canonical_parameter_value(float(value)))
+                unique_task_ids.append(index.get(tuple(key), -1))
+            task_ids = np.array(unique_task_ids, dtype=np.int64)[np.reshape(inverse, -1)]
+        rows = rows[task_ids != -1]
+        task_ids = task_ids[task_ids != -1]
+
+        parameter_columns = []
+        for k in range(len(problem.PS)):
+            name = "tuning_parameter/" + problem.PS[k].name
+            if name not in columns:
+                return None
+            column, array = columns[name]
+            values = array[rows]
+            if type(problem.PS[k]).__name__ == "Categoricalnorm":
+                if column["kind"] != "categorical" or np.any(values < 0):
+                    return None
+                values = np.array(column["categories"], dtype=object)[values]
+            elif column["kind"] != "real" or np.any(np.isnan(values)):
+                return None
+            elif type(problem.PS[k]).__name__ == "Integer":
+                values = values.astype(np.int64)
+            elif type(problem.PS[k]).__name__ != "Real":
+                return None
+            parameter_columns.append(values.tolist())
+
+        output_columns = []
+        for k in range(len(problem.OS)):
+            name = "evaluation_result/" + problem.OS[k].name
+            if name not in columns or columns[name][0]["kind"] != "real":
+                return None
+            values = columns[name][1][rows]
+            if np.any(np.isnan(values)):
+                # failed evaluations are stored as None
+                output_columns.append([None if value != value else value for value in values.tolist()])
+            else:
+                output_columns.append(values.tolist())
+
+        for task_id, parameter_arr, output_arr in zip(task_ids.tolist(), zip(*parameter_columns), zip(*output_columns)):
+            PS_history[task_id].append(list(parameter_arr))
+            OS_history[task_id].append(list(output_arr))
+
+        return (PS_history, OS_history, len(rows))
+
     def load_history_func_eval(self, data : Data, problem : Problem, Tgiven : np.ndarray, function_evaluations : list = None, source_function_evaluations : list = None, options : dict = None):
 
         """ Init history database JSON file """
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
 
             if self.sync_crowd_repo == True:
+                crowd_download_cache = CrowdDownloadCache(self.historydb_path,
+                        self.crowd_repo_download_url,
+                        self.crowdtuning_api_key,
+                        ttl=self.crowd_sync_ttl)
+                crowd_query = {"tuning_problem_name":self.tuning_problem_name,
+                        "tuning_problem_category":self.tuning_problem_category}
                 try:
-                    r = requests.get(url = self.crowd_repo_download_url,
-                            headers={"x-api-key":self.crowdtuning_api_key},
-                            params={"tuning_problem_name":self.tuning_problem_name,
-                                "tuning_problem_category":self.tuning_problem_category},
-                            verify=False)
-                    if r.status_code == 200:
-                        if not os.path.exists(json_data_path): #TODO: check
-                            with open(json_data_path, "w") as f_out:
-                                json_data = {"tuning_problem_name":self.tuning_problem_name,
-                                    "tuning_problem_category":self.tuning_problem_category,
-                                    "surrogate_model":[],
-                                    "func_eval":[]}
-                                json.dump(json_data, f_out, indent=2)
-
-                        func_eval_list_downloaded = json.loads(r.text)["perf_data"]
-                        print ("FUNC_EVAL_LIST_DOWNLOADED: ", func_eval_list_downloaded)
-                        with open(json_data_path, "r") as f_in:
-                            json_data = json.load(f_in)
-                            json_data["func_eval"] += func_eval_list_downloaded #TODO: uid check
-                        with open(json_data_path, "w") as f_out:
-                            json.dump(json_data, f_out, indent=2)
-                    else:
-                        print ("request status_code: ", r.status_code)
-                except:
-                    print ("direct download failed")
+                    (func_eval_list_cached, func_eval_list_downloaded) = crowd_download_cache.download(crowd_query)
+                except Exception as e:
+                    print ("direct download failed: " + str(e))
+                    (func_eval_list_cached, func_eval_list_downloaded) = (crowd_download_cache.read(crowd_query)["perf_data"], [])
+                try:
+                    # the whole cached copy is merged by uid, not only the records downloaded now: the cursor of the cache has already moved on,
+                    # so records would be lost if a previous merge failed, the local database was recreated, or another database shares the cache
+                    func_eval_list_merge = [func_eval for func_eval in func_eval_list_cached if "uid" in func_eval] +\
+                            [func_eval for func_eval in func_eval_list_downloaded if "uid" not in func_eval]
+                    if len(func_eval_list_merge) > 0:
+                        # the local database may already have some of them (e.g. our own uploads)
+                        existing_uids = set([func_eval["uid"] for func_eval in self.query_func_eval(uids=[func_eval["uid"] for func_eval in func_eval_list_merge if "uid" in func_eval])]) if os.path.exists(json_data_path) else set()
+                        func_eval_list_merge = [func_eval for func_eval in func_eval_list_merge if "uid" not in func_eval or func_eval["uid"] not in existing_uids]
+                    if len(func_eval_list_merge) > 0:
+                        if not os.path.exists(json_data_path):
+                            self.create_history_data()
+                        print ("[HistoryDB] Merged " + str(len(func_eval_list_merge)) + " new function evaluations from the crowd repository")
+                        self.append_history_data("func_eval", func_eval_list_merge)
+                except Exception as e:
+                    print ("merging the crowd repository data failed: " + str(e))
 
             # Data can be loaded from the DB file (by reading) and/or the source_function_evaluations for TLA (provided by the user)
             # This num_loaded_data variable aggregates them, and if it's higher than 0, we update the data arrays, data.I/P/O.
@@ -804,31 +1921,39 @@ class HistoryDB(dict):
             if os.path.exists(json_data_path) or function_evaluations != None:
                 historical_function_evaluations = []
 
+                num_tasks = len(Tgiven)
+
+                PS_history = [[] for i in range(num_tasks)]
+                OS_history = [[] for i in range(num_tasks)]
+
+                task_id_index = self.build_task_id_index(problem, Tgiven)
+
+                if self.load_check == True:
+                    load_check_signature = self.load_check_signature(problem)
+
                 if os.path.exists(json_data_path):
                     print ("[HistoryDB] Found a history database file")
-                    if self.file_synchronization_method == 'filelock':
-                        with FileLock(json_data_path+".lock"):
-                            with open(json_data_path, "r") as f_in:
-                                history_data = json.load(f_in)
-                    elif self.file_synchronization_method == 'rsync':
-                        temp_path = json_data_path + "." + self.process_uid + ".temp"
-                        os.system("rsync -a " + json_data_path + " " + temp_path)
-                        with open(temp_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                        os.system("rm " + temp_path)
+                    if options != None and options["model_peeking_level"] > 1:
+                        # model peeking groups the evaluations by their storing order, so it needs all of them
+                        historical_function_evaluations.extend(self.query_func_eval())
                     else:
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                    historical_function_evaluations.extend(history_data["func_eval"])
+                        columnar_loaded = None
+                        if self.columnar_mirror == True:
+                            columnar_loaded = self.load_history_func_eval_columnar(data, problem, Tgiven, options, task_id_index)
+
+                        if columnar_loaded != None:
+                            (PS_history, OS_history, num_loaded_data) = columnar_loaded
+                            print ("[HistoryDB] Loaded " + str(num_loaded_data) + " function evaluations from the columnar mirror")
+                        else:
+                            modeling_filter = None
+                            if options != None and options["model_input_separation"] == True:
+                                modeling_filter = (self.modeling_load_type(data, options), options["model_class"])
+                            task_keys = [task_parameter_key({problem.IS[j].name:Tgiven[i][j] for j in range(len(problem.IS))}) for i in range(len(Tgiven))]
+                            historical_function_evaluations.extend(self.query_func_eval(task_keys=task_keys, modeling_filter=modeling_filter))
 
                 if function_evaluations != None:
                     historical_function_evaluations.extend(function_evaluations)
 
-                num_tasks = len(Tgiven)
-
-                PS_history = [[] for i in range(num_tasks)]
-                OS_history = [[] for i in range(num_tasks)]
-
                 if options != None and options["model_peeking_level"] > 1:
                     if problem.DO > 1:
                         print ("[Warning] currently, model peeking does not fully support multi-objective tuning")
@@ -850,8 +1975,8 @@ class HistoryDB(dict):
                         print ("best_y: ", best_y)
 
                         #if self.load_check == False or self.check_load_deps(func_eval):
-                        if self.load_check == False or (self.check_load_deps(func_eval) and self.check_space_boundary(problem, func_eval)):
-                            task_id = self.search_func_eval_task_id(func_eval, problem, Tgiven)
+                        if self.load_check == False or self.check_load_passed(problem, func_eval, load_check_signature):
+                            task_id = self.lookup_task_id(func_eval, task_id_index)
                             if (task_id != -1):
                                 # # current policy: skip loading the func eval result
                                 # # if the same parameter data has been loaded once (duplicated)
@@ -881,34 +2006,15 @@ class HistoryDB(dict):
                 else:
                     for func_eval in historical_function_evaluations:
                         if options != None and options["model_input_separation"] == True:
-                            if options["TLA_method"] == None:
-                                if len(data.I) == 1:
-                                    modeling_load = "SLA_GP"
-                                elif len(data.I) > 1:
-                                    modeling_load = "MLA_LCM"
-                            elif options["TLA_method"] == "Regression":
-                                modeling_load = "TLA_RegressionSum"
-                            elif options["TLA_method"] == "Sum":
-                                modeling_load = "TLA_Sum"
-                            elif options["TLA_method"] == "Stacking":
-                                modeling_load = "TLA_Stacking"
-                            elif options["TLA_method"] == "LCM_BF":
-                                modeling_load = "TLA_LCM_BF"
-                            elif options["TLA_method"] == "LCM":
-                                modeling_load = "TLA_LCM"
-                            else:
-                                if len(data.I) == 1:
-                                    modeling_load = "SLA_GP"
-                                elif len(data.I) > 1:
-                                    modeling_load = "MLA_LCM"
+                            modeling_load = self.modeling_load_type(data, options)
 
                             if func_eval["modeling"] != "Pilot" and \
                                (func_eval["modeling"] != modeling_load or
                                 func_eval["model_class"] != options["model_class"]):
                                 continue
 
-                        if self.load_check == False or (self.check_load_deps(func_eval) and self.check_space_boundary(problem, func_eval)):
-                            task_id = self.search_func_eval_task_id(func_eval, problem, Tgiven)
+                        if self.load_check == False or self.check_load_passed(problem, func_eval, load_check_signature):
+                            task_id = self.lookup_task_id(func_eval, task_id_index)
                             if (task_id != -1):
                                 # # current policy: skip loading the func eval result
                                 # # if the same parameter data has been loaded once (duplicated)
@@ -937,31 +2043,7 @@ class HistoryDB(dict):
                                     num_loaded_data += 1
             else:
                 print ("[HistoryDB] Create a JSON file at " + json_data_path)
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "w") as f_out:
-                            json_data = {"tuning_problem_name":self.tuning_problem_name,
-                                "tuning_problem_category":self.tuning_problem_category,
-                                "surrogate_model":[],
-                                "func_eval":[]}
-                            json.dump(json_data, f_out, indent=2)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    with open(temp_path, "w") as f_out:
-                        json_data = {"tuning_problem_name":self.tuning_problem_name,
-                            "tuning_problem_category":self.tuning_problem_category,
-                            "surrogate_model":[],
-                            "func_eval":[]}
-                        json.dump(json_data, f_out, indent=2)
-                    os.system("rsync -u " + temp_path + " " + json_data_path)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "w") as f_out:
-                        json_data = {"tuning_problem_name":self.tuning_problem_name,
-                            "tuning_problem_category":self.tuning_problem_category,
-                            "surrogate_model":[],
-                            "func_eval":[]}
-                        json.dump(json_data, f_out, indent=2)
+                self.create_history_data()
 
             if source_function_evaluations != None:
                 for source_task_id in range(len(source_function_evaluations)):
@@ -1035,23 +2117,10 @@ class HistoryDB(dict):
     def load_model_func_eval(self, data : Data, problem : Problem, Tgiven : np.ndarray, model_data : dict):
         """ Init history database JSON file """
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
             if os.path.exists(json_data_path):
                 print ("[HistoryDB] Found a history database file")
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                print ("history_data: ", history_data)
+                task_id_index = self.build_task_id_index(problem, Tgiven)
 
                 num_tasks = len(Tgiven)
 
@@ -1060,9 +2129,7 @@ class HistoryDB(dict):
                 PS_history = [[] for i in range(num_tasks)]
                 OS_history = [[] for i in range(num_tasks)]
 
-                # Assume that all function evaluations of the surrogate model are in the database file
-                for func_eval_uid in model_data["function_evaluations"]:
-                    func_eval = search_item_by_uid(history_data["func_eval"], func_eval_uid)
+                for func_eval in self.query_surrogate_model_func_evals([model_data])[0]:
                     print ("func_eval: ", func_eval)
                     parameter_arr = []
                     for k in range(len(problem.PS)):
@@ -1074,7 +2141,7 @@ class HistoryDB(dict):
                             parameter_arr.append(float(func_eval["tuning_parameter"][problem.PS[k].name]))
                         else:
                             parameter_arr.append(func_eval["tuning_parameter"][problem.PS[k].name])
-                    task_id = self.search_func_eval_task_id(func_eval, problem, Tgiven)
+                    task_id = self.lookup_task_id(func_eval, task_id_index)
                     PS_history[task_id].append(parameter_arr)
                     OS_history[task_id].append(\
                         [func_eval["evaluation_result"][problem.OS[k].name] \
@@ -1098,31 +2165,7 @@ class HistoryDB(dict):
             else:
                 print ("[HistoryDB] Create a JSON file at " + json_data_path)
 
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "w") as f_out:
-                            json_data = {"tuning_problem_name":self.tuning_problem_name,
-                                "tuning_problem_category":self.tuning_problem_category,
-                                "surrogate_model":[],
-                                "func_eval":[]}
-                            json.dump(json_data, f_out, indent=2)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    with open(temp_path, "w") as f_out:
-                        json_data = {"tuning_problem_name":self.tuning_problem_name,
-                            "tuning_problem_category":self.tuning_problem_category,
-                            "surrogate_model":[],
-                            "func_eval":[]}
-                        json.dump(json_data, f_out, indent=2)
-                    os.system("rsync -u " + temp_path + " " + json_data_path)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "w") as f_out:
-                        json_data = {"tuning_problem_name":self.tuning_problem_name,
-                            "tuning_problem_category":self.tuning_problem_category,
-                            "surrogate_model":[],
-                            "func_eval":[]}
-                        json.dump(json_data, f_out, indent=2)
+                self.create_history_data()
 
     def store_func_eval(self, problem : Problem,\
             task_parameter : np.ndarray,\
@@ -1139,7 +2182,7 @@ class HistoryDB(dict):
         # print (problem.constants)
 
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
 
             new_function_evaluation_results = []
 
@@ -1178,7 +2221,12 @@ class HistoryDB(dict):
             num_evals = len(tuning_parameter)
             for i in range(num_evals):
                 uid = uuid.uuid1()
+                session_index = len(self.uids)
                 self.uids.append(str(uid))
+                if len(self.session_ranges) > 0 and self.session_ranges[-1]["session_uid"] == self.session_uid:
+                    self.session_ranges[-1]["stop"] = session_index + 1
+                else:
+                    self.session_ranges.append({"session_uid":self.session_uid, "start":session_index, "stop":session_index + 1})
 
                 tuning_parameter_orig = problem.PS.inverse_transform(
                         np.array(tuning_parameter[i], ndmin=2))[0]
@@ -1235,67 +2283,31 @@ class HistoryDB(dict):
                             "tm_yday":now.tm_yday,
                             "tm_isdst":now.tm_isdst
                             },
+                        "session":{"uid":self.session_uid, "index":session_index},
                         "uid":str(uid)
                     }
 
                 new_function_evaluation_results.append(function_evaluation_document)
 
-                if self.sync_crowd_repo == True:
-                    print ("function_evaluation_document: ", str(function_evaluation_document))
-                    print ("API_KEY: ", self.crowdtuning_api_key)
+            if self.sync_crowd_repo == True:
+                self.upload_crowd_repo(new_function_evaluation_results)
 
-                    try:
-                        r = requests.post(url = self.crowd_repo_upload_url,
-                                headers={"x-api-key":self.crowdtuning_api_key},
-                                data={"tuning_problem_name":self.tuning_problem_name,
-                                    "tuning_problem_category":self.tuning_problem_category,
-                                    "function_evaluation_document":json.dumps(function_evaluation_document)},
-                                verify=False)
-                        if r.status_code == 200:
-                            print ("direct upload success")
-                        else:
-                            print ("request status_code: ", r.status_code)
-                    except:
-                        print ("direct upload failed")
-
-            if self.file_synchronization_method == 'filelock':
-                with FileLock(json_data_path+".lock"):
-                    with open(json_data_path, "r") as f_in:
-                        json_data = json.load(f_in)
-                        json_data["func_eval"] += new_function_evaluation_results
-                    with open(json_data_path, "w") as f_out:
-                        json.dump(json_data, f_out, indent=2)
-            elif self.file_synchronization_method == 'rsync':
-                while True:
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        json_data = json.load(f_in)
-                        json_data["func_eval"] += new_function_evaluation_results
-                    with open(temp_path, "w") as f_out:
-                        json.dump(json_data, f_out, indent=2)
-                    os.system("rsync -u " + temp_path + " " + json_data_path)
-                    os.system("rm " + temp_path)
-                    with open(json_data_path, "r") as f_in:
-                        json_data = json.load(f_in)
-                        existing_uids = [item["uid"] for item in json_data["func_eval"]]
-                        new_uids = [item["uid"] for item in new_function_evaluation_results]
-                        retry = False
-                        for uid in new_uids:
-                            if uid not in existing_uids:
-                                retry = True
-                                break
-                        if retry == False:
-                            break
-            else:
-                with open(json_data_path, "r") as f_in:
-                    json_data = json.load(f_in)
-                    json_data["func_eval"] += new_function_evaluation_results
-                with open(json_data_path, "w") as f_out:
-                    json.dump(json_data, f_out, indent=2)
+            self.buffer_func_eval(new_function_evaluation_results)
 
         return
 
+    def upload_crowd_repo(self, documents):
+        """ Hand function evaluation documents to the background uploader (see crowdrepo.CrowdUploadQueue) """
+        if self.crowd_upload_queue == None:
+            self.crowd_upload_queue = CrowdUploadQueue(self.crowd_repo_upload_url,
+                    self.crowdtuning_api_key,
+                    self.tuning_problem_name,
+                    self.tuning_problem_category,
+                    self.historydb_path+"/"+self.tuning_problem_name,
+                    batch_size=self.crowd_upload_batch_size,
+                    timeout=self.crowd_upload_timeout)
+        self.crowd_upload_queue.put(documents)
+
     def check_surrogate_model_exact_match(self,
             surrogate_model : dict,
             task_parameters_given: np.array,
@@ -1430,274 +2442,142 @@ class HistoryDB(dict):
             return ret
 
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
             if os.path.exists(json_data_path):
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-
-                num_models = len(history_data["surrogate_model"])
+                input_space_given = self.problem_space_to_dict(tuningproblem.input_space)
+                parameter_space_given = self.problem_space_to_dict(tuningproblem.parameter_space)
+                output_space_given = self.problem_space_to_dict(tuningproblem.output_space)
 
-                max_evals = 0
-                max_evals_index = -1 # TODO: if no model is found?
-                for i in range(num_models):
-                    surrogate_model = history_data["surrogate_model"][i]
+                for surrogate_model in self.query_surrogate_models(modeler=modeler):
                     if (self.check_surrogate_model_exact_match(
                         surrogate_model,
                         Tgiven,
-                        self.problem_space_to_dict(tuningproblem.input_space),
-                        self.problem_space_to_dict(tuningproblem.parameter_space),
-                        self.problem_space_to_dict(tuningproblem.output_space)) and
-                        surrogate_model["modeler"] == modeler):
+                        input_space_given,
+                        parameter_space_given,
+                        output_space_given)):
                         ret.append(surrogate_model)
 
         return ret
 
+    def surrogate_model_hyperparameters(self, surrogate_model : dict):
+        hyperparameters = surrogate_model["hyperparameters"]
+
+        parameter_names = []
+        for parameter_info in surrogate_model["parameter_space"]:
+            parameter_names.append(parameter_info["name"])
+
+        model_options = surrogate_model.get("modeling_options")
+
+        return (hyperparameters, parameter_names, model_options)
+
+    def load_matching_surrogate_models(self, tuningproblem : TuningProblem,
+            input_given : np.ndarray, objective : int, modeler : str):
+        input_space_given = self.problem_space_to_dict(tuningproblem.input_space)
+        parameter_space_given = self.problem_space_to_dict(tuningproblem.parameter_space)
+        output_space_given = self.problem_space_to_dict(tuningproblem.output_space)
+
+        return [index_entry for index_entry in self.query_surrogate_model_index(modeler=modeler, objective=objective)
+                if self.check_surrogate_model_exact_match(
+                    index_entry,
+                    input_given,
+                    input_space_given,
+                    parameter_space_given,
+                    output_space_given)]
+
     def load_MLE_surrogate_model_hyperparameters(self, tuningproblem : TuningProblem,
             input_given : np.ndarray, objective : int, modeler : str):
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
             if os.path.exists(json_data_path):
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-
                 max_mle = -9999
-                max_mle_index = -1
-                for i in range(len(history_data["surrogate_model"])):
-                    surrogate_model = history_data["surrogate_model"][i]
-                    if (self.check_surrogate_model_exact_match(
-                        surrogate_model,
-                        input_given,
-                        self.problem_space_to_dict(tuningproblem.input_space),
-                        self.problem_space_to_dict(tuningproblem.parameter_space),
-                        self.problem_space_to_dict(tuningproblem.output_space)) and
-                        surrogate_model["modeler"] == modeler and
-                        surrogate_model["objective"]["objective_id"] == objective):
-                        log_likelihood = surrogate_model["log_likelihood"]
-                        if log_likelihood > max_mle:
-                            max_mle = log_likelihood
-                            max_mle_index = i
-                if (max_mle_index == -1):
+                surrogate_model_mle = None
+                for surrogate_model in self.load_matching_surrogate_models(tuningproblem, input_given, objective, modeler):
+                    log_likelihood = surrogate_model["log_likelihood"]
+                    if log_likelihood > max_mle:
+                        max_mle = log_likelihood
+                        surrogate_model_mle = surrogate_model
+                if (surrogate_model_mle == None):
                     print ("Unable to find a model")
                     return None
 
-                hyperparameters =\
-                        history_data["surrogate_model"][max_mle_index]["hyperparameters"]
+                return self.surrogate_model_hyperparameters(self.load_surrogate_model(surrogate_model_mle))
 
-                parameter_names = []
-                for parameter_info in history_db["surrogate_model"][max_mle_index]["parameter_space"]:
-                    parameter_names.append(parameter_info["name"])
-
-                model_options = history_data["surrogate_model"][max_mle_index]["modeling_options"]
-
-        return (hyperparameters, parameter_names, model_options)
+        return None
 
     def load_AIC_surrogate_model_hyperparameters(self, tuningproblem : TuningProblem,
             input_given : np.ndarray, objective : int, modeler : str):
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
             if os.path.exists(json_data_path):
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-
                 min_aic = 99999
-                min_aic_index = -1
-                for i in range(len(history_data["surrogate_model"])):
-                    surrogate_model = history_data["surrogate_model"][i]
-                    if (self.check_surrogate_model_exact_match(
-                        surrogate_model,
-                        input_given,
-                        self.problem_space_to_dict(tuningproblem.input_space),
-                        self.problem_space_to_dict(tuningproblem.parameter_space),
-                        self.problem_space_to_dict(tuningproblem.output_space)) and
-                        surrogate_model["modeler"] == modeler and
-                        surrogate_model["objective"]["objective_id"] == objective):
-                        log_likelihood = surrogate_model["log_likelihood"]
-                        num_parameters = len(surrogate_model["hyperparameters"])
-                        AIC = -1.0 * 2.0 * log_likelihood + 2.0 * num_parameters
-                        if AIC < min_aic:
-                            min_aic = AIC
-                            min_aic_index = i
-                if (min_aic_index == -1):
+                surrogate_model_aic = None
+                for surrogate_model in self.load_matching_surrogate_models(tuningproblem, input_given, objective, modeler):
+                    log_likelihood = surrogate_model["log_likelihood"]
+                    num_parameters = surrogate_model["num_hyperparameters"]
+                    AIC = -1.0 * 2.0 * log_likelihood + 2.0 * num_parameters
+                    if AIC < min_aic:
+                        min_aic = AIC
+                        surrogate_model_aic = surrogate_model
+                if (surrogate_model_aic == None):
                     print ("Unable to find a model")
                     return None
 
-                hyperparameters =\
-                        history_data["surrogate_model"][min_aic_index]["hyperparameters"]
+                return self.surrogate_model_hyperparameters(self.load_surrogate_model(surrogate_model_aic))
 
-                parameter_names = []
-                for parameter_info in history_db["surrogate_model"][min_aic_index]["parameter_space"]:
-                    parameter_names.append(parameter_info["name"])
-
-                model_options = history_data["surrogate_model"][min_aic_index]["modeling_options"]
-
-        return (hyperparameters, parameter_names, model_options)
+        return None
 
     def load_BIC_surrogate_model_hyperparameters(self, tuningproblem : TuningProblem,
             input_given : np.ndarray, objective : int, modeler : str):
         import math
 
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
             if os.path.exists(json_data_path):
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-
                 min_bic = 99999
-                min_bic_index = -1
-                for i in range(len(history_data["surrogate_model"])):
-                    surrogate_model = history_data["surrogate_model"][i]
-                    if (self.check_surrogate_model_exact_match(
-                        surrogate_model,
-                        input_given,
-                        self.problem_space_to_dict(tuningproblem.input_space),
-                        self.problem_space_to_dict(tuningproblem.parameter_space),
-                        self.problem_space_to_dict(tuningproblem.output_space)) and
-                        surrogate_model["modeler"] == modeler and
-                        surrogate_model["objective"]["objective_id"] == objective):
-                        log_likelihood = surrogate_model["log_likelihood"]
-                        num_parameters = len(surrogate_model["hyperparameters"])
-                        num_samples = len(surrogate_model["function_evaluations"])
-                        BIC = -1.0 * 2.0 * log_likelihood + num_parameters * math.log(num_samples)
-                        if BIC < min_bic:
-                            min_bic = BIC
-                            min_bic_index = i
-                if (min_bic_index == -1):
+                surrogate_model_bic = None
+                for surrogate_model in self.load_matching_surrogate_models(tuningproblem, input_given, objective, modeler):
+                    log_likelihood = surrogate_model["log_likelihood"]
+                    num_parameters = surrogate_model["num_hyperparameters"]
+                    num_samples = surrogate_model["num_evals"]
+                    BIC = -1.0 * 2.0 * log_likelihood + num_parameters * math.log(num_samples)
+                    if BIC < min_bic:
+                        min_bic = BIC
+                        surrogate_model_bic = surrogate_model
+                if (surrogate_model_bic == None):
                     print ("Unable to find a model")
                     return None
 
-                hyperparameters =\
-                        history_data["surrogate_model"][min_bic_index]["hyperparameters"]
+                return self.surrogate_model_hyperparameters(self.load_surrogate_model(surrogate_model_bic))
 
-                parameter_names = []
-                for parameter_info in history_db["surrogate_model"][min_bic_index]["parameter_space"]:
-                    parameter_names.append(parameter_info["name"])
-
-                model_options = history_data["surrogate_model"][min_bic_index]["modeling_options"]
-
-        return (hyperparameters, parameter_names, model_options)
+        return None
 
     def load_max_evals_surrogate_model_hyperparameters(self, tuningproblem : TuningProblem,
             input_given : np.ndarray, objective : int, modeler : str):
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
             if os.path.exists(json_data_path):
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-
                 max_evals = 0
-                max_evals_index = -1 # TODO: if no model is found?
-                for i in range(len(history_data["surrogate_model"])):
-                    surrogate_model = history_data["surrogate_model"][i]
-                    if (self.check_surrogate_model_exact_match(
-                        surrogate_model,
-                        input_given,
-                        self.problem_space_to_dict(tuningproblem.input_space),
-                        self.problem_space_to_dict(tuningproblem.parameter_space),
-                        self.problem_space_to_dict(tuningproblem.output_space)) and
-                        surrogate_model["modeler"] == modeler and
-                        surrogate_model["objective"]["objective_id"] == objective):
-                        num_evals = len(history_data["surrogate_model"][i]["function_evaluations"])
-                        if num_evals > max_evals:
-                            max_evals = num_evals
-                            max_evals_index = i
-                if (max_evals_index == -1):
+                surrogate_model_max_evals = None
+                for surrogate_model in self.load_matching_surrogate_models(tuningproblem, input_given, objective, modeler):
+                    num_evals = surrogate_model["num_evals"]
+                    if num_evals > max_evals:
+                        max_evals = num_evals
+                        surrogate_model_max_evals = surrogate_model
+                if (surrogate_model_max_evals == None):
                     print ("Unable to find a model")
                     return None
 
-                hyperparameters =\
-                        history_data["surrogate_model"][max_evals_index]["hyperparameters"]
-
-                parameter_names = []
-                for parameter_info in history_data["surrogate_model"][max_evals_index]["parameter_space"]:
-                    parameter_names.append(parameter_info["name"])
+                return self.surrogate_model_hyperparameters(self.load_surrogate_model(surrogate_model_max_evals))
 
-                model_options = history_data["surrogate_model"][max_evals_index]["modeling_options"]
-
-        return (hyperparameters, parameter_names, model_options)
+        return None
 
     def load_surrogate_model_hyperparameters_by_uid(self, model_uid):
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
             if os.path.exists(json_data_path):
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-
-                surrogate_model = history_data["surrogate_model"]
-                num_models = len(surrogate_model)
-                for i in range(num_models):
-                    if surrogate_model[i]["uid"] == model_uid:
-                        hyperparameters = surrogate_model[i]["hyperparameters"]
-                        parameter_names = []
-                        for parameter_info in surrogate_model[i]["parameter_space"]:
-                            parameter_names.append(parameter_info["name"])
-                        model_options = surrogate_model[i]["modeling_options"]
-                        return (hyperparameters, parameter_names, model_options)
+                for index_entry in self.query_surrogate_model_index():
+                    if index_entry["uid"] == model_uid:
+                        return self.surrogate_model_hyperparameters(self.load_surrogate_model(index_entry))
 
         return []
 
@@ -1711,41 +2591,29 @@ class HistoryDB(dict):
             modeler: str):
             #tuningproblem : TuningProblem,
             #input_given : np.ndarray, objective : int, modeler : str):
+        surrogate_model_max_evals = None
+
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
             if os.path.exists(json_data_path):
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-
                 max_evals = 0
-                max_evals_index = -1 # TODO: if no model is found?
-                for i in range(len(history_data["surrogate_model"])):
-                    surrogate_model = history_data["surrogate_model"][i]
-                    if (self.check_surrogate_model_usable(surrogate_model,
+                for index_entry in self.query_surrogate_model_index(modeler=modeler, objective=objective):
+                    if (self.check_surrogate_model_usable(index_entry,
                         task_parameters_given,
                         input_space_given,
                         parameter_space_given,
-                        output_space_given) and
-                        surrogate_model["modeler"] == modeler and
-                        surrogate_model["objective"]["objective_id"] == objective):
+                        output_space_given)):
+
+                        num_evals = index_entry["num_evals"]
+                        if num_evals <= max_evals:
+                            continue
+                        surrogate_model = self.load_surrogate_model(index_entry)
 
                         tuning_configuration_match = True
-                        for func_eval_uid in surrogate_model["function_evaluations"]:
-                            func_eval = search_item_by_uid(history_data["func_eval"], func_eval_uid)
-                            #print ("tuning_configuration (machine): ", tuning_configuration["machine_configuration"])
-                            #print ("func_eval (machine):            ", func_eval["machine_configuration"])
-                            if tuning_configuration != None:
+                        if tuning_configuration != None:
+                            for func_eval in self.query_surrogate_model_func_evals([surrogate_model])[0]:
+                                #print ("tuning_configuration (machine): ", tuning_configuration["machine_configuration"])
+                                #print ("func_eval (machine):            ", func_eval["machine_configuration"])
                                 if str(tuning_configuration["machine_configuration"]) != str(func_eval["machine_configuration"]):
                                     #print ("not same")
                                     tuning_configuration_match = False
@@ -1753,19 +2621,17 @@ class HistoryDB(dict):
                                 #else:
                                 #    print ("same")
 
-                            #if tuning_configuration != None and tuning_configuration["software_configuration"] != func_eval["software_configuration"]:
-                            #    tuning_configuration_match = False
-                            #    break
+                                #if tuning_configuration["software_configuration"] != func_eval["software_configuration"]:
+                                #    tuning_configuration_match = False
+                                #    break
                         if tuning_configuration_match:
-                            num_evals = len(history_data["surrogate_model"][i]["function_evaluations"])
-                            if num_evals > max_evals:
-                                max_evals = num_evals
-                                max_evals_index = i
-                if (max_evals_index == -1):
+                            max_evals = num_evals
+                            surrogate_model_max_evals = surrogate_model
+                if (surrogate_model_max_evals == None):
                     print ("Unable to find a surrogate model")
                     return None
 
-        return history_data["surrogate_model"][max_evals_index]
+        return surrogate_model_max_evals
 
     def load_surrogate_model_configurations(self,
             task_parameters_given: np.ndarray,
@@ -1780,44 +2646,30 @@ class HistoryDB(dict):
         model_configurations = []
 
         if (self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
+            json_data_path = self.historydb_data_path()
             if os.path.exists(json_data_path):
-                if self.file_synchronization_method == 'filelock':
-                    with FileLock(json_data_path+".lock"):
-                        with open(json_data_path, "r") as f_in:
-                            history_data = json.load(f_in)
-                elif self.file_synchronization_method == 'rsync':
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        history_data = json.load(f_in)
-                    os.system("rm " + temp_path)
-                else:
-                    with open(json_data_path, "r") as f_in:
-                        history_data = json.load(f_in)
-
-                for surrogate_model in history_data["surrogate_model"]:
-
-                    if (self.check_surrogate_model_usable(surrogate_model,
+                surrogate_models = [self.load_surrogate_model(index_entry) for index_entry in self.query_surrogate_model_index(modeler=modeler, objective=objective)
+                    if self.check_surrogate_model_usable(index_entry,
                         task_parameters_given,
                         input_space_given,
                         parameter_space_given,
-                        output_space_given) and
-                        surrogate_model["modeler"] == modeler and
-                        surrogate_model["objective_id"] == objective):
-                        #print (surrogate_model)
+                        output_space_given)]
+
+                surrogate_model_func_evals = self.query_surrogate_model_func_evals(surrogate_models)
 
-                        for func_eval_uid in surrogate_model["function_evaluations"]:
-                            func_eval = search_item_by_uid(history_data["func_eval"], func_eval_uid)
+                for surrogate_model, func_evals in zip(surrogate_models, surrogate_model_func_evals):
+                    #print (surrogate_model)
 
-                            configuration = {
-                                    "task_parameters": surrogate_model["task_parameters"],
-                                    "machine_configuration": func_eval["machine_configuration"],
-                                    "software_configuration": func_eval["software_configuration"]
-                                    }
+                    for func_eval in func_evals:
 
-                            if configuration not in model_configurations:
-                                model_configurations.append(configuration)
+                        configuration = {
+                                "task_parameters": surrogate_model["task_parameters"],
+                                "machine_configuration": func_eval["machine_configuration"],
+                                "software_configuration": func_eval["software_configuration"]
+                                }
+
+                        if configuration not in model_configurations:
+                            model_configurations.append(configuration)
 
         return (model_configurations)
 
@@ -1874,11 +2726,10 @@ class HistoryDB(dict):
             bestxopt : np.ndarray,\
             neg_log_marginal_likelihood : float,\
             gradients : np.ndarray,\
-            iteration : int):
+            iteration : int,\
+            num_samples : int = None):
 
         if (self.save_model== True and self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
-
             new_surrogate_models = []
 
             now = time.localtime()
@@ -1916,7 +2767,8 @@ class HistoryDB(dict):
                     "hyperparameters":bestxopt.tolist(),
                     "model_stats":model_stats,
                     "task_parameters":task_parameter_orig_list,
-                    "function_evaluations":self.uids,
+                    "function_evaluation_ranges":[dict(evaluation_range) for evaluation_range in self.session_ranges],
+                    "num_samples":num_samples,
                     "input_space":self.problem_space_to_dict(problem.IS),
                     "parameter_space":self.problem_space_to_dict(problem.PS),
                     "output_space":self.problem_space_to_dict(problem.OS),
@@ -1938,41 +2790,8 @@ class HistoryDB(dict):
                     # we might need a nicer way to manage different models
                 })
 
-            if self.file_synchronization_method == 'filelock':
-                with FileLock(json_data_path+".lock"):
-                    with open(json_data_path, "r") as f_in:
-                        json_data = json.load(f_in)
-                        json_data["surrogate_model"] += new_surrogate_models
-                    with open(json_data_path, "w") as f_out:
-                        json.dump(json_data, f_out, indent=2)
-            elif self.file_synchronization_method == 'rsync':
-                while True:
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        json_data = json.load(f_in)
-                        json_data["surrogate_model"] += new_surrogate_models
-                    with open(temp_path, "w") as f_out:
-                        json.dump(json_data, f_out, indent=2)
-                    os.system("rsync -u " + temp_path + " " + json_data_path)
-                    os.system("rm " + temp_path)
-                    with open(json_data_path, "r") as f_in:
-                        json_data = json.load(f_in)
-                        existing_uids = [item["uid"] for item in json_data["surrogate_model"]]
-                        new_uids = [item["uid"] for item in new_surrogate_models]
-                        retry = False
-                        for uid in new_uids:
-                            if uid not in existing_uids:
-                                retry = True
-                                break
-                        if retry == False:
-                            break
-            else:
-                with open(json_data_path, "r") as f_in:
-                    json_data = json.load(f_in)
-                    json_data["surrogate_model"] += new_surrogate_models
-                with open(json_data_path, "w") as f_out:
-                    json.dump(json_data, f_out, indent=2)
+            for surrogate_model in new_surrogate_models:
+                self.store_surrogate_model(surrogate_model)
 
         return
 
@@ -1982,11 +2801,10 @@ class HistoryDB(dict):
             input_given : np.ndarray,\
             hyperparameters : dict,\
             modeling_options : dict,\
-            model_stats : dict):
+            model_stats : dict,\
+            num_samples : int = None):
 
         if (self.save_model== True and self.tuning_problem_name is not None):
-            json_data_path = self.historydb_path+"/"+self.tuning_problem_name+".json"
-
             new_surrogate_models = []
 
             now = time.localtime()
@@ -2002,7 +2820,8 @@ class HistoryDB(dict):
                     "modeling_options":modeling_options,
                     "model_stats":model_stats,
                     "task_parameters":task_parameter_orig_list,
-                    "function_evaluations":self.uids,
+                    "function_evaluation_ranges":[dict(evaluation_range) for evaluation_range in self.session_ranges],
+                    "num_samples":num_samples,
                     "input_space":self.problem_space_to_dict(problem.IS),
                     "parameter_space":self.problem_space_to_dict(problem.PS),
                     "output_space":self.problem_space_to_dict(problem.OS),
@@ -2024,40 +2843,31 @@ class HistoryDB(dict):
                     # we might need a nicer way to manage different models
                 })
 
-            if self.file_synchronization_method == 'filelock':
-                with FileLock(json_data_path+".lock"):
-                    with open(json_data_path, "r") as f_in:
-                        json_data = json.load(f_in)
-                        json_data["surrogate_model"] += new_surrogate_models
-                    with open(json_data_path, "w") as f_out:
-                        json.dump(json_data, f_out, indent=2)
-            elif self.file_synchronization_method == 'rsync':
-                while True:
-                    temp_path = json_data_path + "." + self.process_uid + ".temp"
-                    os.system("rsync -a " + json_data_path + " " + temp_path)
-                    with open(temp_path, "r") as f_in:
-                        json_data = json.load(f_in)
-                        json_data["surrogate_model"] += new_surrogate_models
-                    with open(temp_path, "w") as f_out:
-                        json.dump(json_data, f_out, indent=2)
-                    os.system("rsync -u " + temp_path + " " + json_data_path)
-                    os.system("rm " + temp_path)
-                    with open(json_data_path, "r") as f_in:
-                        json_data = json.load(f_in)
-                        existing_uids = [item["uid"] for item in json_data["surrogate_model"]]
-                        new_uids = [item["uid"] for item in new_surrogate_models]
-                        retry = False
-                        for uid in new_uids:
-                            if uid not in existing_uids:
-                                retry = True
-                                break
-                        if retry == False:
-                            break
-            else:
-                with open(json_data_path, "r") as f_in:
-                    json_data = json.load(f_in)
-                    json_data["surrogate_model"] += new_surrogate_models
-                with open(json_data_path, "w") as f_out:
-                    json.dump(json_data, f_out, indent=2)
+            for surrogate_model in new_surrogate_models:
+                self.store_surrogate_model(surrogate_model)
 
         return
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="GPTune history database utilities")
+    subparsers = parser.add_subparsers(dest="command")
+    parser_compact = subparsers.add_parser("compact", help="compact a JSON-lines (or SQLite) history database")
+    parser_compact.add_argument("path", type=str)
+    parser_convert = subparsers.add_parser("convert", help="convert between .json, .jsonl and .sqlite history databases")
+    parser_convert.add_argument("src", type=str)
+    parser_convert.add_argument("dst", type=str)
+    for subparser in [parser_compact, parser_convert]:
+        subparser.add_argument("--sync", type=str, default="filelock", choices=["filelock", "atomic", "none"],
+                help="how concurrent GPTune writers are locked out: 'filelock' (flock), 'atomic' (lock files created with O_EXCL, where flock is not supported), or 'none'")
+    args = parser.parse_args()
+
+    if args.command == "compact":
+        with history_file_lock(args.path, args.sync):
+            compact_journal_file(args.path)
+    elif args.command == "convert":
+        with history_file_lock(args.src, args.sync):
+            convert_history_file(args.src, args.dst)
+    else:
+        parser.print_help()
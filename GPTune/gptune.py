@@ -83,6 +83,7 @@ class GPTune(object):
 
         PS_history = [[] for i in range(num_tasks)]
         OS_history = [[] for i in range(num_tasks)]
+        task_id_index = self.historydb.build_task_id_index(self.problem, Tgiven)
         for func_eval in function_evaluations:
             parameter_arr = []
             for k in range(len(self.problem.PS)):
@@ -94,7 +95,7 @@ class GPTune(object):
                     parameter_arr.append(float(func_eval["tuning_parameter"][self.problem.PS[k].name]))
                 else:
                     parameter_arr.append(func_eval["tuning_parameter"][self.problem.PS[k].name])
-            task_id = self.historydb.search_func_eval_task_id(func_eval, self.problem, Tgiven)
+            task_id = self.historydb.lookup_task_id(func_eval, task_id_index)
             if task_id >= 0:
                 PS_history[task_id].append(parameter_arr)
                 OS_history[task_id].append(\
@@ -377,7 +378,8 @@ class GPTune(object):
             "time_loaddata": 0,
             "func_eval_time":[],
             "modeling_time":[],
-            "modeling_iteration":[]
+            "modeling_iteration":[],
+            "modeling_iteration_total":[]
         }
         time_fun=0
         time_search=0
@@ -491,6 +493,7 @@ class GPTune(object):
             newdata = Data(problem = self.problem, I = self.data.I, D = self.data.D)
             print("Iteration: ",optiter)
             stats["modeling_iteration"].append(0)
+            stats["modeling_iteration_total"].append(0)
             optiter = optiter + 1
             model_reupdate = model_reupdate + 1
             for o in range(self.problem.DO):
@@ -533,6 +536,7 @@ class GPTune(object):
                                 gradients,
                                 iteration)
                         stats["modeling_iteration"][optiter-1] += iteration
+                        stats["modeling_iteration_total"][optiter-1] += modelers[o].iteration_total
                     else:
                         (hyperparameters, modeling_options, model_stats) = modelers[o].train(data = tmpdata, **kwargs)
                         self.historydb.store_model_GPy_LCM(
@@ -545,6 +549,8 @@ class GPTune(object):
                         stats["modeling_iteration"][optiter-1] += 0
                     model_reupdate = 0
                 else:
+                    # keep the hyperparameters, but append the new samples to the posterior
+                    modelers[o].update(tmpdata, do_train = False, **kwargs)
                     if (kwargs["model_class"] == "Model_LCM"):
                         stats["modeling_iteration"][optiter-1] += 0
 
@@ -633,6 +639,24 @@ class GPTune(object):
 
         return
 
+    def warm_start_modeler_from_db(self, modeler, objective : int, data : Data, **kwargs):
+
+        """ Let the first training of the run start from the most recent compatible model in the history database (options['model_warm_start_from_db']) """
+
+        surrogate_model = self.historydb.query_latest_surrogate_model(self.problem, self.data.I, objective, kwargs["model_class"])
+        if surrogate_model is None:
+            return
+
+        num_samples = sum([len(P_) for P_ in data.P])
+        modeler.hyperparameters_history = surrogate_model["hyperparameters"]
+        modeler.retrain_history = True
+        if (kwargs["model_retrain_min_new_samples"] is not None and surrogate_model.get("num_samples") is not None):
+            modeler.retrain_history = (num_samples - surrogate_model["num_samples"] >= kwargs["model_retrain_min_new_samples"])
+        if (modeler.retrain_history):
+            print ("warm start from the stored model ", surrogate_model["uid"])
+        else:
+            print ("reuse the stored model ", surrogate_model["uid"], " (", num_samples - surrogate_model["num_samples"], " new samples)")
+
     def MLA_(self, NS, NS1 = None, NI = None, Tgiven = None, T_sampleflag = None, function_evaluations = None, source_function_evaluations = None, models_transfer = None, mfs = None, **kwargs):
         stats = {
             "time_total": 0,
@@ -644,7 +668,8 @@ class GPTune(object):
             "func_eval_time":[],
             "search_time":[],
             "modeling_time":[],
-            "modeling_iteration":[]
+            "modeling_iteration":[],
+            "modeling_iteration_total":[]
         }
         time_fun=0
         time_sample_init=0
@@ -737,7 +762,8 @@ class GPTune(object):
                 raise Exception("Number of problems to be generated (NI) is not defined")
 
             check_constraints = functools.partial(self.computer.evaluate_constraints, self.problem, inputs_only = True, kwargs = kwargs)
-            self.data.I = sampler.sample_inputs(n_samples = NI, IS = self.problem.IS, check_constraints = check_constraints, **kwargs)
+            check_constraints_batch = functools.partial(self.computer.evaluate_constraints_batch, self.problem, inputs_only = True, kwargs = kwargs)
+            self.data.I = sampler.sample_inputs(n_samples = NI, IS = self.problem.IS, check_constraints = check_constraints, check_constraints_batch = check_constraints_batch, **kwargs)
             # print("riji",type(self.data.I),type(self.data.I[0]))
             self.data.D = [{}] * NI
         else:
@@ -787,7 +813,8 @@ class GPTune(object):
                 NS1 = 1
             if (NSmin<NS1):
                 check_constraints = functools.partial(self.computer.evaluate_constraints, self.problem, inputs_only = False, kwargs = kwargs)
-                tmpP = sampler.sample_parameters(problem = self.problem, n_samples = NS1-NSmin, I = self.data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, **kwargs)
+                check_constraints_batch = functools.partial(self.computer.evaluate_constraints_batch, self.problem, inputs_only = False, kwargs = kwargs)
+                tmpP = sampler.sample_parameters(problem = self.problem, n_samples = NS1-NSmin, I = self.data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, check_constraints_batch = check_constraints_batch, **kwargs)
                 for i in range(NI):
                     if(T_sampleflag[i]== False):
                         tmpP[i] = np.empty(shape=(0,self.problem.DP))
@@ -854,6 +881,7 @@ class GPTune(object):
             newdata = Data(problem = self.problem, I = self.data.I, D = self.data.D)
             print("Iteration: ",optiter)
             stats["modeling_iteration"].append(0)
+            stats["modeling_iteration_total"].append(0)
             optiter = optiter + 1
             
             for o in range(self.problem.DO):
@@ -966,28 +994,37 @@ class GPTune(object):
                         tmpdata.O[i] = tmpdata.O[i][0:NSmin,:]
                         tmpdata.P[i] = tmpdata.P[i][0:NSmin,:]
 
+                    if (kwargs["model_warm_start_from_db"] == True and optiter == 1):
+                        self.warm_start_modeler_from_db(modelers[o], o, tmpdata, **kwargs)
                     (bestxopt, neg_log_marginal_likelihood,
                             gradients, iteration) = \
                         modelers[o].train(data = tmpdata, **kwargs)
-                    self.historydb.store_model_LCM(
-                            o,
-                            self.problem,
-                            self.data.I,
-                            bestxopt,
-                            neg_log_marginal_likelihood,
-                            gradients,
-                            iteration)
+                    if (not modelers[o].reused_history): # a reused model is already in the database
+                        self.historydb.store_model_LCM(
+                                o,
+                                self.problem,
+                                self.data.I,
+                                bestxopt,
+                                neg_log_marginal_likelihood,
+                                gradients,
+                                iteration,
+                                num_samples = sum([len(P_) for P_ in tmpdata.P]))
                     stats["modeling_iteration"][optiter-1] += iteration
+                    stats["modeling_iteration_total"][optiter-1] += modelers[o].iteration_total
                 else:
                     # print(tmpdata.O)
+                    if (kwargs["model_warm_start_from_db"] == True and optiter == 1 and kwargs["model_class"] == "Model_GPy_LCM"):
+                        self.warm_start_modeler_from_db(modelers[o], o, tmpdata, **kwargs)
                     (hyperparameters, modeling_options, model_stats) = modelers[o].train(data = tmpdata, **kwargs)
-                    self.historydb.store_model_GPy_LCM(
-                            o,
-                            self.problem,
-                            self.data.I,
-                            hyperparameters,
-                            modeling_options,
-                            model_stats)
+                    if (not modelers[o].reused_history): # a reused model is already in the database
+                        self.historydb.store_model_GPy_LCM(
+                                o,
+                                self.problem,
+                                self.data.I,
+                                hyperparameters,
+                                modeling_options,
+                                model_stats,
+                                num_samples = sum([len(P_) for P_ in tmpdata.P]))
 
                 if self.options['verbose'] == True and self.options['model_class'] == 'Model_LCM' and len(self.data.I)>1:
                     C = modelers[o].M.kern.get_correlation_metric()
@@ -1470,28 +1507,27 @@ class GPTune(object):
                     (data, model, stats) = self.MLA_(n_sample, NS1, NI, Tnew_)
 
                 # currently hard coded.. it will work only for single target task TLA
-                with open(self.historydb.historydb_path+"/"+self.historydb.tuning_problem_name+".json", "r") as f_in:
-                    loaded_function_evaluations = json.load(f_in)["func_eval"]
-
-                    for TLA_option in TLA_options:
-                        if TLA_option == "Sum":
-                            modeling_load = "TLA_Sum"
-                        elif TLA_option == "Regression":
-                            modeling_load = "TLA_RegressionSum"
-                        elif TLA_option == "LCM_BF":
-                            modeling_load = "TLA_LCM_BF"
-                        elif TLA_option == "LCM":
-                            modeling_load = "TLA_LCM"
-                        elif TLA_option == "Stacking":
-                            modeling_load = "TLA_Stacking"
-
-                        best_result_ = None
-                        for i in range(len(loaded_function_evaluations)):
-                            func_eval = loaded_function_evaluations[i]
-                            if func_eval["modeling"] == modeling_load:
-                                if best_result_ == None or func_eval["evaluation_result"][objective_name] < best_result_:
-                                    best_result_ = func_eval["evaluation_result"][objective_name]
-                                    best_result[TLA_option] = best_result_
+                loaded_function_evaluations = self.historydb.read_history_data()["func_eval"]
+
+                for TLA_option in TLA_options:
+                    if TLA_option == "Sum":
+                        modeling_load = "TLA_Sum"
+                    elif TLA_option == "Regression":
+                        modeling_load = "TLA_RegressionSum"
+                    elif TLA_option == "LCM_BF":
+                        modeling_load = "TLA_LCM_BF"
+                    elif TLA_option == "LCM":
+                        modeling_load = "TLA_LCM"
+                    elif TLA_option == "Stacking":
+                        modeling_load = "TLA_Stacking"
+
+                    best_result_ = None
+                    for i in range(len(loaded_function_evaluations)):
+                        func_eval = loaded_function_evaluations[i]
+                        if func_eval["modeling"] == modeling_load:
+                            if best_result_ == None or func_eval["evaluation_result"][objective_name] < best_result_:
+                                best_result_ = func_eval["evaluation_result"][objective_name]
+                                best_result[TLA_option] = best_result_
 
             return (data, model, stats)
 
@@ -1600,28 +1636,27 @@ class GPTune(object):
                     (data, model, stats) = self.MLA_(n_sample, NS1, NI, Tnew_)
 
                 # currently hard coded..
-                with open(self.historydb.historydb_path+"/"+self.historydb.tuning_problem_name+".json", "r") as f_in:
-                    loaded_function_evaluations = json.load(f_in)["func_eval"]
-
-                    for TLA_option in TLA_options:
-                        if TLA_option == "Sum":
-                            modeling_load = "TLA_Sum"
-                        elif TLA_option == "Regression":
-                            modeling_load = "TLA_RegressionSum"
-                        elif TLA_option == "LCM_BF":
-                            modeling_load = "TLA_LCM_BF"
-                        elif TLA_option == "LCM":
-                            modeling_load = "TLA_LCM"
-                        elif TLA_option == "Stacking":
-                            modeling_load = "TLA_Stacking"
-
-                        best_result_ = None
-                        for i in range(len(loaded_function_evaluations)):
-                            func_eval = loaded_function_evaluations[i]
-                            if func_eval["modeling"] == modeling_load:
-                                if best_result_ == None or func_eval["evaluation_result"][objective_name] < best_result_:
-                                    best_result_ = func_eval["evaluation_result"][objective_name]
-                                    best_result[TLA_option] = best_result_
+                loaded_function_evaluations = self.historydb.read_history_data()["func_eval"]
+
+                for TLA_option in TLA_options:
+                    if TLA_option == "Sum":
+                        modeling_load = "TLA_Sum"
+                    elif TLA_option == "Regression":
+                        modeling_load = "TLA_RegressionSum"
+                    elif TLA_option == "LCM_BF":
+                        modeling_load = "TLA_LCM_BF"
+                    elif TLA_option == "LCM":
+                        modeling_load = "TLA_LCM"
+                    elif TLA_option == "Stacking":
+                        modeling_load = "TLA_Stacking"
+
+                    best_result_ = None
+                    for i in range(len(loaded_function_evaluations)):
+                        func_eval = loaded_function_evaluations[i]
+                        if func_eval["modeling"] == modeling_load:
+                            if best_result_ == None or func_eval["evaluation_result"][objective_name] < best_result_:
+                                best_result_ = func_eval["evaluation_result"][objective_name]
+                                best_result[TLA_option] = best_result_
 
             return (data, model, stats)
 
@@ -1636,7 +1671,8 @@ class GPTune(object):
             "func_eval_time":[],
             "search_time":[],
             "modeling_time":[],
-            "modeling_iteration":[]
+            "modeling_iteration":[],
+            "modeling_iteration_total":[]
         }
         time_fun=0
         time_sample_init=0
@@ -1703,7 +1739,8 @@ class GPTune(object):
                 raise Exception("Number of problems to be generated (NI) is not defined")
 
             check_constraints = functools.partial(self.computer.evaluate_constraints, self.problem, inputs_only = True, kwargs = kwargs)
-            self.data.I = sampler.sample_inputs(n_samples = NI, IS = self.problem.IS, check_constraints = check_constraints, **kwargs)
+            check_constraints_batch = functools.partial(self.computer.evaluate_constraints_batch, self.problem, inputs_only = True, kwargs = kwargs)
+            self.data.I = sampler.sample_inputs(n_samples = NI, IS = self.problem.IS, check_constraints = check_constraints, check_constraints_batch = check_constraints_batch, **kwargs)
             # print("riji",type(self.data.I),type(self.data.I[0]))
             self.data.D = [{}] * NI
         else:
@@ -1735,7 +1772,8 @@ class GPTune(object):
             is_pilot = True
             if (NSmin<NS1):
                 check_constraints = functools.partial(self.computer.evaluate_constraints, self.problem, inputs_only = False, kwargs = kwargs)
-                tmpP = sampler.sample_parameters(problem = self.problem, n_samples = NS1-NSmin, I = self.data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, **kwargs)
+                check_constraints_batch = functools.partial(self.computer.evaluate_constraints_batch, self.problem, inputs_only = False, kwargs = kwargs)
+                tmpP = sampler.sample_parameters(problem = self.problem, n_samples = NS1-NSmin, I = self.data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, check_constraints_batch = check_constraints_batch, **kwargs)
                 if(self.data.P is not None):
                     for i in range(len(self.data.P)):
                         NSi = self.data.P[i].shape[0]
@@ -1787,6 +1825,7 @@ class GPTune(object):
             newdata = Data(problem = self.problem, I = self.data.I, D = self.data.D)
             print("Iteration: ", optiter)
             stats["modeling_iteration"].append(0)
+            stats["modeling_iteration_total"].append(0)
             optiter = optiter + 1
             for o in range(self.problem.DO):
                 t1 = time.time_ns()
@@ -1890,6 +1929,7 @@ class GPTune(object):
                             gradients,
                             iteration)
                     stats["modeling_iteration"][optiter-1] += iteration
+                    stats["modeling_iteration_total"][optiter-1] += modelers[o].iteration_total
                 else:
                     (hyperparameters, modeling_options, model_stats) = modelers[o].train(data = tmpdata, **kwargs)
                     self.historydb.store_model_GPy_LCM(
@@ -1963,7 +2003,8 @@ class GPTune(object):
             "func_eval_time":[],
             "search_time":[],
             "modeling_time":[],
-            "modeling_iteration":[]
+            "modeling_iteration":[],
+            "modeling_iteration_total":[]
         }
         time_fun=0
         time_sample_init=0
@@ -2031,7 +2072,8 @@ class GPTune(object):
                 raise Exception("Number of problems to be generated (NI) is not defined")
 
             check_constraints = functools.partial(self.computer.evaluate_constraints, self.problem, inputs_only = True, kwargs = kwargs)
-            self.data.I = sampler.sample_inputs(n_samples = NI, IS = self.problem.IS, check_constraints = check_constraints, **kwargs)
+            check_constraints_batch = functools.partial(self.computer.evaluate_constraints_batch, self.problem, inputs_only = True, kwargs = kwargs)
+            self.data.I = sampler.sample_inputs(n_samples = NI, IS = self.problem.IS, check_constraints = check_constraints, check_constraints_batch = check_constraints_batch, **kwargs)
             # print("riji",type(self.data.I),type(self.data.I[0]))
             self.data.D = [{}] * NI
         else:
@@ -2061,7 +2103,8 @@ class GPTune(object):
         else:
             if (NSmin<NS1):
                 check_constraints = functools.partial(self.computer.evaluate_constraints, self.problem, inputs_only = False, kwargs = kwargs)
-                tmpP = sampler.sample_parameters(problem = self.problem, n_samples = NS1-NSmin, I = self.data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, **kwargs)
+                check_constraints_batch = functools.partial(self.computer.evaluate_constraints_batch, self.problem, inputs_only = False, kwargs = kwargs)
+                tmpP = sampler.sample_parameters(problem = self.problem, n_samples = NS1-NSmin, I = self.data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, check_constraints_batch = check_constraints_batch, **kwargs)
                 if(self.data.P is not None):
                     for i in range(len(self.data.P)):
                         NSi = self.data.P[i].shape[0]
@@ -2113,6 +2156,7 @@ class GPTune(object):
             newdata = Data(problem = self.problem, I = self.data.I, D = self.data.D)
             print("Iteration: ", optiter)
             stats["modeling_iteration"].append(0)
+            stats["modeling_iteration_total"].append(0)
             optiter = optiter + 1
             
             for o in range(self.problem.DO):
@@ -2208,6 +2252,7 @@ class GPTune(object):
                             gradients,
                             iteration)
                     stats["modeling_iteration"][optiter-1] += iteration
+                    stats["modeling_iteration_total"][optiter-1] += modelers[o].iteration_total
                 else:
                     (hyperparameters, modeling_options, model_stats) = modelers[o].train(data = tmpdata, **kwargs)
                     self.historydb.store_model_GPy_LCM(
@@ -2282,7 +2327,8 @@ class GPTune(object):
             "func_eval_time":[],
             "search_time":[],
             "modeling_time":[],
-            "modeling_iteration":[]
+            "modeling_iteration":[],
+            "modeling_iteration_total":[]
         }
         time_fun=0
         time_sample_init=0
@@ -2349,7 +2395,8 @@ class GPTune(object):
                 raise Exception("Number of problems to be generated (NI) is not defined")
 
             check_constraints = functools.partial(self.computer.evaluate_constraints, self.problem, inputs_only = True, kwargs = kwargs)
-            self.data.I = sampler.sample_inputs(n_samples = NI, IS = self.problem.IS, check_constraints = check_constraints, **kwargs)
+            check_constraints_batch = functools.partial(self.computer.evaluate_constraints_batch, self.problem, inputs_only = True, kwargs = kwargs)
+            self.data.I = sampler.sample_inputs(n_samples = NI, IS = self.problem.IS, check_constraints = check_constraints, check_constraints_batch = check_constraints_batch, **kwargs)
             # print("riji",type(self.data.I),type(self.data.I[0]))
             self.data.D = [{}] * NI
         else:
@@ -2563,7 +2610,8 @@ class GPTune(object):
             is_pilot = True
             if (NSmin<NS1):
                 check_constraints = functools.partial(self.computer.evaluate_constraints, self.problem, inputs_only = False, kwargs = kwargs)
-                tmpP = sampler.sample_parameters(n_samples = NS1-NSmin, I = self.data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, **kwargs)
+                check_constraints_batch = functools.partial(self.computer.evaluate_constraints_batch, self.problem, inputs_only = False, kwargs = kwargs)
+                tmpP = sampler.sample_parameters(n_samples = NS1-NSmin, I = self.data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, check_constraints_batch = check_constraints_batch, **kwargs)
                 if(self.data.P is not None):
                     for i in range(len(self.data.P)):
                         NSi = self.data.P[i].shape[0]
@@ -2607,6 +2655,7 @@ class GPTune(object):
             newdata = Data(problem = self.problem, I = self.data.I, D = self.data.D)
             print("Iteration: ", optiter)
             stats["modeling_iteration"].append(0)
+            stats["modeling_iteration_total"].append(0)
             optiter = optiter + 1
             
             for o in range(self.problem.DO):
@@ -2767,6 +2816,7 @@ class GPTune(object):
         return (copy.deepcopy(self.data), modelers, stats)
 
     def TLA_II(self, Tnew, Tsrc = None, source_function_evaluations = None):
+        import GPy
 
         print('\n\n\n------Starting TLA_II for task: ',Tnew)
         stats = {
@@ -3416,15 +3466,16 @@ def SensitivityAnalysis(
     if surrogate_model == None:
         if function_evaluations == None:
             if historydb_path != None:
-                with open(historydb_path, "r") as f_in:
-                    function_evaluations = json.load(f_in)["func_eval"]
+                function_evaluations = read_history_file(historydb_path)["func_eval"]
                 surrogate_model = BuildSurrogateModel(problem_space = problem_space,
                         modeler = modeler,
                         input_task = [input_task],
                         function_evaluations = function_evaluations)
             elif tuning_problem_name != None:
-                with open("gptune.db/"+tuning_problem_name+".json", "r") as f_in:
-                    function_evaluations = json.load(f_in)["func_eval"]
+                if os.path.exists("gptune.db/"+tuning_problem_name+".jsonl"):
+                    function_evaluations = read_history_file("gptune.db/"+tuning_problem_name+".jsonl")["func_eval"]
+                else:
+                    function_evaluations = read_history_file("gptune.db/"+tuning_problem_name+".json")["func_eval"]
                 surrogate_model = BuildSurrogateModel(problem_space = problem_space,
                         modeler = modeler,
                         input_task = [input_task],
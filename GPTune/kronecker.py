@@ -0,0 +1,132 @@
+# GPTune Copyright (c) 2019, The Regents of the University of California,
+# through Lawrence Berkeley National Laboratory (subject to receipt of any
+# required approvals from the U.S.Dept. of Energy) and the University of
+# California, Berkeley.  All rights reserved.
+#
+# If you have questions about your rights to use or distribute this software,
+# please contact Berkeley Lab's Intellectual Property Office at IPO@lbl.gov.
+#
+# NOTICE. This Software was developed under funding from the U.S. Department
+# of Energy and the U.S. Government consequently retains certain rights.
+# As such, the U.S. Government has been granted for itself and others acting
+# on its behalf a paid-up, nonexclusive, irrevocable, worldwide license in
+# the Software to reproduce, distribute copies to the public, prepare
+# derivative works, and perform publicly and display publicly, and to permit
+# other to do so.
+#
+
+# Kronecker-structured inference for the LCM kernel of lcm.py with a single latent function (model_latent=1), when
+# every task is sampled at the same points P (n points, NT tasks). With the outputs stacked task by task, the
+# covariance is B (x) K + D (x) I, where B = w w^T + diag(kappa), K = var * exp(-|x-x'|^2 / (2 theta^2)) on P, and
+# D = diag(sigma). With D^-1/2 B D^-1/2 = Ub Lb Ub^T and K = U Lk U^T, it is
+#     (D^1/2 Ub (x) U) (Lb (x) Lk + I) (D^1/2 Ub (x) U)^T,
+# so that the likelihood, its gradients and the predictions cost O(NT^3 + n^3) instead of O(NT^3 n^3).
+
+import numpy as np
+
+def shared_design(P):
+    """ The points shared by all the tasks (n x DI array), or None if the tasks are not sampled at the same points """
+
+    P0 = np.asarray(P[0], dtype=np.float64)
+    for P_i in P[1:]:
+        P_i = np.asarray(P_i, dtype=np.float64)
+        if (P_i.shape != P0.shape or not np.array_equal(P_i, P0)):
+            return None
+    return P0
+
+def use_kronecker(P, Q, **kwargs):
+    """ The shared points P if Kronecker-structured inference applies to an LCM with Q latent functions on P, else None """
+
+    if (not kwargs.get('model_kronecker', True) or Q != 1 or len(P) < 2):
+        return None
+    return shared_design(P)
+
+class KroneckerLCM(object):
+
+    def __init__(self, kern, P, Y):   # kern: lcm.LCM with Q=1, P: n x DI, Y: one array of n outputs per task
+
+        self.kern = kern
+        self.P = np.asarray(P, dtype=np.float64)
+        self.Y = np.array([np.asarray(Y_i, dtype=np.float64).flatten() for Y_i in Y])
+        n = self.P.shape[0]
+        NT = self.Y.shape[0]
+        self.dists = (self.P[:, None, :] - self.P[None, :, :])**2
+
+        # the same layout as GPCoregionalizedRegression, so that the model can be used in place of it
+        self.X = np.concatenate([np.concatenate([self.P, np.full((n, 1), i)], axis=1) for i in range(NT)])
+        self.Y_metadata = {'output_index': self.X[:, -1:].astype(int)}
+
+        self.factorize(kern.get_param_array())
+
+    def factorize(self, x):
+
+        (DI, NT) = (self.P.shape[1], self.Y.shape[0])
+        self.theta = x[:DI]
+        self.var = x[DI]
+        self.kappa = x[DI+1:DI+1+NT]
+        self.sigma = x[DI+1+NT:DI+1+2*NT]
+        self.ws = x[DI+1+2*NT:DI+1+3*NT]
+
+        self.B = np.outer(self.ws, self.ws) + np.diag(self.kappa)
+        self.K = self.var * np.exp(-0.5 * np.sum(self.dists / self.theta**2, axis=2))
+        dh = 1. / np.sqrt(self.sigma)
+        (self.lb, Ub) = np.linalg.eigh(dh[:, None] * self.B * dh[None, :])
+        (self.lk, self.U) = np.linalg.eigh(self.K)
+        self.lb = np.maximum(self.lb, 0.)
+        self.lk = np.maximum(self.lk, 0.)
+        self.S = dh[:, None] * Ub
+        self.E = 1. / (np.outer(self.lb, self.lk) + 1.)
+
+        self.A = np.linalg.multi_dot([self.S, self.E * np.linalg.multi_dot([self.S.T, self.Y, self.U]), self.U.T])   # Sigma^-1 y
+        self.BA = np.dot(self.B, self.A)
+        self.SB = np.dot(self.S.T, self.B)
+
+    def neg_log_marginal_likelihood(self):
+
+        n = self.P.shape[0]
+        logdet = - np.sum(np.log(self.E)) + n * np.sum(np.log(self.sigma))
+        return 0.5 * (self.Y.size * np.log(2 * np.pi) + logdet + np.sum(self.Y * self.A))
+
+    def log_likelihood(self):
+
+        return - self.neg_log_marginal_likelihood()
+
+    def fun_jac(self, x):
+        """ Same as fun_jac of lcm.c: the negative log marginal likelihood, and the gradients of the log marginal
+            likelihood with respect to the logarithms of the parameters (var is kept fixed) """
+
+        self.factorize(x)
+        (DI, NT) = (self.P.shape[1], self.Y.shape[0])
+
+        # dL/dB, dL/dK and dL/dsigma from L = -0.5 y^T Sigma^-1 y - 0.5 logdet(Sigma)
+        H = np.dot(self.S * np.dot(self.E, self.lk), self.S.T)
+        G = np.dot(self.U * np.dot(self.lb, self.E), self.U.T)
+        J = np.sum(self.S**2 * np.sum(self.E, axis=1), axis=1)
+        dB = 0.5 * (np.linalg.multi_dot([self.A, self.K, self.A.T]) - H)
+        dK = 0.5 * (np.dot(self.A.T, self.BA) - G)
+        dsigma = 0.5 * (np.sum(self.A**2, axis=1) - J)
+
+        gradients = np.zeros(len(x))
+        gradients[:DI] = np.einsum('ij,ijd->d', dK * self.K, self.dists) / self.theta**2
+        gradients[DI+1:DI+1+NT] = np.diag(dB) * self.kappa
+        gradients[DI+1+NT:DI+1+2*NT] = dsigma * self.sigma
+        gradients[DI+1+2*NT:DI+1+3*NT] = 2. * self.ws * np.dot(dB, self.ws)
+
+        return (self.neg_log_marginal_likelihood(), gradients)
+
+    def predict_noiseless(self, x, full_cov=False):   # x: points with the task index in the last column, as for GPCoregionalizedRegression
+
+        x = np.atleast_2d(np.asarray(x, dtype=np.float64))
+        tids = x[:, -1].astype(int)
+        Ks = self.var * np.exp(-0.5 * np.sum((self.P[:, None, :] - x[None, :, :-1])**2 / self.theta**2, axis=2))   # n x m
+        mu = np.sum(self.BA[tids] * Ks.T, axis=1)[:, None]
+        Us = np.dot(self.U.T, Ks)
+        if (full_cov):
+            Kss = self.var * np.exp(-0.5 * np.sum((x[:, None, :-1] - x[None, :, :-1])**2 / self.theta**2, axis=2))
+            F = (self.SB[:, tids].T[:, :, None] * Us.T[:, None, :]).reshape(x.shape[0], -1)
+            var = self.B[np.ix_(tids, tids)] * Kss - np.dot(F * self.E.flatten(), F.T)
+        else:
+            var = self.B[tids, tids] * self.var - np.sum(self.SB[:, tids]**2 * np.dot(self.E, Us**2), axis=0)
+            var = np.maximum(var, 0.)[:, None]
+
+        return (mu, var)
@@ -26,6 +26,7 @@ import scipy
 import sys
 from sys import platform
 import time
+from kronecker import KroneckerLCM, use_kronecker
 
 if platform == "linux" or platform == "linux2":
     pos='.so'
@@ -61,6 +62,34 @@ else:
 
 ####################################################################################################
 
+def select_inducing(X, num_inducing):   # X: samples of all tasks, stored in row major with the task index in the last column
+
+    # inducing points of the sparse likelihood: a deterministic subset of the samples, split among the tasks in proportion
+    # to their number of samples (at least one each), and spread out in each task by greedy farthest point selection
+
+    tids = X[:, -1].astype(int)
+    tasks = np.unique(tids)
+    num_inducing = max(min(num_inducing, X.shape[0]), len(tasks))
+    counts = np.array([np.sum(tids == t) for t in tasks])
+    target = num_inducing * counts / X.shape[0]
+    alloc = np.maximum(1, np.floor(target).astype(int))
+    while (np.sum(alloc) < num_inducing):
+        alloc[np.argmax(np.where(alloc < counts, target - alloc, -np.inf))] += 1
+    while (np.sum(alloc) > num_inducing):
+        alloc[np.argmax(np.where(alloc > 1, alloc - target, -np.inf))] -= 1
+
+    Z = []
+    for t, k in zip(tasks, alloc):
+        Xt = X[tids == t, :-1]
+        chosen = [int(np.argmin(np.sum((Xt - np.mean(Xt, axis=0))**2, axis=1)))]
+        dists = np.sum((Xt - Xt[chosen[0]])**2, axis=1)
+        for _ in range(1, k):
+            chosen.append(int(np.argmax(dists)))
+            dists = np.minimum(dists, np.sum((Xt - Xt[chosen[-1]])**2, axis=1))
+        Z.append(X[tids == t][chosen])
+
+    return np.ascontiguousarray(np.concatenate(Z))
+
 class LCM(GPy.kern.Kern):
 
     """
@@ -189,7 +218,10 @@ class LCM(GPy.kern.Kern):
 
     def Kdiag(self, X):   # Required for GPy
 
-        return np.diag(self.K(X, X2=X))
+        # sum_q B_q[t,t] var_q, without forming K(X, X)
+        tids = np.asarray(X)[:, -1].astype(int)
+        BS = self.BS.reshape(self.Q, self.num_outputs, self.num_outputs)
+        return np.dot(self.var, BS[:, tids, tids])
 
     def update_gradients_full(self, dL_dK, X1, X2=None):
 
@@ -207,7 +239,7 @@ class LCM(GPy.kern.Kern):
 
         raise("Not implemented")
 
-    def train_kernel(self, X, Y, computer, kwargs):
+    def train_kernel(self, X, Y, computer, kwargs, warm_start=False):   # warm_start: the current parameters are a previous optimum, use them as the initial guess
         npernode = int(computer.cores/kwargs['model_threads'])
         maxtries = kwargs['model_max_jitter_try']
         jitter = kwargs['model_jitter']
@@ -216,8 +248,26 @@ class LCM(GPy.kern.Kern):
         npcol = mpi_size // nprow
         mpi_size = nprow * npcol
 
+        # the worker pool is shared by all restarts of the session, except for the (thread-parallel) restarts that would use it concurrently
+        persistent = kwargs.get('model_persistent_pool', True) and not kwargs['shared_memory_parallelism']
+
+        # all tasks sampled at the same points with a single latent function: Kronecker-structured likelihood, no workers needed
+        P = use_kronecker(X, self.Q, **kwargs)
+        if (P is not None):
+            kron = KroneckerLCM(self, P, Y)
+            if (kwargs['verbose']):
+                print('LCM Kronecker-structured likelihood on ', P.shape[0], ' shared samples of ', len(X), ' tasks')
+
         t1 = time.time_ns()
-        mpi_comm = computer.spawn(__file__, nproc=mpi_size, nthreads=kwargs['model_threads'], npernode=npernode, kwargs = kwargs)
+        if (P is not None):
+            pool = None
+            mpi_comm = None
+        elif (persistent):
+            pool = computer.spawn_pool(__file__, nproc=mpi_size, nthreads=kwargs['model_threads'], npernode=npernode, kwargs = kwargs)
+            mpi_comm = pool['comm']
+        else:
+            pool = None
+            mpi_comm = computer.spawn(__file__, nproc=mpi_size, nthreads=kwargs['model_threads'], npernode=npernode, kwargs = kwargs)
         t2 = time.time_ns()
         if (kwargs['verbose']):
             print('LCM spawn time: ',(t2-t1)/1e9)
@@ -225,7 +275,33 @@ class LCM(GPy.kern.Kern):
         X = np.concatenate([np.concatenate([X[i], np.ones((len(X[i]), 1)) * i], axis=1) for i in range(len(X))])
         Y = np.array(list(itertools.chain.from_iterable(Y)))
 
-        _ = mpi_comm.bcast(("init", (self, X, Y, maxtries,jitter)), root=mpi4py.MPI.ROOT)
+        # inducing-point likelihood (options['model_sparse']): O(m M^2) per evaluation instead of O(m^3)
+        sparse = kwargs.get('model_sparse', False) and mpi_comm is not None   # the Kronecker-structured likelihood is exact and cheaper
+        if (sparse):
+            if (kwargs.get('model_inducing') is None):
+                num_inducing = int(min(X.shape[0], 3 * np.sqrt(X.shape[0])))
+            else:
+                num_inducing = kwargs['model_inducing']
+            Z = select_inducing(X, num_inducing)
+            method = kwargs.get('model_sparse_method', 'VFE')
+            if (method not in ['VFE', 'FITC']):
+                raise Exception(f"Unknown model_sparse_method {method}, should be 'VFE' or 'FITC'")
+            if (kwargs['verbose']):
+                print('LCM sparse likelihood: ', method, ' with ', Z.shape[0], ' inducing points')
+        else:
+            Z = None
+            method = None
+
+        # YL: the workers keep fun_jac_struct (distances, buffers, BLACS grid) between restarts, so it is rebuilt only when the data or the layout changes
+        lean = kwargs.get('model_lean_memory', False)
+        state = (self.input_dim, self.num_outputs, self.Q, maxtries, jitter, method, lean, X, Y, Z)
+        if (mpi_comm is not None and (pool is None or pool['state'] is None or pool['state'][:7] != state[:7] or not np.array_equal(pool['state'][7], X) or not np.array_equal(pool['state'][8], Y) or not np.array_equal(pool['state'][9], Z))):
+            if (sparse):
+                _ = mpi_comm.bcast(("init_sparse", (self, X, Y, Z, method, maxtries, jitter)), root=mpi4py.MPI.ROOT)
+            else:
+                _ = mpi_comm.bcast(("init", (self, X, Y, maxtries,jitter,lean)), root=mpi4py.MPI.ROOT)
+            if (pool is not None):
+                pool['state'] = state
 
         _log_lim_val = np.log(np.finfo(np.float64).max)
         _exp_lim_val = np.finfo(np.float64).max
@@ -277,10 +353,13 @@ class LCM(GPy.kern.Kern):
             t3 = time.time_ns()
             x2 = transform_x(x)
             # x2 = np.insert(x2,len(self.theta), np.ones(len(self.var)))  # fix self.var to 1
-            _ = mpi_comm.bcast(("fun_jac", x2), root=mpi4py.MPI.ROOT)
-    #            gradients[:] = 0.
-            # print("~~~~")
-            (neg_log_marginal_likelihood, g) = mpi_comm.recv(source = 0)
+            if (mpi_comm is None):
+                (neg_log_marginal_likelihood, g) = kron.fun_jac(x2)
+            else:
+                _ = mpi_comm.bcast(("fun_jac", x2), root=mpi4py.MPI.ROOT)
+        #            gradients[:] = 0.
+                # print("~~~~")
+                (neg_log_marginal_likelihood, g) = mpi_comm.recv(source = 0)
             # print("@@@@")
             # print(x2,neg_log_marginal_likelihood)
             #print ("g: ", g)
@@ -311,7 +390,8 @@ class LCM(GPy.kern.Kern):
         x0_log = inverse_transform_x(x0)
 
         # x0_log[0]=0
-        x0_log[list(range(len(self.theta),len(self.theta)+len(self.var)))]=0
+        if (not warm_start):
+            x0_log[list(range(len(self.theta),len(self.theta)+len(self.var)))]=0
         # x0_log[2]=0
         # x0_log[3]=-10
         # x0_log[4]=-10
@@ -323,8 +403,12 @@ class LCM(GPy.kern.Kern):
         bounds = [(-10, 8)] * len(self.theta) + [(None, None)] * len(self.var) + [(-10, 8)] * len(self.kappa)+ [(-10, -5)] * len(self.sigma)+ [(-10, 6)] * len(self.WS)
         # print(bounds)
 
+        maxiter = 1000
+        if (warm_start and kwargs.get('model_warm_start_max_iters') is not None):
+            maxiter = min(maxiter, kwargs['model_warm_start_max_iters'])
+
         # sol = scipy.optimize.minimize(fun, x0_log, args=(), method='L-BFGS-B', jac=grad)
-        sol = scipy.optimize.minimize(fun, x0_log, args=(), method='L-BFGS-B', jac=grad, bounds=bounds, tol=None, callback=None, options={'disp': None, 'maxcor': 10, 'ftol': 1e-32, 'gtol': 1e-05, 'eps': 1e-08, 'maxfun': 1000, 'maxiter': 1000, 'iprint': -1, 'maxls': 100})
+        sol = scipy.optimize.minimize(fun, x0_log, args=(), method='L-BFGS-B', jac=grad, bounds=bounds, tol=None, callback=None, options={'disp': None, 'maxcor': 10, 'ftol': 1e-32, 'gtol': 1e-05, 'eps': 1e-08, 'maxfun': maxiter, 'maxiter': maxiter, 'iprint': -1, 'maxls': 100})
 
         # print(sol.x,'after')
         # print(transform_x(sol.x),'after exp')  # sol.x is not yet transformed
@@ -371,9 +455,9 @@ class LCM(GPy.kern.Kern):
     #        xopt = transform_x(xopt)
 
         self.set_param_array(xopt)
-        _ = mpi_comm.bcast(("end", None), root=mpi4py.MPI.ROOT)
-
-        mpi_comm.Disconnect()
+        if (pool is None and mpi_comm is not None):
+            _ = mpi_comm.bcast(("end", None), root=mpi4py.MPI.ROOT)
+            mpi_comm.Disconnect()
 
         return (xopt, fopt, gradients, iteration[0])
 
@@ -414,7 +498,8 @@ if __name__ == "__main__":
                     ("jitter", c_double),\
                     ("distY", POINTER(c_double)),\
                     ("buffer", POINTER(c_double)),\
-                    ("mpi_comm", POINTER(c_mpi_comm_t))]
+                    ("mpi_comm", POINTER(c_mpi_comm_t)),\
+                    ("lean", c_int)]
 
     mpi_comm = mpi4py.MPI.Comm.Get_parent()
     #    mpi_comm.Merge()
@@ -429,6 +514,8 @@ if __name__ == "__main__":
     #    assert(nprow * npcol == mpi_size)
     mb = 32
 
+    z = None
+    sparse = False
     cond = True
     while (cond):
 
@@ -438,7 +525,14 @@ if __name__ == "__main__":
 
         if (res[0] == "init"):
 
-            (ker_lcm, X, Y, maxtries,jitter) = res[1]
+            (ker_lcm, X, Y, maxtries,jitter,lean) = res[1]
+            if (z is not None):   # the data changed since the last init of this persistent worker
+                if (sparse):
+                    cliblcm.finalize_sparse(z)
+                else:
+                    cliblcm.finalize(z)
+            sparse = False
+            mb = 32
             mb = min(mb, max(1,min(X.shape[0]//nprow, X.shape[0]//npcol)))   # YL: mb <=32 doesn't seem reasonable, comment this line out ?
             # # print('mb',mb,'nprow',nprow,'npcol',npcol)
             cliblcm.initialize.restype = POINTER(fun_jac_struct)
@@ -454,22 +548,56 @@ if __name__ == "__main__":
                     c_double(jitter),\
                     c_int(nprow),\
                     c_int(npcol),\
+                    c_int(1 if lean else 0),\
+                    c_mpi_comm_t.from_address(mpi4py.MPI._addressof(mpi4py.MPI.COMM_WORLD)))
+
+        elif (res[0] == "init_sparse"):
+
+            (ker_lcm, X, Y, Z, method, maxtries,jitter) = res[1]
+            if (z is not None):
+                if (sparse):
+                    cliblcm.finalize_sparse(z)
+                else:
+                    cliblcm.finalize(z)
+            sparse = True
+            cliblcm.initialize_sparse.restype = c_void_p
+            z = cliblcm.initialize_sparse (\
+                    c_int(ker_lcm.input_dim - 1),\
+                    c_int(ker_lcm.num_outputs),\
+                    c_int(ker_lcm.Q),\
+                    c_int(X.shape[0]),\
+                    c_int(Z.shape[0]),\
+                    c_int(0 if method == 'VFE' else 1),\
+                    X.ctypes.data_as(POINTER(c_double)),\
+                    Y.ctypes.data_as(POINTER(c_double)),\
+                    Z.ctypes.data_as(POINTER(c_double)),\
+                    c_int(maxtries),\
+                    c_double(jitter),\
                     c_mpi_comm_t.from_address(mpi4py.MPI._addressof(mpi4py.MPI.COMM_WORLD)))
+            z = c_void_p(z)
 
         elif (res[0] == "fun_jac"):
             x2 = res[1]
             gradients = np.zeros(len(ker_lcm.theta) + len(ker_lcm.var) + len(ker_lcm.kappa) + len(ker_lcm.sigma) + len(ker_lcm.WS))
             cliblcm.fun_jac.restype = c_double
+            cliblcm.fun_jac_sparse.restype = c_double
 
             # res = mpi_comm.bcast(None, root=mpi4py.MPI.ROOT)
             # print('check',res)
-            neg_log_marginal_likelihood = cliblcm.fun_jac ( x2.ctypes.data_as(POINTER(c_double)), z, gradients.ctypes.data_as(POINTER(c_double)) )
+            if (sparse):
+                neg_log_marginal_likelihood = cliblcm.fun_jac_sparse ( x2.ctypes.data_as(POINTER(c_double)), z, gradients.ctypes.data_as(POINTER(c_double)) )
+            else:
+                neg_log_marginal_likelihood = cliblcm.fun_jac ( x2.ctypes.data_as(POINTER(c_double)), z, gradients.ctypes.data_as(POINTER(c_double)) )
             if (mpi_rank == 0):
                 mpi_comm.send((neg_log_marginal_likelihood, gradients), dest=0)
 
-        elif (res[0] == "end"):
+        elif (res[0] == "end" or res[0] == "shutdown"):
 
             cond = False
-            cliblcm.finalize(z)
+            if (z is not None):
+                if (sparse):
+                    cliblcm.finalize_sparse(z)
+                else:
+                    cliblcm.finalize(z)
             mpi_comm.Disconnect()
 
@@ -22,6 +22,7 @@ import numpy as np
 from problem import Problem
 from computer import Computer
 from data import Data
+from kronecker import KroneckerLCM, use_kronecker
 
 import math
 
@@ -38,6 +39,10 @@ class Model(abc.ABC):
         self.M_last = None # used for TLA with model regression
         self.M_stacked = [] # used for TLA with model stacking
         self.num_samples_stacked = [] # number of samples used for models in model stacking
+        self.hyperparameters_history = None # hyperparameters of a model stored in the history database, the initial guess of the next training (options['model_warm_start_from_db'])
+        self.retrain_history = True # False: the next training takes hyperparameters_history as they are, without optimizing
+        self.reused_history = False # whether the last training took hyperparameters_history without optimizing
+        self.iteration_total = 0 # number of optimizer iterations of all the restarts of the last training (Model_LCM)
 
     def mfnorm(self,xnorm):
         return self.mf(self.problem.PS.inverse_transform(np.array(xnorm, ndmin=2))[0])
@@ -62,14 +67,204 @@ class Model(abc.ABC):
 
         raise Exception("Abstract method")
 
+    def predict_batch(self, points : np.ndarray, tids, last : bool = False, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+
+        """
+        Noiseless mean and variance, as arrays of shape (n, 1), at the n rows of points (normalized space) for the tasks tids
+        (one task index for all the points, or one per point).
+        An exact GP posterior is evaluated for all the points at once from its cached woodbury vector and Cholesky factor,
+        with the cross-covariances from the kernel K routine (cliblcm.K for Model_LCM), stacked models with predict_stacked;
+        other models are evaluated point by point.
+        With last=True, the batched counterpart of predict_last: the previous model M_last (or M if there is none) is used,
+        without model stacking nor prior mean function.
+        """
+
+        points = np.array(points, dtype=np.float64, ndmin=2)
+        n = points.shape[0]
+        tids = np.broadcast_to(np.array(tids, dtype=int).reshape(-1), (n,))
+        if (n == 0):
+            return (np.empty((0, 1)), np.empty((0, 1)))
+
+        M = self.M_last if (last and self.M_last is not None) else self.M
+        x = np.concatenate([points, tids.reshape(n, 1)], axis=1)
+        if (len(self.M_stacked) > 0 and not last):
+            return self.predict_stacked(points, tids)
+        elif (isinstance(M, KroneckerLCM)):
+            (mu, var) = M.predict_noiseless(x)
+        elif (self.exact_posterior(M)):
+            import scipy.linalg
+            x = x[:, :M.X.shape[1]]   # the single-task models have no task column
+            Kx = M.kern.K(np.asarray(M.X), x)
+            mu = np.dot(Kx.T, M.posterior.woodbury_vector)
+            tmp = scipy.linalg.solve_triangular(M.posterior.woodbury_chol, Kx, lower=True)
+            var = np.maximum(M.kern.Kdiag(x) - np.sum(np.square(tmp), axis=0), 1e-15).reshape(n, 1)   # same floor as GPy
+        else:
+            if (last):
+                res = [self.predict_last(points[i], tid=int(tids[i]), **kwargs) for i in range(n)]
+            else:
+                res = [self.predict(points[i], tid=int(tids[i]), **kwargs) for i in range(n)]
+            mu = np.array([np.asarray(r[0]).flatten()[0] for r in res]).reshape(n, 1)
+            var = np.array([np.asarray(r[1]).flatten()[0] for r in res]).reshape(n, 1)
+            return (mu, var)
+
+        # YL: the models are built on the data minus the prior mean, see train_mpi
+        if (self.mf is not None and not last):
+            mu = mu + np.array([self.mfnorm(points[i]) for i in range(n)]).reshape(n, 1)
+
+        return (mu, var)
+
+    def predict_stacked(self, points : np.ndarray, tids, mf_residuals : bool = False, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+
+        """
+        Noiseless mean and variance, as arrays of shape (n, 1), of the stacked models (TLA with model stacking) at the n rows of points.
+        Every model of M_stacked predicts all the points at once; the means of the residual models are added to the mean of the first one,
+        and the variances are blended geometrically, var = var_i^beta * var^(1-beta) with beta = n_i/(n_i+n_prior).
+        If mf_residuals, the prior mean function is added to the residual models.
+        """
+
+        points = np.array(points, dtype=np.float64, ndmin=2)
+        n = points.shape[0]
+        tids = np.broadcast_to(np.array(tids, dtype=int).reshape(-1), (n,))
+        x = np.concatenate([points, tids.reshape(n, 1)], axis=1)
+
+        (mu, var) = self.M_stacked[0].predict_noiseless(x)
+        mu = np.array(mu, dtype=np.float64).reshape(n, 1)
+        var = np.maximum(1e-18, np.asarray(var).reshape(n, 1))
+        num_samples_prior = self.num_samples_stacked[0]
+        mf = 0
+        if (mf_residuals and self.mf is not None and len(self.M_stacked) > 1):
+            mf = np.array([self.mfnorm(points[i]) for i in range(n)], dtype=np.float64).reshape(n, 1)
+
+        for i in range(1, len(self.M_stacked), 1):
+            (mu_, var_) = self.M_stacked[i].predict_noiseless(x)
+            var_ = np.maximum(1e-18, np.asarray(var_).reshape(n, 1))
+            num_samples_current = self.num_samples_stacked[i]
+            alpha = 1.0 # relative importance of the prior and current ones
+            beta = float((alpha*num_samples_current)/(alpha*num_samples_current+num_samples_prior))
+            mu += np.asarray(mu_).reshape(n, 1) + mf
+            var = np.power(var_, beta) * np.power(var, (1.0-beta))
+            num_samples_prior = num_samples_current
+
+        return (mu, var)
+
+    def exact_posterior(self, M) -> bool:
+
+        # whether M is a GPy model with an exact GP posterior (Cholesky factor and woodbury vector) on unnormalized outputs
+        if (M is None or not hasattr(M, 'inference_method')):
+            return False
+        from GPy.inference.latent_function_inference.exact_gaussian_inference import ExactGaussianInference
+        return isinstance(M.inference_method, ExactGaussianInference) and M.normalizer is None
+
+    def new_samples(self, data : Data):
+
+        """
+        Return the rows (X_new, Y_new, Y_metadata_new) of data that are not yet in self.M, laid out as self.M.X and self.M.Y.
+        data is expected to start with the samples self.M was built on (per task, in the same order); otherwise None is returned.
+        """
+
+        X_old = np.asarray(self.M.X)
+        multitask = self.M.Y_metadata is not None and 'output_index' in self.M.Y_metadata
+        X_new = []
+        Y_new = []
+        index_new = []
+        for i in range(len(data.P) if multitask else 1):
+            if (multitask):
+                X_i = X_old[X_old[:,-1] == i, :-1]
+            else:
+                X_i = X_old
+            n_i = X_i.shape[0]
+            P_i = np.asarray(data.P[i], dtype=np.float64)
+            O_i = np.asarray(data.O[i], dtype=np.float64)
+            if (P_i.shape[0] < n_i or P_i.shape[1] != X_i.shape[1] or not np.allclose(P_i[:n_i], X_i)):
+                return None
+            X_new.append(P_i[n_i:])
+            Y_new.append(O_i[n_i:])
+            index_new.append(np.full((P_i.shape[0]-n_i, 1), i, dtype=int))
+        X_new = np.concatenate(X_new)
+        Y_new = np.concatenate(Y_new)
+        index_new = np.concatenate(index_new)
+        if (multitask):
+            X_new = np.hstack([X_new, index_new])
+            Y_metadata_new = {'output_index': index_new}
+        else:
+            Y_metadata_new = None
+
+        return (X_new, Y_new, Y_metadata_new)
+
+    def update_posterior(self, X_new : np.ndarray, Y_new : np.ndarray, Y_metadata_new : dict = None):
+        """
+        Append the rows X_new, Y_new to the exact GP posterior of self.M with frozen hyperparameters.
+        The Cholesky factor L of K+noise and Kinv*y are extended by k rows in O(N^2 k) instead of refactorizing in O(N^3):
+        L21 = (L^-1 K_on)^T, L22 = chol(K_nn + noise - L21 L21^T), z_new = L22^-1 (y_new - L21 z_old), Kinv*y = L^-T z.
+        Returns False (and leaves self.M unchanged) if self.M is not an exact GP posterior.
+        """
+
+        import scipy.linalg
+        import GPy
+        from GPy.inference.latent_function_inference.posterior import PosteriorExact
+        from paramz import ObsAr
+
+        M = self.M
+        if (not self.exact_posterior(M)):
+            return False
+        if (X_new.shape[0] == 0):
+            return True
+
+        X_old = np.ascontiguousarray(M.X, dtype=np.float64)
+        X_new = np.ascontiguousarray(X_new, dtype=np.float64)
+        Y_raw = np.asarray(Y_new, dtype=np.float64).reshape((X_new.shape[0], -1))
+        Y_new = Y_raw
+        if (M.mean_function is not None):
+            Y_new = Y_raw - M.mean_function.f(X_new)
+        N = X_old.shape[0]
+        k = X_new.shape[0]
+
+        L = M.posterior.woodbury_chol
+        K_old = M.posterior._K
+        if (K_old is None):
+            K_old = M.kern.K(X_old)
+        K_on = M.kern.K(X_old, X_new)
+        K_nn = M.kern.K(X_new)
+        # same diagonal shift as GPy's ExactGaussianInference
+        noise = np.asarray(M.likelihood.gaussian_variance(Y_metadata_new), dtype=np.float64).flatten()
+        noise = np.broadcast_to(noise, (k,))
+
+        L21 = scipy.linalg.solve_triangular(L, K_on, lower=True).T
+        L22 = GPy.util.linalg.jitchol(K_nn + np.diag(noise + 1e-8) - np.dot(L21, L21.T))
+        L_full = np.zeros((N+k, N+k))
+        L_full[:N,:N] = L
+        L_full[N:,:N] = L21
+        L_full[N:,N:] = L22
+
+        z_old = np.dot(L.T, M.posterior.woodbury_vector)
+        z_new = scipy.linalg.solve_triangular(L22, Y_new - np.dot(L21, z_old), lower=True)
+        z = np.vstack([z_old, z_new])
+        alpha = scipy.linalg.solve_triangular(L_full, z, lower=True, trans='T')
+
+        K_full = np.empty((N+k, N+k))
+        K_full[:N,:N] = K_old
+        K_full[:N,N:] = K_on
+        K_full[N:,:N] = K_on.T
+        K_full[N:,N:] = K_nn
+
+        # YL: set the attributes directly, set_XY would trigger a full inference
+        M.X = ObsAr(np.vstack([X_old, X_new]))
+        M.Y = ObsAr(np.vstack([np.asarray(M.Y), Y_raw]))
+        M.Y_normalized = M.Y
+        if (Y_metadata_new is not None):
+            M.Y_metadata = {'output_index': np.vstack([M.Y_metadata['output_index'], Y_metadata_new['output_index']])}
+        M.num_data = N + k
+        M.posterior = PosteriorExact(woodbury_chol=L_full, woodbury_vector=alpha, K=K_full)
+        M._log_marginal_likelihood = -0.5 * (N+k) * z.shape[1] * np.log(2*np.pi) - z.shape[1] * np.sum(np.log(np.diag(L_full))) - 0.5 * np.sum(np.square(z))
+
+        return True
+
     @abc.abstractmethod
     def predict_last(self, points : Collection[np.ndarray], tid : int, **kwargs) -> Collection[Tuple[float, float]]:
 
         raise Exception("Abstract method")
 
 
-import GPy
-
 class Model_GPy_LCM(Model):
 
 #model_threads=1
@@ -83,6 +278,7 @@ class Model_GPy_LCM(Model):
 #model_layers=2
 
     def train(self, data : Data, **kwargs):
+        import GPy
         if kwargs['model_random_seed'] != None:
             seed = kwargs['model_random_seed']
             if data.P is not None:
@@ -151,7 +347,12 @@ class Model_GPy_LCM(Model):
 #        np.random.seed(mpi_rank)
 #        num_restarts = max(1, model_n_restarts // mpi_size)
 
-        resopt = self.M.optimize_restarts(num_restarts = kwargs['model_restarts'], robust = True, verbose = kwargs['verbose'], parallel = (kwargs['model_threads'] > 1), num_processes = kwargs['model_threads'], messages = kwargs['verbose'], optimizer = kwargs['model_optimizer'], start = None, max_iters = kwargs['model_max_iters'], ipython_notebook = False, clear_after_finish = True)
+        # the first restart of optimize_restarts starts from the current parameters, i.e. the stored hyperparameters if they fit
+        warm_start = (self.hyperparameters_history is not None and self.set_hyperparameters(self.hyperparameters_history, data.NI, model_latent, multitask))
+        self.reused_history = (warm_start and not self.retrain_history)
+        self.hyperparameters_history = None
+        if (not self.reused_history):
+            resopt = self.M.optimize_restarts(num_restarts = kwargs['model_restarts'], robust = True, verbose = kwargs['verbose'], parallel = (kwargs['model_threads'] > 1), num_processes = kwargs['model_threads'], messages = kwargs['verbose'], optimizer = kwargs['model_optimizer'], start = None, max_iters = kwargs['model_max_iters'], ipython_notebook = False, clear_after_finish = True)
 
 #        self.M.param_array[:] = allreduce_best(self.M.param_array[:], resopt)[:]
         self.M.parameters_changed()
@@ -257,31 +458,24 @@ class Model_GPy_LCM(Model):
 
         return self.M_stacked
 
+    # newdata contains all the samples (the ones the current model was built on first), only the new ones are appended to the posterior unless do_train=True
     def update(self, newdata : Data, do_train: bool = False, **kwargs):
 
-        #XXX TODO
-        self.train(newdata, **kwargs)
+        if (do_train or self.M is None):   # there is no model to keep without training
+            self.train(newdata, **kwargs)
+            return
+        if (len(self.M_stacked) == 0):
+            res = self.new_samples(newdata)
+            if (res is not None and self.update_posterior(*res)):
+                return
+        # sparse or stacked models, or newdata not extending the samples of the model: the hyperparameters stay frozen, so the current model is kept
+        if (kwargs.get('verbose', False)):
+            print ("Model_GPy_LCM.update: the new samples cannot be appended to the posterior, the current model is kept")
 
     def predict(self, points : Collection[np.ndarray], tid : int, full_cov : bool=False, **kwargs) -> Collection[Tuple[float, float]]:
 
         if len(self.M_stacked) > 0: # stacked model
-            x = np.empty((1, points.shape[0] + 1))
-            x[0,:-1] = points
-            x[0,-1] = tid
-
-            (mu, var) = self.M_stacked[0].predict_noiseless(x)
-            var[0][0] = max(1e-18, var[0][0])
-            num_samples_prior = self.num_samples_stacked[0]
-
-            for i in range(1, len(self.M_stacked), 1):
-                (mu_, var_) = self.M_stacked[i].predict_noiseless(x)
-                var_[0][0] = max(1e-18, var_[0][0])
-                num_samples_current = self.num_samples_stacked[i]
-                alpha = 1.0 # relative importance of the prior and current ones
-                beta = float((alpha*num_samples_current)/(alpha*num_samples_current+num_samples_prior))
-                mu[0][0] += mu_[0][0]
-                var[0][0] = math.pow(var_[0][0], beta) * math.pow(var[0][0], (1.0-beta))
-                num_samples_prior = num_samples_current
+            (mu, var) = self.predict_stacked(points, tid)
         else:
             if not len(points.shape) == 2:
                 points = np.atleast_2d(points)
@@ -323,7 +517,38 @@ class Model_GPy_LCM(Model):
                 C[i, ip] = np.linalg.norm(B[i, ip, :]) / np.sqrt(np.linalg.norm(B[i, i, :]) * np.linalg.norm(B[ip, ip, :]))
         return C
 
+    def set_hyperparameters(self, hyperparameters : dict, num_tasks : int, model_latent : int, multitask : bool):
+
+        # set the hyperparameters dumped by train on self.M; False if they do not fit the model
+        def set_param(parameterized, name, value):
+            value = np.array(value, dtype=float)
+            if (value.size != parameterized[name].size):
+                raise ValueError("hyperparameter %s has size %d instead of %d"%(name, value.size, parameterized[name].size))
+            parameterized[name] = value.reshape(parameterized[name].shape)
+
+        try:
+            if (multitask):
+                if (len(hyperparameters["rbf_lengthscale"]) != model_latent or len(hyperparameters["noise_variance"]) != num_tasks):
+                    return False
+                for qq in range(model_latent):
+                    set_param(self.M.kern, 'sum.GPy_LCM%s.rbf.lengthscale'%qq, hyperparameters["rbf_lengthscale"][qq])
+                    set_param(self.M.kern, 'sum.GPy_LCM%s.B.W'%qq, hyperparameters["B_W"][qq])
+                    set_param(self.M.kern, 'sum.GPy_LCM%s.B.kappa'%qq, hyperparameters["B_kappa"][qq])
+                for qq in range(num_tasks):
+                    set_param(self.M, 'mixed_noise.Gaussian_noise_%s.variance'%qq, hyperparameters["noise_variance"][qq])
+            else:
+                set_param(self.M.kern, 'GPy_GP.lengthscale', hyperparameters["lengthscale"])
+                set_param(self.M.kern, 'GPy_GP.variance', hyperparameters["variance"])
+                set_param(self.M, 'Gaussian_noise.variance', hyperparameters["noise_variance"])
+        except (KeyError, TypeError, ValueError) as e:
+            print ("stored hyperparameters do not fit the model: ", e)
+            return False
+
+        self.M.parameters_changed()
+        return True
+
     def gen_model_from_hyperparameters(self, data : Data, hyperparameters : dict, modeling_options : dict, **kwargs):
+        import GPy
 
         if kwargs['model_random_seed'] != None:
             seed = kwargs['model_random_seed']
@@ -427,9 +652,34 @@ class Model_LCM(Model):
         import copy
         self.M_last = copy.deepcopy(self.M)
 
-        return self.train_mpi(data, i_am_manager = True, restart_iters=list(range(kwargs['model_restarts'])), **kwargs)
+        res = None
+        if (self.hyperparameters_history is not None and not self.retrain_history and self.mf is None):
+            res = self.reuse_hyperparameters_history(data, **kwargs)
+        self.reused_history = (res is not None)
+        self.iteration_total = 0
+        if (res is None):
+            res = self.train_mpi(data, i_am_manager = True, restart_iters=list(range(kwargs['model_restarts'])), **kwargs)
+        self.hyperparameters_history = None
+
+        return res
+
+    def reuse_hyperparameters_history(self, data : Data, **kwargs):
+
+        # build the model from the stored hyperparameters without optimizing; None if they do not fit the current model size
+        if (kwargs['model_latent'] is None):
+            Q = data.NI
+        else:
+            Q = kwargs['model_latent']
+
+        xwarm = self.warm_start_hyperparameters(data, Q, **kwargs)
+        if (xwarm is None):
+            return None
+        self.gen_model_from_hyperparameters(data, xwarm, **kwargs)
+
+        return (xwarm, -self.M.log_likelihood(), np.zeros(len(xwarm)), 0)
 
     def train_mpi(self, data : Data, i_am_manager : bool, restart_iters : Collection[int] = None, **kwargs):
+        import GPy
         if (kwargs['RCI_mode']== False):
             import mpi4py
             from lcm import LCM
@@ -439,8 +689,13 @@ class Model_LCM(Model):
         else:
             Q = kwargs['model_latent']
 
+        xwarm = self.warm_start_hyperparameters(data, Q, **kwargs)
+
         if (kwargs['distributed_memory_parallelism'] and i_am_manager):
-            mpi_comm = self.computer.spawn(__file__, nproc=kwargs['model_restart_processes'], nthreads=kwargs['model_restart_threads'], kwargs=kwargs) # XXX add args and kwargs
+            if (kwargs.get('model_persistent_pool', True)):
+                mpi_comm = self.computer.spawn_pool(__file__, nproc=kwargs['model_restart_processes'], nthreads=kwargs['model_restart_threads'], kwargs=kwargs)['comm']
+            else:
+                mpi_comm = self.computer.spawn(__file__, nproc=kwargs['model_restart_processes'], nthreads=kwargs['model_restart_threads'], kwargs=kwargs) # XXX add args and kwargs
             kwargs_tmp = kwargs
             # print("kwargs_tmp",kwargs_tmp)
 
@@ -457,9 +712,11 @@ class Model_LCM(Model):
                     for p in range(data.P[i].shape[0]):
                         data_tmp.O[i][p,0]=data_tmp.O[i][p,0]-self.mfnorm(data.P[i][p,:])            
             self.mf = None
-            _ = mpi_comm.bcast((self, data_tmp, restart_iters, kwargs_tmp), root=mpi4py.MPI.ROOT)
+            _ = mpi_comm.bcast(("train", (self, data_tmp, restart_iters, kwargs_tmp)), root=mpi4py.MPI.ROOT)
             tmpdata = mpi_comm.gather(None, root=mpi4py.MPI.ROOT)
-            mpi_comm.Disconnect()
+            if (not kwargs.get('model_persistent_pool', True)):
+                _ = mpi_comm.bcast(("shutdown", None), root=mpi4py.MPI.ROOT)
+                mpi_comm.Disconnect()
             self.mf = mf_saved
             res=[]
             for p in range(int(kwargs['model_restart_processes'])):
@@ -477,8 +734,9 @@ class Model_LCM(Model):
                     # np.random.seed(seed)
                     ## np.random.seed()
                     kern = LCM(input_dim = len(data.P[0][0]), num_outputs = data.NI, Q = Q)
-                    # if (restart_iter == 0 and self.M is not None):
-                    #     kern.set_param_array(self.M.kern.get_param_array())
+                    warm_start = (restart_iter == 0 and xwarm is not None)
+                    if (warm_start):
+                        kern.set_param_array(xwarm)
                     
                     import copy
                     data_O = copy.deepcopy(data.O)
@@ -487,7 +745,7 @@ class Model_LCM(Model):
                         for i in range(len(data.P)):
                             for p in range(data.P[i].shape[0]):
                                 data_O[i][p,0]=data_O[i][p,0]-self.mfnorm(data.P[i][p,:])
-                    return kern.train_kernel(X = data.P, Y = data_O, computer = self.computer, kwargs = kwargs)
+                    return kern.train_kernel(X = data.P, Y = data_O, computer = self.computer, kwargs = kwargs, warm_start = warm_start)
                 res = list(executor.map(fun, restart_iters, timeout=None, chunksize=1))
 
         else:
@@ -502,6 +760,9 @@ class Model_LCM(Model):
                             seed += len(P_)
                     np.random.seed(seed)
                 kern = LCM(input_dim = len(data.P[0][0]), num_outputs = data.NI, Q = Q)
+                warm_start = (restart_iter == 0 and xwarm is not None)
+                if (warm_start):
+                    kern.set_param_array(xwarm)
                 import copy
                 data_O = copy.deepcopy(data.O)
                 # YL: substract the prior mean before calling the C modeling training function 
@@ -509,7 +770,7 @@ class Model_LCM(Model):
                     for i in range(len(data.P)):
                         for p in range(data.P[i].shape[0]):
                             data_O[i][p,0]=data_O[i][p,0]-self.mfnorm(data.P[i][p,:])
-                return kern.train_kernel(X = data.P, Y = data_O, computer = self.computer, kwargs = kwargs)
+                return kern.train_kernel(X = data.P, Y = data_O, computer = self.computer, kwargs = kwargs, warm_start = warm_start)
             res = list(map(fun, restart_iters))
 
         if (kwargs['distributed_memory_parallelism'] and i_am_manager == False):
@@ -521,6 +782,7 @@ class Model_LCM(Model):
         neg_log_marginal_likelihood = best_result[1]
         gradients = best_result[2]
         iteration = best_result[3]
+        self.iteration_total = sum([x[3] for x in res])   # L-BFGS iterations of all restarts, so that the savings of model_warm_start show up in stats["modeling_iteration_total"]
         kern.set_param_array(bestxopt)
         if(kwargs['verbose']==True):
             # print('hyperparameters:', kern.get_param_array())
@@ -533,8 +795,6 @@ class Model_LCM(Model):
 
 
 
-        # YL: likelihoods needs to be provided, since K operator doesn't take into account sigma/jittering, but Kinv does. The GPCoregionalizedRegression intialization will call inference in GPy/interence/latent_function_inference/exact_gaussian_inference.py, and add to diagonals of the K operator with sigma+1e-8
-        likelihoods_list = [GPy.likelihoods.Gaussian(variance = kern.sigma[i], name = "Gaussian_noise_%s" %i) for i in range(data.NI)]
         import copy
         data_O = copy.deepcopy(data.O)
         # YL: GPCoregionalizedRegression initialization in GPy (unlike GPRegression) doesn't accept mean_function, so we need to subtract mean from data.O for calling the prediction function later. Also, we need to add back the mean in the predict function below 
@@ -542,7 +802,7 @@ class Model_LCM(Model):
             for i in range(len(data.P)):
                 for p in range(data.P[i].shape[0]):
                     data_O[i][p,0]=data_O[i][p,0]-self.mfnorm(data.P[i][p,:])
-        self.M = GPy.models.GPCoregionalizedRegression(data.P, data_O, kern, likelihoods_list = likelihoods_list)
+        self.M = self.gen_posterior(data, kern, data_O, **kwargs)
 
         #print ("kernel: " + str(kern))
         #print ("bestxopt:" + str(bestxopt))
@@ -558,6 +818,34 @@ class Model_LCM(Model):
 
         return (bestxopt, neg_log_marginal_likelihood, gradients, iteration)
 
+    def gen_posterior(self, data : Data, kern, data_O, **kwargs):
+
+        # exact posterior of the fitted LCM kernel, Kronecker-structured when all tasks share their samples (options['model_kronecker'])
+        import GPy
+
+        P = use_kronecker(data.P, kern.Q, **kwargs)
+        if (P is not None):
+            return KroneckerLCM(kern, P, data_O)
+
+        # YL: likelihoods needs to be provided, since K operator doesn't take into account sigma/jittering, but Kinv does. The GPCoregionalizedRegression intialization will call inference in GPy/interence/latent_function_inference/exact_gaussian_inference.py, and add to diagonals of the K operator with sigma+1e-8
+        likelihoods_list = [GPy.likelihoods.Gaussian(variance = kern.sigma[i], name = "Gaussian_noise_%s" %i) for i in range(data.NI)]
+        return GPy.models.GPCoregionalizedRegression(data.P, data_O, kern, likelihoods_list = likelihoods_list)
+
+    def warm_start_hyperparameters(self, data : Data, Q : int, **kwargs):
+
+        # hyperparameters of a model stored in the history database (options['model_warm_start_from_db']), or of the previous model if options['model_warm_start'] is set,
+        # if they fit the current model size, otherwise None
+        if (self.hyperparameters_history is not None):
+            xwarm = np.array(self.hyperparameters_history)
+        elif (not kwargs.get('model_warm_start', False) or self.M is None):
+            return None
+        else:
+            xwarm = np.array(self.M.kern.get_param_array())
+        nparam = Q * len(data.P[0][0]) + Q + Q * data.NI + data.NI + Q * data.NI
+        if (len(xwarm) != nparam):
+            return None
+        return xwarm
+
     def train_stacked(self, data : Data, num_source_tasks, **kwargs):
 
         if len(self.M_stacked) < 1+num_source_tasks:
@@ -571,34 +859,50 @@ class Model_LCM(Model):
 
         return self.M_stacked
 
+    # newdata contains all the samples (the ones the current model was built on first), only the new ones are appended to the posterior unless do_train=True
     def update(self, newdata : Data, do_train: bool = False, **kwargs):
 
-        #XXX TODO
-        self.train(newdata, **kwargs)
+        if (do_train or self.M is None):   # there is no model to keep without training
+            self.train(newdata, **kwargs)
+            return
+        if (len(self.M_stacked) > 0):
+            # the stacked residual models are kept until the next training
+            return
+        if (not isinstance(self.M, KroneckerLCM)):
+            res = self.new_samples(newdata)
+            if (res is not None):
+                (X_new, Y_new, Y_metadata_new) = res
+                # YL: the model is built on data.O minus the prior mean, see train_mpi
+                if(self.mf is not None):
+                    for p in range(X_new.shape[0]):
+                        Y_new[p,0] = Y_new[p,0] - self.mfnorm(X_new[p,:-1])
+                if (self.update_posterior(X_new, Y_new, Y_metadata_new)):
+                    return
+
+        # Kronecker-structured posterior (rebuilt in O(NT^3 + n^3)), or newdata not extending the samples of the model: the posterior is rebuilt on newdata with the same hyperparameters
+        kern = self.M.kern
+        if (len(kern.theta) != kern.Q * len(newdata.P[0][0]) or len(kern.sigma) != newdata.NI):
+            if (kwargs.get('verbose', False)):
+                print ("Model_LCM.update: the hyperparameters do not fit newdata, the current model is kept")
+            return
+        import copy
+        data_O = copy.deepcopy(newdata.O)
+        if(self.mf is not None):
+            for i in range(len(newdata.P)):
+                for p in range(newdata.P[i].shape[0]):
+                    data_O[i][p,0]=data_O[i][p,0]-self.mfnorm(newdata.P[i][p,:])
+        self.M = self.gen_posterior(newdata, kern, data_O, **kwargs)
+
+    def predict_stacked(self, points : np.ndarray, tids, **kwargs) -> Tuple[np.ndarray, np.ndarray]:
+
+        # the residual models of Model_LCM are trained on the data minus the prior mean, see train_mpi
+        return super().predict_stacked(points, tids, mf_residuals=True, **kwargs)
 
     # make prediction on a single sample point of a specific task tid
     def predict(self, points : Collection[np.ndarray], tid : int, full_cov : bool=False, **kwargs) -> Collection[Tuple[float, float]]:
 
         if len(self.M_stacked) > 0: # stacked model
-            x = np.empty((1, points.shape[0] + 1))
-            x[0,:-1] = points
-            x[0,-1] = tid
-
-            (mu, var) = self.M_stacked[0].predict_noiseless(x)
-            var[0][0] = max(1e-18, var[0][0])
-            num_samples_prior = self.num_samples_stacked[0]
-
-            for i in range(1, len(self.M_stacked), 1):
-                (mu_, var_) = self.M_stacked[i].predict_noiseless(x)
-                if(self.mf is not None):
-                    mu_[0][0] = mu_[0][0] + self.mfnorm(x)
-                var_[0][0] = max(1e-18, var_[0][0])
-                num_samples_current = self.num_samples_stacked[i]
-                alpha = 1.0 # relative importance of the prior and current ones
-                beta = float((alpha*num_samples_current)/(alpha*num_samples_current+num_samples_prior))
-                mu[0][0] += mu_[0][0]
-                var[0][0] = math.pow(var_[0][0], beta) * math.pow(var[0][0], (1.0-beta))
-                num_samples_prior = num_samples_current
+            (mu, var) = self.predict_stacked(points, tid)
         else:
             if not len(points.shape) == 2:
                 points = np.atleast_2d(points)
@@ -626,6 +930,7 @@ class Model_LCM(Model):
         return (mu, var)
 
     def gen_model_from_hyperparameters(self, data : Data, hyperparameters : list, **kwargs):
+        import GPy
         if (kwargs['RCI_mode']== False):
             from lcm import LCM
 
@@ -638,14 +943,14 @@ class Model_LCM(Model):
         #print ("received hyperparameters: " + str(hyperparameters))
         kern.set_param_array(hyperparameters)
 
-        likelihoods_list = [GPy.likelihoods.Gaussian(variance = kern.sigma[i], name = "Gaussian_noise_%s" %i) for i in range(data.NI)]
-        self.M = GPy.models.GPCoregionalizedRegression(data.P, data.O, kern, likelihoods_list = likelihoods_list)
+        self.M = self.gen_posterior(data, kern, data.O, **kwargs)
 
         return
 
 class Model_DGP(Model):
 
     def train(self, data : Data, **kwargs):
+        import GPy
 
         multitask = len(self.I) > 1
 
@@ -736,9 +1041,22 @@ if __name__ == '__main__':
     mpi_comm = mpi4py.MPI.Comm.Get_parent()
     mpi_rank = mpi_comm.Get_rank()
     mpi_size = mpi_comm.Get_size()
-    (modeler, data, restart_iters, kwargs) = mpi_comm.bcast(None, root=0)
-    restart_iters_loc = restart_iters[mpi_rank:len(restart_iters):mpi_size]
-    tmpdata = modeler.train_mpi(data, i_am_manager = False, restart_iters = restart_iters_loc, **kwargs)
-    res = mpi_comm.gather(tmpdata, root=0)
-    mpi_comm.Disconnect()
+    computer = None
+    cond = True
+    while (cond):
+        (cmd, payload) = mpi_comm.bcast(None, root=0)
+        if (cmd == "train"):
+            (modeler, data, restart_iters, kwargs) = payload
+            # keep the first computer so that the LCM worker pool it spawns is reused by later training requests
+            if (computer is None):
+                computer = modeler.computer
+            modeler.computer = computer
+            restart_iters_loc = restart_iters[mpi_rank:len(restart_iters):mpi_size]
+            tmpdata = modeler.train_mpi(data, i_am_manager = False, restart_iters = restart_iters_loc, **kwargs)
+            res = mpi_comm.gather(tmpdata, root=0)
+        elif (cmd == "shutdown"):
+            cond = False
+            if (computer is not None):
+                computer.shutdown_pools()
+            mpi_comm.Disconnect()
 
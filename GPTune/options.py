@@ -26,6 +26,8 @@ class Options(dict):
         """ Options for GPTune """
         lite_mode = False        # whether to disable all C/C++ dependencies 
         RCI_mode = False         # whether the reverse communication mode will be used
+        RCI_server = None        # path of a UNIX socket; if set, GPTune stays resident and the RCI driver script asks it for samples and reports results through this socket (see rci.py), instead of relaunching GPTune per sample
+        RCI_server_point_timeout = 3600 # seconds after which a sample handed out by the RCI server and not reported yet (e.g. its driver was killed) is handed out again (None: never)
         mpi_comm = None          # The mpi communicator that invokes gptune if mpi4py is installed
         distributed_memory_parallelism = False   # Using distributed_memory_parallelism for the modeling (one MPI per model restart) and search phase (one MPI per task)
         shared_memory_parallelism      = False   # Using shared_memory_parallelism for the modeling (one MPI per model restart) and search phase (one MPI per task)
@@ -68,11 +70,19 @@ class Options(dict):
         model_max_iters = 15000   # Number of maximum iterations for the optimizers
         model_jitter = 1e-10   # Initial jittering
         model_latent = None # Number of latent functions for building one LCM model, defaults to number of tasks
-        model_sparse = False # Whether to use SparseGPRegression or SparseGPCoregionalizedRegression from Model_GPy_LCM
-        model_inducing = None # Number of inducing points for SparseGPRegression or SparseGPCoregionalizedRegression
+        model_sparse = False # Whether to use SparseGPRegression or SparseGPCoregionalizedRegression from Model_GPy_LCM, or the inducing-point likelihood of Model_LCM
+        model_inducing = None # Number of inducing points for SparseGPRegression or SparseGPCoregionalizedRegression, or Model_LCM (default: min(m, 3*sqrt(m)) for m samples)
+        model_sparse_method = 'VFE' # Inducing-point likelihood of Model_LCM when model_sparse is True: 'VFE' (variational lower bound) or 'FITC'
+        model_lean_memory = False # Whether Model_LCM recomputes the kernel exponentials and distances in the gradient instead of storing them and keeps no copy of the covariance matrix for the jitter retries: (DI+NL+2) times less memory per process, at the cost of recomputing the exponentials
+        model_kronecker = True # Whether Model_LCM with model_latent=1 uses Kronecker-structured inference (eigendecompositions of the task and sample covariances) when all tasks are sampled at the same points
         model_layers = 2 # Number of layers for Model_DGP
         model_max_jitter_try = 10 # Max number of jittering 
         model_random_seed = None # Specify a certain random seed for the surrogate modeling phase
+        model_warm_start = False # Whether one of the model restarts in Model_LCM starts from the hyperparameters of the previous iteration, the other restarts keep random initial guesses
+        model_warm_start_max_iters = 100 # Max number of L-BFGS iterations for the warm-started restart (None: same as the random restarts)
+        model_warm_start_from_db = False # Whether the first model of a run starts from the hyperparameters of the most recent model stored in the history database for the same tasks, spaces and objective, e.g. to carry the fit over RCI relaunches (Model_LCM and Model_GPy_LCM)
+        model_retrain_min_new_samples = None # With model_warm_start_from_db, take the stored hyperparameters as they are, without retraining, while fewer than this many samples have been added since that model was stored (None: always retrain)
+        model_persistent_pool = True # Whether the MPI workers spawned for Model_LCM are kept alive and reused across model restarts and tuning iterations, instead of being spawned for each restart
 
 
         """ Options for the search phase """
@@ -99,6 +109,8 @@ class Options(dict):
         search_ucb_beta=0.01 #hyperparameter beta in UCB, UCB-HVI 
         search_ei_alpha=0.0  #hyperparameter beta in EI, q-EI
         search_bigval=1e12 # return this value when the input constraint is not respected during the search phase
+        search_cache_size = 10000 # Maximum number of points (in the original space) whose constraint verdicts and surrogate predictions are memoized during one search (least recently used points are evicted first), 0 disables the cache
+        search_batch_fitness = True # Whether the acquisition function is evaluated on a whole population at once (pymoo, and pygmo algorithms supporting a batch fitness evaluator such as 'pso_gen' or 'nsga2'), instead of one point at a time
 
         """ Options for transfer learning """
         TLA_method = 'LCM' #None #'Regression' #"LCM_BF" #'Sum' #'Stacking' #'regression_weights_no_scale'
@@ -158,6 +170,9 @@ class Options(dict):
         if (os.environ.get('GPTUNE_LITE_MODE') is not None):
             self['lite_mode']=True
 
+        if(self['RCI_server'] is not None and self['RCI_mode']==True):
+            self['RCI_mode']=False   # the resident process receives the results through RCI_server and carries on like a normal run
+
         if(self['lite_mode']==True):
             self['model_class']='Model_GPy_LCM'
             self['distributed_memory_parallelism']=False
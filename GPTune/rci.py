@@ -0,0 +1,283 @@
+#! /usr/bin/env python
+
+# GPTune Copyright (c) 2019, The Regents of the University of California,
+# through Lawrence Berkeley National Laboratory (subject to receipt of any
+# required approvals from the U.S.Dept. of Energy) and the University of
+# California, Berkeley.  All rights reserved.
+#
+# If you have questions about your rights to use or distribute this software,
+# please contact Berkeley Lab's Intellectual Property Office at IPO@lbl.gov.
+#
+# NOTICE. This Software was developed under funding from the U.S. Department
+# of Energy and the U.S. Government consequently retains certain rights.
+# As such, the U.S. Government has been granted for itself and others acting
+# on its behalf a paid-up, nonexclusive, irrevocable, worldwide license in
+# the Software to reproduce, distribute copies to the public, prepare
+# derivative works, and perform publicly and display publicly, and to permit
+# other to do so.
+#
+
+# Resident reverse communication (RCI) mode: the GPTune process keeps running with options['RCI_server'] set to a
+# UNIX socket path, and the driver script asks it for the next sample and reports the result through this socket,
+# instead of relaunching GPTune after every sample.
+#
+# Protocol: one JSON request per connection, terminated by a newline, answered by one JSON line.
+#   {"request":"next"}  ->  {"status":"point", "id":<int>, "task_parameter":{...}, "tuning_parameter":{...}, "constants":{...}}
+#                           or {"status":"done"} once tuning has finished (blocks while GPTune is modeling and searching)
+#                           a point that is not reported within point_timeout seconds (options['RCI_server_point_timeout']) is handed out again
+#   {"request":"report", "id":<int>, "evaluation_result":{<objective name>:<value or list of values>}, "additional_output":{...}}
+#                       ->  {"status":"ok"} or {"status":"error", "message":...}, e.g. if an objective is missing or not numeric
+#
+# From a bash driver (the values are in the original parameter spaces, as in the database):
+#   python ./gptune_driver.py ... &      # with options['RCI_server'] = "gptune.sock"
+#   pid=$!
+#   while true; do
+#       point=$(python $GPTUNEROOT/GPTune/rci.py next -socket gptune.sock -pid $pid)
+#       if [ $(echo $point | jq -r '.status') = done ]; then break; fi
+#       ... run the application with $(echo $point | jq -r '.tuning_parameter.mb') etc. ...
+#       python $GPTUNEROOT/GPTune/rci.py report -socket gptune.sock -id $(echo $point | jq -r '.id') -result "{\"r\":$result}"
+#   done
+
+import json
+import os
+import sys
+import time
+import socket
+import threading
+import atexit
+import argparse
+
+def read_message(connection):
+    data = b""
+    while not data.endswith(b"\n"):
+        chunk = connection.recv(65536)
+        if not chunk:
+            break
+        data += chunk
+    if len(data) == 0:
+        return None
+    return json.loads(data.decode())
+
+def write_message(connection, message):
+    connection.sendall((json.dumps(message) + "\n").encode())
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def check_evaluation_result(evaluation_result, objective_names):
+    """ None if evaluation_result gives a number (or a non-empty list of numbers) for each objective, else an error message """
+    if not isinstance(evaluation_result, dict):
+        return "evaluation_result is not a dict"
+    for name in objective_names:
+        if name not in evaluation_result:
+            return "evaluation_result has no objective " + str(name)
+        value = evaluation_result[name]
+        if isinstance(value, list):
+            if len(value) == 0 or not all([is_number(v) for v in value]):
+                return "objective " + str(name) + " is not a non-empty list of numbers"
+        elif not is_number(value):
+            return "objective " + str(name) + " is not a number"
+    return None
+
+class RCIServer(object):
+    """ Hands out the samples GPTune wants evaluated to the RCI driver script, and collects their results.
+        evaluate() is called by the tuning loop and blocks until every point has been reported; several drivers may
+        ask for points concurrently, e.g. to evaluate a batch of samples in parallel. Points handed out to a driver that
+        does not report them within point_timeout seconds (e.g. it crashed) are handed out again. """
+
+    def __init__(self, socket_path, point_timeout=None):
+        self.socket_path = os.path.abspath(socket_path)
+        self.point_timeout = point_timeout
+        self.condition = threading.Condition()
+        self.next_id = 0
+        self.pending = [] # ids not handed out yet
+        self.points = {} # id -> point
+        self.objective_names = {} # id -> names of the objectives its evaluation_result must hold
+        self.handed_out = {} # id -> time at which it was last handed out, until it is reported
+        self.results = {} # id -> reported result
+        self.closing = False
+
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+                probe.close()
+                raise Exception(f"another GPTune RCI server is listening on {self.socket_path}")
+            except (ConnectionRefusedError, FileNotFoundError):
+                os.remove(self.socket_path) # left by a process that is gone
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(64)
+        print ("[RCIServer] Listening on " + self.socket_path)
+
+        self.thread = threading.Thread(target=self.run, name="rci-server", daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+
+    def run(self):
+        while True:
+            try:
+                connection, _ = self.listener.accept()
+            except OSError:
+                return # closed
+            threading.Thread(target=self.serve, args=(connection,), daemon=True).start()
+
+    def serve(self, connection):
+        try:
+            message = read_message(connection)
+            if message == None:
+                return
+            if message.get("request") == "next":
+                write_message(connection, self.next_point())
+            elif message.get("request") == "report":
+                write_message(connection, self.report(message))
+            else:
+                write_message(connection, {"status":"error", "message":"unknown request " + str(message.get("request"))})
+        except (OSError, ValueError) as e:
+            print ("[RCIServer] " + str(e))
+        finally:
+            connection.close()
+
+    def next_point(self):
+        with self.condition:
+            while len(self.pending) == 0 and not self.closing:
+                self.condition.wait()
+            if self.closing:
+                return {"status":"done"}
+            point_id = self.pending.pop(0)
+            self.handed_out[point_id] = time.time()
+            message = {"status":"point", "id":point_id}
+            message.update(self.points[point_id])
+            return message
+
+    def report(self, message):
+        with self.condition:
+            point_id = message.get("id")
+            if point_id not in self.points or point_id in self.results:
+                return {"status":"error", "message":"unknown point id " + str(point_id)}
+            if "evaluation_result" not in message:
+                return {"status":"error", "message":"no evaluation_result"}
+            error = check_evaluation_result(message["evaluation_result"], self.objective_names[point_id])
+            if error != None:
+                return {"status":"error", "message":error}
+            self.results[point_id] = {"evaluation_result":message["evaluation_result"],
+                    "additional_output":message.get("additional_output")}
+            # a late report of a point that was handed out again
+            self.handed_out.pop(point_id, None)
+            if point_id in self.pending:
+                self.pending.remove(point_id)
+            self.condition.notify_all()
+        return {"status":"ok"}
+
+    def evaluate(self, points, objective_names=None):
+        """ Results of the given points (dicts with task_parameter, tuning_parameter, constants), in the same order;
+            reports whose evaluation_result lacks one of objective_names are rejected """
+        with self.condition:
+            point_ids = []
+            for point in points:
+                self.points[self.next_id] = point
+                self.objective_names[self.next_id] = [] if objective_names == None else list(objective_names)
+                self.pending.append(self.next_id)
+                point_ids.append(self.next_id)
+                self.next_id += 1
+            self.condition.notify_all()
+            while not all([point_id in self.results for point_id in point_ids]):
+                if self.closing:
+                    raise Exception("[RCIServer] closed before all the points were reported")
+                self.requeue_expired()
+                self.condition.wait(timeout=1.0)
+            results = []
+            for point_id in point_ids:
+                del self.points[point_id]
+                del self.objective_names[point_id]
+                results.append(self.results.pop(point_id))
+        return results
+
+    def requeue_expired(self):
+        # called with self.condition held: hand out again the points whose driver did not report within point_timeout
+        if self.point_timeout == None:
+            return
+        now = time.time()
+        expired = [point_id for point_id, handed_out in self.handed_out.items() if now - handed_out > self.point_timeout]
+        for point_id in expired:
+            del self.handed_out[point_id]
+            print ("[RCIServer] Point " + str(point_id) + " was not reported within " + str(self.point_timeout) + " seconds, handing it out again")
+            self.pending.insert(0, point_id)
+        if len(expired) > 0:
+            self.condition.notify_all()
+
+    def close(self):
+        """ Tell the waiting and future drivers that tuning has finished, and remove the socket """
+        with self.condition:
+            if self.closing:
+                return
+            self.closing = True
+            self.condition.notify_all()
+        time.sleep(0.1) # let the waiting drivers get their answer
+        self.listener.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+def rci_request(socket_path, message, pid=None, timeout=None):
+    """ Send one request to the RCI server; waits for the server to come up. Returns {"status":"done"} if the
+        server process (pid) is gone or closes the connection without an answer. """
+    from crowdrepo import process_is_alive
+
+    deadline = None if timeout == None else time.time() + timeout
+    while True:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(socket_path)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            connection.close()
+            if pid != None and not process_is_alive(socket.gethostname(), pid):
+                return {"status":"done"}
+            if deadline != None and time.time() > deadline:
+                raise Exception(f"no GPTune RCI server on {socket_path}")
+            time.sleep(0.2)
+    try:
+        write_message(connection, message)
+        answer = read_message(connection)
+    finally:
+        connection.close()
+    if answer == None:
+        return {"status":"done"}
+    return answer
+
+def parse_args():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('request', type=str, choices=['next', 'report'], help='next: get the next sample to evaluate, report: send its result')
+    parser.add_argument('-socket', type=str, default='gptune.sock', help='UNIX socket of the GPTune RCI server (options["RCI_server"])')
+    parser.add_argument('-pid', type=int, default=None, help='Process id of the GPTune RCI server; "done" is returned once it has exited')
+    parser.add_argument('-timeout', type=float, default=None, help='Seconds to wait for the server to come up')
+    parser.add_argument('-id', type=int, default=None, help='Id of the reported sample')
+    parser.add_argument('-result', type=str, default=None, help='Evaluation result of the reported sample as JSON, e.g. {"r":1.5}')
+    parser.add_argument('-additional_output', type=str, default=None, help='Additional output of the reported sample as JSON')
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = parse_args()
+
+    if args.request == "next":
+        message = {"request":"next"}
+    else:
+        if args.id == None or args.result == None:
+            raise Exception("report requires -id and -result")
+        message = {"request":"report", "id":args.id, "evaluation_result":json.loads(args.result)}
+        if args.additional_output != None:
+            message["additional_output"] = json.loads(args.additional_output)
+
+    answer = rci_request(args.socket, message, pid=args.pid, timeout=args.timeout)
+    print (json.dumps(answer))
+    if answer["status"] == "error":
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
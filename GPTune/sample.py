@@ -17,6 +17,7 @@
 
 import abc
 from problem import Problem
+from data import point_key
 from typing import Callable
 import numpy as np
 import math
@@ -33,7 +34,8 @@ class Sample(abc.ABC):
 
         raise Exception("Abstract method")
 
-    def sample_constrained(self, n_samples : int, repeat : int, space : Space, check_constraints : Callable = None, check_constraints_kwargs : dict = {}, **kwargs):
+    # check_constraints_batch (optional) takes a dict of parameter columns and the dict of shared values, and returns a boolean mask, see Computer.evaluate_constraints_batch
+    def sample_constrained(self, n_samples : int, repeat : int, space : Space, check_constraints : Callable = None, check_constraints_kwargs : dict = {}, check_constraints_batch : Callable = None, **kwargs):
 
         if (check_constraints is None):
             S = self.sample(n_samples, space)
@@ -57,17 +59,27 @@ class Sample(abc.ABC):
                 # t2 = time.time_ns()
                 # print('sample_para:',(t2-t1)/1e9)
 
-                for s_norm in S2:
-                    # print("jiji",s_norm)
-                    s_orig = space.inverse_transform(np.array(s_norm, ndmin=2))[0]
-                    kwargs2 = {d.name: s_orig[i] for (i, d) in enumerate(space)}
-                    # print("dfdfdfdfd",kwargs2)
-                    kwargs2.update(check_constraints_kwargs)
-                    if (check_constraints(kwargs2)):
-                        S.append(s_norm)
+                if (check_constraints_batch is not None and len(S2) > 0):
+                    S2_orig = space.inverse_transform(np.array(S2, ndmin=2))
+                    columns = {d.name: [s_orig[i] for s_orig in S2_orig] for (i, d) in enumerate(space)}
+                    mask = check_constraints_batch(columns, point = dict(check_constraints_kwargs))
+                    for j in np.nonzero(mask)[0]:
+                        S.append(S2[j])
                         cpt += 1
                         if (cpt >= n_samples):
                             break
+                else:
+                    for s_norm in S2:
+                        # print("jiji",s_norm)
+                        s_orig = space.inverse_transform(np.array(s_norm, ndmin=2))[0]
+                        kwargs2 = {d.name: s_orig[i] for (i, d) in enumerate(space)}
+                        # print("dfdfdfdfd",kwargs2)
+                        kwargs2.update(check_constraints_kwargs)
+                        if (check_constraints(kwargs2)):
+                            S.append(s_norm)
+                            cpt += 1
+                            if (cpt >= n_samples):
+                                break
                 # print('input',S,space[0],isinstance(space[0], Categorical))
 
                 n_itr += 1
@@ -84,11 +96,11 @@ class Sample(abc.ABC):
 
         return S
 
-    def sample_inputs(self, n_samples : int, IS : Space, check_constraints : Callable = None, check_constraints_kwargs : dict = {}, **kwargs):
+    def sample_inputs(self, n_samples : int, IS : Space, check_constraints : Callable = None, check_constraints_kwargs : dict = {}, check_constraints_batch : Callable = None, **kwargs):
 
-        return self.sample_constrained(n_samples, 0, IS, check_constraints = check_constraints, check_constraints_kwargs = check_constraints_kwargs, **kwargs)
+        return self.sample_constrained(n_samples, 0, IS, check_constraints = check_constraints, check_constraints_kwargs = check_constraints_kwargs, check_constraints_batch = check_constraints_batch, **kwargs)
 
-    def sample_parameters(self, problem : Problem, n_samples : int, I : np.ndarray, IS : Space, PS : Space, check_constraints : Callable = None, check_constraints_kwargs : dict = {}, **kwargs):
+    def sample_parameters(self, problem : Problem, n_samples : int, I : np.ndarray, IS : Space, PS : Space, check_constraints : Callable = None, check_constraints_kwargs : dict = {}, check_constraints_batch : Callable = None, **kwargs):
 
         P = []
         targetSeed = 0
@@ -106,22 +118,19 @@ class Sample(abc.ABC):
             kwargs2 = {d.name: I_orig[i] for (i, d) in enumerate(IS)}
             kwargs2.update(check_constraints_kwargs)
 
-            xs__ = self.sample_constrained(n_samples, 0, PS, check_constraints = check_constraints, check_constraints_kwargs = kwargs2, **kwargs) # result from the sampling module
+            xs__ = self.sample_constrained(n_samples, 0, PS, check_constraints = check_constraints, check_constraints_kwargs = kwargs2, check_constraints_batch = check_constraints_batch, **kwargs) # result from the sampling module
             xs = []
+            xs_keys = set() # original-space keys of xs
 
             repeat = 0
             while (len(xs) < n_samples):
                 gen_samples = n_samples - len(xs)
-                xs_ = self.sample_constrained(gen_samples, repeat, PS, check_constraints = check_constraints, check_constraints_kwargs = kwargs2, **kwargs) # result from the sampling module
-                for elem_xs_ in xs_: # remove any duplicates
-                    duplicate = False
-                    for elem_xs in xs:
-                        elem_xs_orig_ = problem.PS.inverse_transform(np.array([elem_xs_], ndmin=2))
-                        elem_xs_orig = problem.PS.inverse_transform(np.array([elem_xs], ndmin=2))
-                        if elem_xs_orig_ == elem_xs_orig:
-                            duplicate = True
-                            break
-                    if duplicate == False:
+                xs_ = self.sample_constrained(gen_samples, repeat, PS, check_constraints = check_constraints, check_constraints_kwargs = kwargs2, check_constraints_batch = check_constraints_batch, **kwargs) # result from the sampling module
+                xs_orig_ = problem.PS.inverse_transform(np.array(xs_, ndmin=2))
+                for (elem_xs_, elem_xs_orig_) in zip(xs_, xs_orig_): # remove any duplicates
+                    key = point_key(elem_xs_orig_)
+                    if key not in xs_keys:
+                        xs_keys.add(key)
                         xs.append(list(elem_xs_))
                 repeat += 1
             xs = np.array(xs)
@@ -138,8 +147,6 @@ class Sample(abc.ABC):
 
         return P
 
-import lhsmdu
-
 class SampleLHSMDU(Sample):
 
     def __init__(self):
@@ -152,6 +159,8 @@ class SampleLHSMDU(Sample):
 
     def sample(self, n_samples : int, space : Space, n_itr : int, **kwargs):
 
+        import lhsmdu
+
         kwargs = kwargs['kwargs']
 
         #if kwargs['sample_random_seed'] != None:
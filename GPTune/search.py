@@ -24,13 +24,13 @@ from typing import Collection
 import numpy as np
 import scipy as sp
 import functools
-from joblib import *
+import collections
 
 import copy
 from problem import Problem
 from computer import Computer
 from options import Options
-from data import Data
+from data import Data, point_key
 from model import Model
 from sample import *
 
@@ -100,28 +100,22 @@ class Search(abc.ABC):
                 tid = res_[0]
                 x = res_[1][0]
                 tmp = x
+                index = data.parameter_index(tid)
                 duplicate = False
-                for x_ in data.P[tid]:
-                    x_orig = self.problem.PS.inverse_transform(np.array(x, ndmin=2))[0]
-                    x_orig_ = self.problem.PS.inverse_transform(np.array(x_, ndmin=2))[0]
-                    if x_orig == x_orig_:
-                        duplicate = True
-                        print ("duplicated sample: ", x)
-                        break
+                if len(index) > 0 and point_key(self.problem.PS.inverse_transform(np.array(x, ndmin=2))[0]) in index:
+                    duplicate = True
+                    print ("duplicated sample: ", x)
 
                 while duplicate == True:
                     duplicate = False
                     # generate random sample if the sample already has duplicates
                     x = np.random.rand(len(tmp[0]))
+                    x_orig = self.problem.PS.inverse_transform(np.array(x, ndmin=2))[0]
                     print ("generate random sample: ", x)
-                    print ("generate random sample (orig): ", self.problem.PS.inverse_transform(np.array(x, ndmin=2))[0])
+                    print ("generate random sample (orig): ", x_orig)
                     res_[1][0] = np.array([x.tolist()], ndmin=2)
-                    for x_ in data.P[tid]:
-                        x_orig = self.problem.PS.inverse_transform(np.array(x, ndmin=2))[0]
-                        x_orig_ = self.problem.PS.inverse_transform(np.array(x_, ndmin=2))[0]
-                        if x_orig == x_orig_:
-                            duplicate = True
-                            break
+                    if point_key(x_orig) in index:
+                        duplicate = True
         res.sort(key = lambda x : x[0])
         return res
 
@@ -138,6 +132,12 @@ class SurrogateProblem(object):
 
         self.tid = tid
 
+        # LRU cache keyed on point_key of the points in the original space, holding the constraint verdict ('cond'), the performance model data ('modeldata') and the (mu, var) prediction of each objective o (o)
+        self.cache = collections.OrderedDict()
+        self.cache_size = self.options['search_cache_size'] if self.options['search_cache_size'] is not None else 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
         self.D     = self.data.D[tid]
         self.IOrig = self.problem.IS.inverse_transform(np.array(self.data.I[tid], ndmin=2))[0]
         if (self.options['verbose']):
@@ -145,8 +145,10 @@ class SurrogateProblem(object):
 
         if self.data.P is not None and len(self.data.P[tid]) > 0:
             self.POrig = self.problem.PS.inverse_transform(np.array(self.data.P[tid], ndmin=2))
+            self.POrig_index = self.data.parameter_index(tid)
         else:
             self.POrig = [] # self.POrig = [[]]
+            self.POrig_index = set()
         if (self.options['verbose']):
             print ("self.POrig: ", self.POrig)
 
@@ -216,7 +218,10 @@ class SurrogateProblem(object):
                 LHS = [(-1.0*float(y_elem/ymin))-(-1.0*(ymin/ymin)) for y_elem in y_list]
             print ("LHS: ", LHS)
             RHS = []
-            for x_sample in x_list:
+            # predictions of the previous model at all the samples at once, and at x_star once
+            (mu_list, var_list) = self.models[o].predict_batch(np.array(x_list, ndmin=2), self.tid, last=True)
+            (mu_star_list, var_star_list) = self.models[o].predict_batch(np.array(x_star, ndmin=2), self.tid, last=True)
+            for j, x_sample in enumerate(x_list):
                 point = self.D
                 point.update({self.problem.IS[k].name: self.IOrig[k] for k in range(self.problem.DI)})
                 point_x_sample = point.copy()
@@ -241,10 +246,8 @@ class SurrogateProblem(object):
                 print ("point_x_star_orig: ", point_x_star_orig)
 
                 RHS_row = []
-                (mu, var) = self.models[o].predict_last(x_sample, tid=self.tid)
-                mu = mu[0][0]
-                (mu_star, var_star) = self.models[o].predict_last(x_star, tid=self.tid)
-                mu_star = mu_star[0][0]
+                mu = mu_list[j][0]
+                mu_star = mu_star_list[0][0]
                 if self.options['TLA_method'] == 'Regression_No_Scale':
                     RHS_elem = (-1.0*float(mu))-(-1.0*(mu_star))
                 else:
@@ -292,6 +295,59 @@ class SurrogateProblem(object):
         DP = self.problem.DP
         return ([0. for i in range(DP)], [1. for  i in range(DP)])
 
+    def cache_lookup(self, key):
+
+        # cache entry of the point key (inserted empty if the point is not cached yet), the entry is not kept if the cache is disabled
+        if (self.cache_size <= 0):
+            return {}
+        entry = self.cache.get(key)
+        if (entry is None):
+            entry = {}
+            self.cache[key] = entry
+            if (len(self.cache) > self.cache_size):
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(key)
+        return entry
+
+    def cache_has(self, entry, field):
+
+        if (field in entry):
+            self.cache_hits += 1
+            return True
+        self.cache_misses += 1
+        return False
+
+    def cache_report(self):
+
+        total = self.cache_hits + self.cache_misses
+        if (self.cache_size > 0 and total > 0):
+            print ("search cache (tid %d): %d hits, %d misses, hit rate %.1f%%, %d points cached"%(self.tid, self.cache_hits, self.cache_misses, 100.0*self.cache_hits/total, len(self.cache)))
+
+    def predict_cached(self, o, x, keys=None, batch=False):
+
+        # (mu, var) of objective o at the rows of x, keys holds the point_key of each row: only the rows whose prediction is not cached are predicted
+        if (keys is None or self.cache_size <= 0 or (not batch and len(keys) != 1)):
+            if (batch):
+                return self.models[o].predict_batch(x, self.tid)
+            return self.models[o].predict(x, tid=self.tid)
+
+        entries = [self.cache_lookup(key) for key in keys]
+        missing = [i for i in range(len(keys)) if not self.cache_has(entries[i], o)]
+        if (len(missing) > 0):
+            if (batch):
+                (mu, var) = self.models[o].predict_batch(x[missing,:], self.tid)
+            else:
+                (mu, var) = self.models[o].predict(x, tid=self.tid)
+            mu = np.asarray(mu).reshape(-1)
+            var = np.asarray(var).reshape(-1)
+            for j in range(len(missing)):
+                entries[missing[j]][o] = (mu[j], var[j])
+
+        mu = np.array([entry[o][0] for entry in entries]).reshape(len(keys), 1)
+        var = np.array([entry[o][1] for entry in entries]).reshape(len(keys), 1)
+        return (mu, var)
+
     def is_dominated(self, x, S):
         is_dom = False
         for pt in S:
@@ -300,14 +356,15 @@ class SurrogateProblem(object):
                 break
         return is_dom
 
-    # Acquisition function
-    def af(self, x):
+    # Acquisition function, keys (if not None) holds the point_key of each row of x to look up the cached predictions
+    def af(self, x, keys=None):
+        import scipy.special
 
         if self.options['search_af'] == 'UCB-HVI':
             uhvi_pt = np.empty(self.problem.DO)
             for o in range(self.problem.DO):
                 # print(o,self.models[o].M.kern.lengthscale)
-                (mu, var) = self.models[o].predict(x, tid=self.tid)
+                (mu, var) = self.predict_cached(o, x, keys)
                 var = max(1e-18, var[0][0])
                 uhvi_pt[o] = (mu - np.sqrt(self.options['search_ucb_beta']* var))
             uhvi_pt = np.where(uhvi_pt > self.A, uhvi_pt, self.A)
@@ -348,14 +405,14 @@ class SurrogateProblem(object):
                 else:
                     if self.models_transfer == None:
                         if self.data.O == None:
-                            (mu, var) = self.models[o].predict(x, tid=self.tid)
+                            (mu, var) = self.predict_cached(o, x, keys)
                             mu = mu[0][0]
                             var = max(1e-18, var[0][0])
                             AF.append(1.0/mu)
                         else:
                             if self.options['search_af'] == 'EI':
                                 ymin = self.data.O[self.tid][:,o].min()
-                                (mu, var) = self.models[o].predict(x, tid=self.tid)
+                                (mu, var) = self.predict_cached(o, x, keys)
                                 mu = mu[0][0]
                                 var = max(1e-18, var[0][0])
                                 std = np.sqrt(var)                            
@@ -364,7 +421,7 @@ class SurrogateProblem(object):
                                 phi = np.exp(-0.5 * chi**2) / np.sqrt(2 * np.pi * var)
                                 AF.append(-((ymin - mu -self.options['search_ei_alpha']) * Phi + std * phi))
                             elif self.options['search_af'] == 'UCB': # as we are minimizing af, use mu - sqrt(beta)std (LCB) instead of mu + sqrt(beta)std (UCB)
-                                (mu, var) = self.models[o].predict(x, tid=self.tid)
+                                (mu, var) = self.predict_cached(o, x, keys)
                                 mu = mu[0][0]
                                 var = max(1e-18, var[0][0])
                                 std = np.sqrt(var)                            
@@ -385,7 +442,7 @@ class SurrogateProblem(object):
                         xi0 = self.problem.PS.inverse_transform(np.array(x, ndmin=2))
                         xi=xi0[0]
 
-                        if (any(xx==xi for xx in self.POrig)):
+                        if (point_key(xi) in self.POrig_index):
                             cond = False
                         else:
                             point0 = self.D
@@ -413,7 +470,7 @@ class SurrogateProblem(object):
                         xi0 = self.problem.PS.inverse_transform(np.array(x, ndmin=2))
                         xi=xi0[0]
 
-                        if (any(xx==xi for xx in self.POrig)):
+                        if (point_key(xi) in self.POrig_index):
                             cond = False
                         else:
                             point0 = self.D
@@ -424,7 +481,7 @@ class SurrogateProblem(object):
                             cond = self.computer.evaluate_constraints(self.problem, point)
 
                         ymin = self.data.O[self.tid][:,o].min()
-                        (mu, var) = self.models[o].predict(x, tid=self.tid)
+                        (mu, var) = self.predict_cached(o, x, keys)
                         mu_transfer = 0
                         var_transfer = 1
 
@@ -448,7 +505,7 @@ class SurrogateProblem(object):
                         # AF.append(mu)
                     elif self.options['TLA_method'] == 'LCM' or self.options['TLA_method'] == 'LCM_BF':
                         ymin = self.data.O[self.tid][:,o].min()
-                        (mu, var) = self.models[o].predict(x, tid=self.tid)
+                        (mu, var) = self.predict_cached(o, x, keys)
                         mu = mu[0][0]
                         var = max(1e-18, var[0][0])
                         std = np.sqrt(var)
@@ -461,7 +518,7 @@ class SurrogateProblem(object):
                         xi0 = self.problem.PS.inverse_transform(np.array(x, ndmin=2))
                         xi=xi0[0]
 
-                        if (any(xx==xi for xx in self.POrig)):
+                        if (point_key(xi) in self.POrig_index):
                             cond = False
                         else:
                             point0 = self.D
@@ -472,7 +529,7 @@ class SurrogateProblem(object):
                             cond = self.computer.evaluate_constraints(self.problem, point)
 
                         ymin = self.data.O[self.tid][:,o].min()
-                        (mu, var) = self.models[o].predict(x, tid=self.tid)
+                        (mu, var) = self.predict_cached(o, x, keys)
                         mu_transfer = 0
                         var_transfer = 1
                         num_models_transfer = len(self.models_transfer)
@@ -508,8 +565,9 @@ class SurrogateProblem(object):
         xNorm = self.problem.PS.transform(xi0)
         CND = True
         modeldata=[]
-        for xi in xi0:
-            if (any(xx==xi for xx in self.POrig)):
+        keys = [point_key(xi) for xi in xi0]
+        for (xi, key) in zip(xi0, keys):
+            if (key in self.POrig_index):
                 cond = False
                 CND = False
             else:
@@ -519,12 +577,21 @@ class SurrogateProblem(object):
                 point.update(point0)
                 point.update(point2)
                 # print("point", point)
-                cond = self.computer.evaluate_constraints(self.problem, point)
+                entry = self.cache_lookup(key)
+                if (self.cache_has(entry, 'cond')):
+                    cond = entry['cond']
+                else:
+                    cond = self.computer.evaluate_constraints(self.problem, point)
+                    entry['cond'] = cond
                 if(cond == False):
                     CND = False
 
             if (cond):
-                if(self.problem.models is not None):    
+                if(self.problem.models is not None and self.cache_has(entry, 'modeldata')):
+                    modeldata.append(entry['modeldata'])
+                elif(self.problem.models is not None):    
+                    if(self.problem.constants is not None):
+                        point.update(self.problem.constants)   # as done by evaluate_constraints, which is skipped when the verdict is cached; same inputs as in fitness_batch
                     if(self.options['distributed_memory_parallelism']== True):                
                         if(self.problem.driverabspath is not None):
                             modulename = Path(self.problem.driverabspath).stem  # get the driver name excluding all directories and extensions
@@ -535,6 +602,7 @@ class SurrogateProblem(object):
                         modeldata.append(module.models(point))
                     else:
                         modeldata.append(self.problem.models(point))                  
+                    entry['modeldata'] = modeldata[-1]
         if (CND):
             if(self.problem.models is not None):
                 xNorm = np.hstack((xNorm,np.array(modeldata).reshape(self.options['search_more_samples'],1)))  # YL: here tmpdata in the normalized space, but modeldata is the in the original space
@@ -544,7 +612,7 @@ class SurrogateProblem(object):
             # sys.exit()          
             # print("cond",cond,- self.af(x),'x',x,'xi',xi)
             #print ("AF: ", self.af(xNorm))
-            return self.af(xNorm)
+            return self.af(xNorm, keys)
         else:
             # print("cond",cond,float("Inf"),'x',x,'xi',xi)
             if(self.problem.DO==1): # single objective optimizer
@@ -557,17 +625,152 @@ class SurrogateProblem(object):
     def obj_scipy(self, x):
         return self.fitness(x)[0]
 
+    # Acquisition function of a batch of points (one per row), same values as calling af on each row
+    def af_batch(self, X, keys=None):
+        import scipy.special
+
+        # the branches of af that only involve self.models are vectorized, the others (UCB-HVI, transfer learning with model functions) are evaluated point by point
+        search_af = None
+        if self.options['search_af'] == 'UCB-HVI':
+            search_af = None
+        elif self.models_transfer == None:
+            if self.data.O is None:
+                search_af = 'inverse'
+            elif self.options['search_af'] in ['EI', 'UCB', 'MSPE']:
+                search_af = self.options['search_af']
+        elif self.models is not None and (self.options['TLA_method'] == 'LCM' or self.options['TLA_method'] == 'LCM_BF'):
+            search_af = 'EI'
+        if (search_af is None):
+            return np.array([self.af(X[i:i+1,:], None if keys is None else keys[i:i+1]) for i in range(X.shape[0])], ndmin=2)
+
+        AF=[]
+        for o in range(self.problem.DO):
+            optimize = self.problem.OS[o].optimize
+            if (self.options['search_algo']=='pso' and optimize == False):
+                continue
+            elif (optimize == False):
+                AF.append(np.zeros(X.shape[0]))
+            elif search_af == 'inverse':
+                (mu, var) = self.predict_cached(o, X, keys, batch=True)
+                AF.append(1.0/mu[:,0])
+            elif search_af == 'MSPE':
+                N = np.array(self.data.P[self.tid], ndmin=2).shape[0]
+                X_joint = np.vstack((X,np.array(self.data.P[self.tid], ndmin=2)))
+                (mu_cross, sigma_joint) = self.models[o].predict(X_joint, tid=self.tid, full_cov=True)
+                m = X.shape[0]
+                sigma = np.diag(sigma_joint[0:m,0:m])
+                sigma_obs = sigma_joint[m:,m:]
+                sigma_cross = sigma_joint[0:m,m:]
+                mspe = (sigma - np.sum((sigma_cross @ sigma_obs) * sigma_cross, axis=1))/N
+                AF.append(mspe)
+            else:
+                (mu, var) = self.predict_cached(o, X, keys, batch=True)
+                mu = mu[:,0]
+                var = np.maximum(1e-18, var[:,0])
+                std = np.sqrt(var)
+                if search_af == 'EI':
+                    ymin = self.data.O[self.tid][:,o].min()
+                    chi = (ymin - mu -self.options['search_ei_alpha']) / std
+                    Phi = 0.5 * (1.0 + sp.special.erf(chi / np.sqrt(2)))
+                    phi = np.exp(-0.5 * chi**2) / np.sqrt(2 * np.pi * var)
+                    AF.append(-((ymin - mu -self.options['search_ei_alpha']) * Phi + std * phi))
+                else: # UCB, as we are minimizing af, use mu - sqrt(beta)std (LCB) instead of mu + sqrt(beta)std (UCB)
+                    AF.append(mu - np.sqrt(self.options['search_ucb_beta'])*std)
+
+        return np.array(AF, ndmin=2).T
+
+    def fitness_batch(self, X, nobj=None):   # X is in the normalized space, one point per row
+
+        X = np.array(X, ndmin=2)
+        if (nobj is None):
+            if(self.problem.DO==1 or self.options['search_algo']=='pso' or self.options['search_algo']=='cmaes'):
+                nobj = 1
+            else:
+                nobj = self.problem.DO
+        F = np.full((X.shape[0], nobj), self.options['search_bigval'], dtype=np.float64)
+
+        xi0 = self.problem.PS.inverse_transform(X)
+        xNorm = np.array(self.problem.PS.transform(xi0), ndmin=2)
+        module = self.problem
+        if(self.problem.models is not None and self.options['distributed_memory_parallelism']== True):
+            if(self.problem.driverabspath is not None):
+                modulename = Path(self.problem.driverabspath).stem  # get the driver name excluding all directories and extensions
+                sys.path.append(self.problem.driverabspath) # add path to sys
+                module = importlib.import_module(modulename) # import driver name as a module
+            else:
+                raise Exception('performance models require passing driverabspath to GPTune')
+
+        point0 = self.D
+        point2 = {self.problem.IS[k].name: self.IOrig[k] for k in range(self.problem.DI)}
+        keys = [point_key(xi) for xi in xi0]
+        candidates = [i for i in range(len(xi0)) if keys[i] not in self.POrig_index]
+        entries = {i: self.cache_lookup(keys[i]) for i in candidates}
+        unchecked = [i for i in candidates if not self.cache_has(entries[i], 'cond')]
+        if (len(unchecked) > 0):
+            columns = {self.problem.PS[k].name: [xi0[i][k] for i in unchecked] for k in range(self.problem.DP)}
+            point = dict(point0)
+            point.update(point2)
+            mask = self.computer.evaluate_constraints_batch(self.problem, columns, point = point)
+            for j in range(len(unchecked)):
+                entries[unchecked[j]]['cond'] = bool(mask[j])
+        valid = [i for i in candidates if entries[i]['cond']]
+
+        modeldata = []
+        if(self.problem.models is not None):
+            for i in valid:
+                if (self.cache_has(entries[i], 'modeldata')):
+                    modeldata.append(entries[i]['modeldata'])
+                    continue
+                xi = xi0[i]
+                point  = {self.problem.PS[k].name: xi[k] for k in range(self.problem.DP)}
+                point.update(point0)
+                point.update(point2)
+                if(self.problem.constants is not None):
+                    point.update(self.problem.constants)
+                modeldata.append(module.models(point))
+                entries[i]['modeldata'] = modeldata[-1]
+
+        if (len(valid) > 0):
+            xNorm = xNorm[valid,:]
+            if(self.problem.models is not None):
+                xNorm = np.hstack((xNorm,np.array(modeldata).reshape(len(valid),-1)))  # YL: here tmpdata in the normalized space, but modeldata is the in the original space
+            F[valid,:] = self.af_batch(xNorm, [keys[i] for i in valid])
 
-from pymoo.core.problem import ElementwiseProblem
-class MyProblemPyMoo(ElementwiseProblem):
+        return F
 
-    def __init__(self,n_var,n_obj,prob):
-        super().__init__(n_var=n_var,n_obj=n_obj,n_constr=0,xl=np.array([0]*n_var),xu=np.array([1]*n_var))
-        self.prob=prob
+    # pygmo evaluates populations with this function if the algorithm is given a batch fitness evaluator (pg.bfe), dvs holds the decision vectors one after the other
+    def batch_fitness(self, dvs):
+        X = np.array(dvs).reshape((-1, self.problem.DP))
+        return self.fitness_batch(X, nobj=self.get_nobj()).flatten()
 
-    def _evaluate(self, x, out, *args, **kwargs):
-        fs = self.prob.fitness(x)
-        out["F"] = fs
+
+def define_pymoo_problems():
+    """ Define MyProblemPyMoo and MyBatchProblemPyMoo (at module level) on first use, so that importing search does not import pymoo """
+    global MyProblemPyMoo, MyBatchProblemPyMoo
+    if "MyProblemPyMoo" in globals():
+        return
+
+    from pymoo.core.problem import ElementwiseProblem
+    from pymoo.core.problem import Problem as ProblemPyMoo
+
+    class MyProblemPyMoo(ElementwiseProblem):
+
+        def __init__(self,n_var,n_obj,prob):
+            super().__init__(n_var=n_var,n_obj=n_obj,n_constr=0,xl=np.array([0]*n_var),xu=np.array([1]*n_var))
+            self.prob=prob
+
+        def _evaluate(self, x, out, *args, **kwargs):
+            fs = self.prob.fitness(x)
+            out["F"] = fs
+
+    class MyBatchProblemPyMoo(ProblemPyMoo):
+
+        def __init__(self,n_var,n_obj,prob):
+            super().__init__(n_var=n_var,n_obj=n_obj,n_constr=0,xl=np.array([0]*n_var),xu=np.array([1]*n_var))
+            self.prob=prob
+
+        def _evaluate(self, x, out, *args, **kwargs):
+            out["F"] = self.prob.fitness_batch(x, nobj=self.n_obj)
 
 
 class SearchPyMoo(Search):
@@ -585,8 +788,14 @@ class SearchPyMoo(Search):
         bestX = []
 
 
+        define_pymoo_problems()
+        if (kwargs['search_batch_fitness']):
+            MyProblem = MyBatchProblemPyMoo
+        else:
+            MyProblem = MyProblemPyMoo
+
         if(self.problem.DO==1 or kwargs['search_af']=='UCB-HVI'): # single objective optimizer
-            prob_pymoo = MyProblemPyMoo(self.problem.DP,1,prob)
+            prob_pymoo = MyProblem(self.problem.DP,1,prob)
             if('ga'==kwargs['search_algo']):
                 from pymoo.algorithms.soo.nonconvex.ga import GA
                 from pymoo.optimize import minimize
@@ -610,7 +819,7 @@ class SearchPyMoo(Search):
             bestX.append(np.array(res.X).reshape(1, self.problem.DP))
 
         else:                   # multi objective
-            prob_pymoo = MyProblemPyMoo(self.problem.DP,self.problem.DO,prob)
+            prob_pymoo = MyProblem(self.problem.DP,self.problem.DO,prob)
             if('nsga2'==kwargs['search_algo']):
                 from pymoo.algorithms.moo.nsga2 import NSGA2
                 from pymoo.optimize import minimize
@@ -632,6 +841,7 @@ class SearchPyMoo(Search):
         if (kwargs['verbose']):
             print(tid); sys.stdout.flush()
             print("bestX",bestX)
+            prob.cache_report()
         return (tid, bestX)
 
 
@@ -664,6 +874,8 @@ class SearchPyGMO(Search):
                 algo = eval(f'pg.{kwargs["search_algo"]}(gen = kwargs["search_gen"])')
             except:
                 raise Exception(f'Unknown optimization algorithm "{kwargs["search_algo"]}"')
+            if (kwargs['search_batch_fitness'] and hasattr(algo, 'set_bfe')):   # only some pygmo algorithms (e.g. pso_gen) can evaluate populations in batches
+                algo.set_bfe(pg.bfe())
             bestX = []
             cond = False
             cpt = 0
@@ -689,11 +901,19 @@ class SearchPyGMO(Search):
                         bestX.append(np.array(champions_x[idx]).reshape(1, self.problem.DP))
                         break
                 cpt += 1
+            if (kwargs['verbose']):   # the islands evolve copies of prob
+                for isl in archi:
+                    prob_isl = isl.get_population().problem.extract(SurrogateProblem)
+                    if (prob_isl is not None):
+                        prob_isl.cache_report()
         else:                   # multi objective
             try:
-                algo = eval(f'pg.algorithm(pg.{kwargs["search_algo"]}(gen = kwargs["search_gen"]))')
+                uda = eval(f'pg.{kwargs["search_algo"]}(gen = kwargs["search_gen"])')
             except:
                 raise Exception(f'Unknown optimization algorithm "{kwargs["search_algo"]}"')
+            if (kwargs['search_batch_fitness'] and hasattr(uda, 'set_bfe')):   # e.g. nsga2, nspso
+                uda.set_bfe(pg.bfe())
+            algo = pg.algorithm(uda)
             bestX = []
             cond = False
             cpt = 0
@@ -726,6 +946,10 @@ class SearchPyGMO(Search):
                     bestX.append(xss)
                     break
                 cpt += 1
+            if (kwargs['verbose']):   # the population evolves a copy of prob
+                prob_pop = pop.problem.extract(SurrogateProblem)
+                if (prob_pop is not None):
+                    prob_pop.cache_report()
         if (kwargs['verbose']):
             print(tid, 'OK' if cond else 'KO'); sys.stdout.flush()
             print("bestX",bestX)
@@ -748,6 +972,7 @@ class SurrogateProblemCMO(object):
         self.D     = self.data.D[tid]
         self.IOrig = self.problem.IS.inverse_transform(np.array(self.data.I[tid], ndmin=2))[0]
         self.POrig = self.problem.PS.inverse_transform(np.array(self.data.P[tid], ndmin=2))
+        self.POrig_index = self.data.parameter_index(tid)
 
     def get_nobj(self):
         if(self.options['search_algo']=='pso' or self.options['search_algo']=='cmaes'):
@@ -815,7 +1040,7 @@ class SurrogateProblemCMO(object):
         xi0 = self.problem.PS.inverse_transform(np.array(x, ndmin=2))
         xi=xi0[0]
 
-        if (any(xx==xi for xx in self.POrig)):
+        if (point_key(xi) in self.POrig_index):
             cond = False
         else:
             point0 = self.D
@@ -931,6 +1156,7 @@ class SearchCMO(Search):
 class SearchSciPy(Search):
 
     def search(self, data : Data, models : Collection[Model], tid : int, **kwargs) -> np.ndarray:
+        import scipy.optimize
 
         if(self.problem.DO>1):
             raise Exception("'SearchSciPy' cannot be used for multi-objective search")
@@ -955,7 +1181,8 @@ class SearchSciPy(Search):
 
         sampler = eval(f'{kwargs["sample_class"]}()')
         check_constraints = functools.partial(self.computer.evaluate_constraints, self.problem, inputs_only = False, kwargs = kwargs)
-        tmpP = sampler.sample_parameters(problem = self.problem, n_samples = 1, I = data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, **kwargs)
+        check_constraints_batch = functools.partial(self.computer.evaluate_constraints_batch, self.problem, inputs_only = False, kwargs = kwargs)
+        tmpP = sampler.sample_parameters(problem = self.problem, n_samples = 1, I = data.I, IS = self.problem.IS, PS = self.problem.PS, check_constraints = check_constraints, check_constraints_batch = check_constraints_batch, **kwargs)
         x0 = tmpP[0][0]
 
         lw = [0]*self.problem.DP
@@ -973,6 +1200,8 @@ class SearchSciPy(Search):
 
         # print(ret,'erere')
         print('>>>>Maximal acquisition function = ',ret.fun,' attained at ',ret.x)
+        if (kwargs['verbose']):
+            prob.cache_report()
 
         
 
@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+
+"""
+Measure the crowd repository upload queue against a local stand-in for the repository's direct-upload endpoint.
+
+Example of invocation of this script:
+
+python ./benchmark_crowd_upload.py -nuploads 200 -latency 0.05 -failure_rate 0.2 -batch_size 8
+
+where:
+    -nuploads is the number of function evaluations to upload
+    -latency is the response time of the stand-in server (seconds)
+    -failure_rate is the fraction of requests the stand-in server answers with HTTP 503
+    -batch_size is the number of function evaluations per upload request
+"""
+
+import sys
+import os
+import json
+import uuid
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import urllib.parse
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.abspath(__file__ + "/../../../GPTune/"))
+
+from crowdrepo import CrowdUploadQueue
+
+def parse_args():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-nuploads', type=int, default=200, help='Number of function evaluations to upload')
+    parser.add_argument('-latency', type=float, default=0.05, help='Response time of the stand-in server (s)')
+    parser.add_argument('-failure_rate', type=float, default=0.2, help='Fraction of requests failed by the stand-in server')
+    parser.add_argument('-batch_size', type=int, default=8, help='Function evaluations per upload request')
+
+    args = parser.parse_args()
+
+    return args
+
+class StandInRepository(BaseHTTPRequestHandler):
+
+    received_uids = set()
+    num_requests = 0
+    latency = 0.0
+    failure_rate = 0.0
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+        data = urllib.parse.parse_qs(body)
+        time.sleep(StandInRepository.latency)
+        StandInRepository.num_requests += 1
+        if random.random() < StandInRepository.failure_rate:
+            self.send_response(503)
+            self.end_headers()
+            return
+        if "function_evaluation_documents" in data:
+            documents = json.loads(data["function_evaluation_documents"][0])
+        else:
+            documents = [json.loads(data["function_evaluation_document"][0])]
+        for document in documents:
+            StandInRepository.received_uids.add(document["uid"])
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+def main():
+
+    args = parse_args()
+
+    StandInRepository.latency = args.latency
+    StandInRepository.failure_rate = args.failure_rate
+    server = HTTPServer(("127.0.0.1", 0), StandInRepository)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    upload_url = "http://127.0.0.1:" + str(server.server_port) + "/repo/direct-upload/"
+
+    spill_path = tempfile.mkdtemp(prefix="gptune-benchmark-")
+    upload_queue = CrowdUploadQueue(upload_url, "api_key", "benchmark", None, spill_path+"/benchmark",
+            batch_size=args.batch_size, timeout=10, max_retries=8, backoff=0.01)
+
+    uids = []
+    t1 = time.time()
+    for i in range(args.nuploads):
+        document = {"tuning_parameter":{"x":i}, "evaluation_result":{"y":float(i)}, "uid":str(uuid.uuid1())}
+        uids.append(document["uid"])
+        upload_queue.put([document])
+    t2 = time.time()
+    upload_queue.flush()
+    t3 = time.time()
+    upload_queue.close()
+
+    print ("uploads: ", args.nuploads, " latency (s): ", args.latency, " failure rate: ", args.failure_rate, " batch size: ", args.batch_size)
+    print ("time in put (s): ", t2-t1, " per evaluation (ms): ", 1000*(t2-t1)/args.nuploads)
+    print ("time until uploaded (s): ", t3-t1)
+    print ("requests: ", StandInRepository.num_requests, " failed requests: ", upload_queue.num_failed_requests)
+    print ("received: ", len(StandInRepository.received_uids), " missing: ", len([uid for uid in uids if uid not in StandInRepository.received_uids]))
+
+    server.shutdown()
+    shutil.rmtree(spill_path)
+
+if __name__ == "__main__":
+    main()
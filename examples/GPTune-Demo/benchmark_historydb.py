@@ -0,0 +1,125 @@
+#! /usr/bin/env python
+
+"""
+Measure HistoryDB store throughput with concurrent writer processes on a local file system.
+
+Example of invocation of this script:
+
+python ./benchmark_historydb.py -nwriters 8 -nstores 100 -backend json -sync atomic
+
+where:
+    -nwriters is the number of concurrent writer processes
+    -nstores is the number of function evaluations stored by each writer
+    -backend is the HistoryDB storage backend: json, jsonl, sqlite
+    -sync is the file synchronization method: filelock, atomic
+"""
+
+import sys
+import os
+import uuid
+import time
+import shutil
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.abspath(__file__ + "/../../../GPTune/"))
+
+from database import HistoryDB
+
+def parse_args():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-nwriters', type=int, default=4, help='Number of concurrent writer processes')
+    parser.add_argument('-nstores', type=int, default=100, help='Number of stores per writer')
+    parser.add_argument('-backend', type=str, default='json', help='HistoryDB storage backend (json, jsonl, sqlite)')
+    parser.add_argument('-sync', type=str, default='atomic', help='File synchronization method (filelock, atomic)')
+    parser.add_argument('-path', type=str, default=None, help='Directory for the database (default: a temporary directory)')
+
+    args = parser.parse_args()
+
+    return args
+
+def function_evaluation_document(writer, i):
+    return {
+        "task_parameter":{"t":1.0},
+        "tuning_parameter":{"x":(writer*100003+i)%1000/1000.0},
+        "constants":{},
+        "machine_configuration":{"machine_name":"mymachine"},
+        "software_configuration":{},
+        "evaluation_result":{"y":float(i)},
+        "evaluation_detail":{"y":{"evaluations":[float(i)], "objective_scheme":"average"}},
+        "additional_output":{},
+        "source":"measure",
+        "modeling":"SLA_GP",
+        "model_class":"Model_GPy_LCM",
+        "uid":str(uuid.uuid1())
+    }
+
+def writer(writer_id, historydb_path, backend, sync, nstores, barrier, queue):
+
+    historydb = HistoryDB(meta_dict={"tuning_problem_name":"benchmark",
+        "historydb_path":historydb_path,
+        "historydb_backend":backend,
+        "write_buffer_size":1,
+        "machine_configuration":{"machine_name":"mymachine"},
+        "software_configuration":{}})
+    historydb.file_synchronization_method = sync
+
+    barrier.wait()
+    t1 = time.time()
+    uids = []
+    for i in range(nstores):
+        document = function_evaluation_document(writer_id, i)
+        uids.append(document["uid"])
+        historydb.append_history_data("func_eval", [document])
+    t2 = time.time()
+
+    queue.put((t2-t1, uids))
+
+def main():
+
+    args = parse_args()
+
+    historydb_path = args.path
+    if historydb_path is None:
+        historydb_path = tempfile.mkdtemp(prefix="gptune-benchmark-")
+    os.makedirs(historydb_path, exist_ok=True)
+
+    # create the database once, before the writers race for it
+    historydb = HistoryDB(meta_dict={"tuning_problem_name":"benchmark",
+        "historydb_path":historydb_path,
+        "historydb_backend":args.backend,
+        "machine_configuration":{"machine_name":"mymachine"},
+        "software_configuration":{}})
+
+    barrier = multiprocessing.Barrier(args.nwriters+1)
+    queue = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=writer, args=(i, historydb_path, args.backend, args.sync, args.nstores, barrier, queue)) for i in range(args.nwriters)]
+    for p in processes:
+        p.start()
+
+    barrier.wait()
+    t1 = time.time()
+    results = [queue.get() for p in processes]
+    t2 = time.time()
+    for p in processes:
+        p.join()
+
+    stored_uids = set([func_eval["uid"] for func_eval in historydb.query_func_eval()])
+    expected_uids = [uid for (elapsed, uids) in results for uid in uids]
+    num_missing = len([uid for uid in expected_uids if uid not in stored_uids])
+
+    num_stores = args.nwriters*args.nstores
+    print ("backend: ", args.backend, " sync: ", args.sync, " writers: ", args.nwriters, " stores per writer: ", args.nstores)
+    print ("wall time (s): ", t2-t1)
+    print ("throughput (stores/s): ", num_stores/(t2-t1))
+    print ("mean per-writer time (s): ", sum([elapsed for (elapsed, uids) in results])/len(results))
+    print ("stored: ", len(stored_uids), " missing: ", num_missing)
+
+    if args.path is None:
+        shutil.rmtree(historydb_path)
+
+if __name__ == "__main__":
+    main()
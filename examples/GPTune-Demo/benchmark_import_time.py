@@ -0,0 +1,88 @@
+#! /usr/bin/env python
+
+"""
+Measure the time of "import gptune" in a fresh interpreter (what every RCI relaunch pays), and check that the
+heavy optional dependencies are not imported before they are used.
+
+Example of invocation of this script:
+
+python ./benchmark_import_time.py -nrepeats 5 -max_seconds 2.0
+
+where:
+    -nrepeats is the number of fresh interpreters to time
+    -max_seconds is the budget for the median import time; the script exits with status 1 if it is exceeded
+                 or if one of the lazily imported modules was loaded by "import gptune"
+    -top is the number of slowest modules (cumulative, from python -X importtime) to print
+"""
+
+import sys
+import os
+import time
+import json
+import argparse
+import subprocess
+
+# modules that "import gptune" must not load; they are imported by the code paths that use them
+LAZY_MODULES = ["GPy", "lcm", "mpi4py", "pymoo", "pygmo", "lhsmdu", "openturns", "SALib", "shap", "requests", "joblib"]
+
+def parse_args():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-nrepeats', type=int, default=5, help='Number of fresh interpreters to time')
+    parser.add_argument('-max_seconds', type=float, default=None, help='Budget for the median import time (s)')
+    parser.add_argument('-top', type=int, default=10, help='Number of slowest modules to print')
+
+    args = parser.parse_args()
+
+    return args
+
+def main():
+
+    args = parse_args()
+
+    gptune_path = os.path.abspath(__file__ + "/../../../GPTune/")
+    env = dict(os.environ)
+    env["PYTHONPATH"] = gptune_path + os.pathsep + env.get("PYTHONPATH", "")
+
+    script = "import sys, json; import gptune; print(json.dumps(sorted(sys.modules.keys())))"
+
+    elapsed = []
+    for i in range(args.nrepeats):
+        t1 = time.time()
+        output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+        t2 = time.time()
+        elapsed.append(t2-t1)
+    modules = json.loads(output.stdout.strip().split("\n")[-1])
+    elapsed.sort()
+    median = elapsed[len(elapsed)//2]
+
+    # cumulative import time per top-level module, in microseconds
+    output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import gptune"], env=env, capture_output=True, text=True, check=True)
+    cumulative = {}
+    for line in output.stderr.split("\n"):
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        fields = [field.strip() for field in line[len("import time:"):].split("|")]
+        name = fields[2]
+        if name == name.lstrip():
+            cumulative[name] = int(fields[1])
+
+    print ("import gptune, median of ", args.nrepeats, " (s): ", median, " min (s): ", elapsed[0], " max (s): ", elapsed[-1])
+    print ("slowest top-level imports (cumulative s):")
+    for name in sorted(cumulative, key=lambda name: -cumulative[name])[:args.top]:
+        print ("    ", name, cumulative[name]/1e6)
+
+    loaded = [name for name in LAZY_MODULES if name in modules]
+    print ("lazily imported modules loaded by import gptune: ", loaded)
+
+    failed = len(loaded) > 0
+    if args.max_seconds is not None and median > args.max_seconds:
+        print ("median import time exceeds the budget of ", args.max_seconds, " s")
+        failed = True
+
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
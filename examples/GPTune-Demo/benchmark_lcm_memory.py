@@ -0,0 +1,110 @@
+#! /usr/bin/env python
+
+"""
+Measure the peak memory (RSS) of one likelihood and gradient evaluation of the LCM C library (fun_jac in
+gptuneclcm/lcm.c) against the number of samples m and of latent functions NL, with and without
+options['model_lean_memory'].
+
+Example of invocation of this script:
+
+python ./benchmark_lcm_memory.py -m 1000 2000 4000 -NL 1 10 30 -NT 30 -DI 3
+
+where:
+    -m is the list of numbers of samples (summed over all tasks)
+    -NL is the list of numbers of latent functions
+    -NT is the number of tasks
+    -DI is the dimension of the tuning parameter space
+    -nthreads is the number of OpenMP threads
+
+Each configuration runs in a fresh single-process interpreter (1x1 BLACS grid); the reported memory is the peak RSS
+of the evaluation minus the peak RSS before the LCM structure is initialized.
+"""
+
+import sys
+import os
+import time
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.abspath(__file__ + "/../../../GPTune/"))
+
+def parse_args():
+
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument('-m', type=int, nargs='+', default=[1000, 2000], help='Numbers of samples')
+    parser.add_argument('-NL', type=int, nargs='+', default=[1, 10], help='Numbers of latent functions')
+    parser.add_argument('-NT', type=int, default=10, help='Number of tasks')
+    parser.add_argument('-DI', type=int, default=3, help='Dimension of the tuning parameter space')
+    parser.add_argument('-nthreads', type=int, default=1, help='Number of OpenMP threads')
+    parser.add_argument('-run', type=int, nargs=3, default=None, help=argparse.SUPPRESS) # m NL lean: one evaluation in this process
+
+    args = parser.parse_args()
+
+    return args
+
+def run(m, NT, NL, DI, lean):
+
+    import ctypes
+    from ctypes import c_int, c_double, c_void_p, POINTER
+    import numpy as np
+    import mpi4py
+    from mpi4py import MPI
+    from lcm import cliblcm
+
+    if mpi4py.MPI._sizeof(mpi4py.MPI.Comm) == ctypes.sizeof(ctypes.c_int):
+        c_mpi_comm_t = c_int
+    else:
+        c_mpi_comm_t = c_void_p
+
+    np.random.seed(0)
+    X = np.concatenate([np.random.rand(m, DI), (np.arange(m) % NT).reshape(m, 1)], axis=1)
+    Y = np.random.randn(m)
+    nparam = NL * DI + NL + NL * NT + NT + NL * NT
+    params = np.power(10, np.random.uniform(-1, 0, nparam))
+    params[NL * DI + NL + NL * NT : NL * DI + NL + NL * NT + NT] = 1e-6
+    gradients = np.zeros(nparam)
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    t1 = time.time()
+    cliblcm.initialize.restype = c_void_p
+    z = cliblcm.initialize(c_int(DI), c_int(NT), c_int(NL), c_int(m),
+            X.ctypes.data_as(POINTER(c_double)), Y.ctypes.data_as(POINTER(c_double)),
+            c_int(min(32, m)), c_int(10), c_double(1e-10), c_int(1), c_int(1), c_int(lean),
+            c_mpi_comm_t.from_address(mpi4py.MPI._addressof(mpi4py.MPI.COMM_WORLD)))
+    z = c_void_p(z)
+    cliblcm.fun_jac.restype = c_double
+    neg_log_marginal_likelihood = cliblcm.fun_jac(params.ctypes.data_as(POINTER(c_double)), z, gradients.ctypes.data_as(POINTER(c_double)))
+    t2 = time.time()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cliblcm.finalize(z)
+
+    print(rss_after - rss_before, t2 - t1, neg_log_marginal_likelihood)
+
+def main():
+
+    args = parse_args()
+
+    if args.run is not None:
+        (m, NL, lean) = args.run
+        run(m, args.NT, NL, args.DI, lean)
+        return
+
+    env = dict(os.environ)
+    env["OMP_NUM_THREADS"] = str(args.nthreads)
+
+    print ("%8s %4s %4s %16s %16s %10s %10s %12s" % ("m", "NT", "NL", "peak RSS (MB)", "lean (MB)", "time (s)", "lean (s)", "rel. diff"))
+    for m in args.m:
+        for NL in args.NL:
+            results = []
+            for lean in [0, 1]:
+                output = subprocess.run([sys.executable, __file__, "-NT", str(args.NT), "-DI", str(args.DI), "-run", str(m), str(NL), str(lean)],
+                        env=env, capture_output=True, text=True, check=True)
+                (rss, elapsed, value) = output.stdout.strip().split("\n")[-1].split()
+                results.append((float(rss)/1024, float(elapsed), float(value))) # ru_maxrss is in kB on linux
+            print ("%8d %4d %4d %16.1f %16.1f %10.3f %10.3f %12.2e" % (m, args.NT, NL, results[0][0], results[1][0], results[0][1], results[1][1],
+                    abs(results[0][2] - results[1][2]) / max(abs(results[0][2]), 1e-300)))
+
+if __name__ == "__main__":
+    main()
@@ -164,6 +164,7 @@ fun_jac_struct* initialize
     double jitter,
     int nprow,
     int npcol,
+    int lean,
     MPI_Comm comm
 )
 {
@@ -182,6 +183,7 @@ fun_jac_struct* initialize
     z->Y      = Y;
     z->maxtries      = maxtries;
     z->jitter      = jitter;
+    z->lean   = lean;
 
     // MPI ScaLAPACK related parameters
     z->mpi_comm = comm;
@@ -240,8 +242,14 @@ printf("%s %d: alphadesc %d %d %d %d %d %d %d %d %d\n", __FILE__, __LINE__, z->a
 
     // Allocate shared arrays
 
-    z->dists  = (double *) malloc(z->lr * z->lc * DI * sizeof(double));
-    z->exps   = (double *) malloc(z->lr * z->lc * NL * sizeof(double));
+    // In the lean mode, the distances and the exponentials are recomputed when needed instead of being stored
+    z->dists  = NULL;
+    z->exps   = NULL;
+    if (lean == 0)
+    {
+        z->dists  = (double *) malloc(z->lr * z->lc * DI * sizeof(double));
+        z->exps   = (double *) malloc(z->lr * z->lc * NL * sizeof(double));
+    }
     z->alpha  = (double *) malloc(z->lr              * sizeof(double));
     z->distY  = (double *) malloc(z->lr              * sizeof(double));
     z->K      = (double *) malloc(z->lr * z->lc      * sizeof(double));
@@ -272,7 +280,7 @@ printf("%s %d: alphadesc %d %d %d %d %d %d %d %d %d\n", __FILE__, __LINE__, z->a
         {
             // Compute element-wise square distances
             rl2g(z, li, z->prowid, &gi);
-            for (lj = 0; lj < z->lc; lj++)
+            for (lj = 0; lj < z->lc && z->dists != NULL; lj++)
             {
                 cl2g(z, lj, z->pcolid, &gj);
                 for (d = 0; d < DI; d++)
@@ -331,45 +339,53 @@ void finalize
     free(z);
 }
 
-double fun_jac // negloglike_and_grads
+// Squared distance between the samples of local entry (li, lj) of K, global indices (gi, gj), along dimension d
+static inline double sqdist(fun_jac_struct* z, int li, int lj, int gi, int gj, int d)
+{
+    double delta;
+    if (z->dists != NULL)
+    {
+        return z->dists[(li * z->lc + lj) * z->DI + d];
+    }
+    delta = z->X[gi * (z->DI + 1) + d] - z->X[gj * (z->DI + 1) + d];
+    return delta * delta;
+}
+
+// exp(- |x_gi - x_gj|^2 / (2 theta_q^2)) of kernel k_q for local entry (li, lj) of K
+static inline double kexp(fun_jac_struct* z, double* theta, int li, int lj, int gi, int gj, int q)
+{
+    int d;
+    double sum = 0.;
+    if (z->exps != NULL)
+    {
+        return z->exps[(li * z->lc + lj) * z->NL + q];
+    }
+    for (d = 0; d < z->DI; d++)
+    {
+        sum += sqdist(z, li, lj, gi, gj, d) / (theta[q * z->DI + d]*theta[q * z->DI + d])/2;
+    }
+    return exp( - sum );
+}
+
+// Upper triangular part of K = sum_q B_q (x) k_q + D, and a copy of it in Kcopy if Kcopy is not NULL
+static void assemble_K
 (
-    // Input parameters
-    double* params,
-    // fun_jac_struct structure
     fun_jac_struct* z,
-    // Output gradients
-    double* gradients
+    double* params,
+    double* Kcopy
 )
 {
-    // Declare variables
+    int k, li, gi, lj, ljstart, gj, d, q, idxi, idxj, idxk, tmppid;
+    double sum, e;
 
-    int k, li, gi, lj, ljstart, gj, d, q, idxi, idxj, idxk, info, tmppid;
-    double sum, ws2, kk, a, dldk, *dL_dK, t1, t2;
-
-    // Unpack hyper-parameters
+    double* theta = params;
+    double* var   = theta + z->NL * z->DI;
+    double* kappa = var   + z->NL;
+    double* sigma = kappa + z->NL * z->NT;
+    double* ws    = sigma + z->NT;
 
-    double* theta = params;                 // length scales of each kernel k_q
-    double* var   = theta + z->NL * z->DI;  // variance of each kernel k_q
-    double* kappa = var   + z->NL;          // YL: diagonal regularizer added to B_q
-    double* sigma = kappa + z->NL * z->NT;  // diagonal matrix D of variances in LCM
-    double* ws    = sigma + z->NT;          // W_q used to form B_q
-
-    double* Kcopy;
-    if(z->lr * z->lc>0)
-        Kcopy = (double *) malloc(z->lr * z->lc      * sizeof(double));
-
-    // Initialize outputs
-
-    double neg_log_marginal_likelihood = 0.;
-
-    //t1 = omp_get_wtime();
-
-    for (k = 0; k < z->nparam ; k++)
-    {
-        z->buffer[k] = 0.;
-    }
 #ifdef _OPENMP
-# pragma omp parallel private ( k, li, gi, lj, ljstart, gj, d, q, idxi, idxj, idxk, sum, info, tmppid ) shared ( z, theta, var, kappa, sigma, ws )
+# pragma omp parallel private ( k, li, gi, lj, ljstart, gj, d, q, idxi, idxj, idxk, sum, e, tmppid ) shared ( z, theta, var, kappa, sigma, ws )
 #endif
     {
         #ifdef _OPENMP
@@ -421,16 +437,20 @@ printf("%s %d: %d %d %d %d\n", __FILE__, __LINE__, z->pid, li, gi, idxi); fflush
 						sum = 0.;
 						for (d = 0; d < z->DI; d++)
 						{
-							sum += z->dists[(li * z->lc + lj) * z->DI + d] / (theta[q * z->DI + d]*theta[q * z->DI + d])/2;
+							sum += sqdist(z, li, lj, gi, gj, d) / (theta[q * z->DI + d]*theta[q * z->DI + d])/2;
+						}
+						e = exp( - sum );
+						if (z->exps != NULL)
+						{
+							z->exps[(li * z->lc + lj) * z->NL + q] = e;
 						}
-						z->exps[(li * z->lc + lj) * z->NL + q] = exp( - sum );
 						if (idxi == idxj)
 						{
-							z->K[idxk] += (ws[q * z->NT + idxi] * ws[q * z->NT + idxj] + kappa[q * z->NT + idxi]) * var[q] * z->exps[(li * z->lc + lj) * z->NL + q];
+							z->K[idxk] += (ws[q * z->NT + idxi] * ws[q * z->NT + idxj] + kappa[q * z->NT + idxi]) * var[q] * e;
 						}
 						else
 						{
-							z->K[idxk] += ws[q * z->NT + idxi] * ws[q * z->NT + idxj] * var[q] * z->exps[(li * z->lc + lj) * z->NL + q]; //dsyrk and dgbmv
+							z->K[idxk] += ws[q * z->NT + idxi] * ws[q * z->NT + idxj] * var[q] * e; //dsyrk and dgbmv
 						}
 					}
 				}
@@ -451,9 +471,52 @@ printf("%s %d: %d %d %d %d\n", __FILE__, __LINE__, z->pid, li, gi, idxi); fflush
 #endif
         for (k = 0; k < z->lr * z->lc; k++)
         {
-            Kcopy[k] = z->K[k];
+            if (Kcopy != NULL)
+            {
+                Kcopy[k] = z->K[k];
+            }
         }
     }
+}
+
+double fun_jac // negloglike_and_grads
+(
+    // Input parameters
+    double* params,
+    // fun_jac_struct structure
+    fun_jac_struct* z,
+    // Output gradients
+    double* gradients
+)
+{
+    // Declare variables
+
+    int k, li, gi, lj, ljstart, gj, d, q, idxi, idxj, idxk, info, tmppid;
+    double ws2, kk, a, dldk, *dL_dK, t1, t2;
+
+    // Unpack hyper-parameters
+
+    double* theta = params;                 // length scales of each kernel k_q
+    double* var   = theta + z->NL * z->DI;  // variance of each kernel k_q
+    double* kappa = var   + z->NL;          // YL: diagonal regularizer added to B_q
+    double* sigma = kappa + z->NL * z->NT;  // diagonal matrix D of variances in LCM
+    double* ws    = sigma + z->NT;          // W_q used to form B_q
+
+    double* Kcopy = NULL;
+    if(z->lr * z->lc>0 && z->lean == 0)
+        Kcopy = (double *) malloc(z->lr * z->lc      * sizeof(double));
+
+    // Initialize outputs
+
+    double neg_log_marginal_likelihood = 0.;
+
+    //t1 = omp_get_wtime();
+
+    for (k = 0; k < z->nparam ; k++)
+    {
+        z->buffer[k] = 0.;
+    }
+    assemble_K(z, params, Kcopy);
 
 #ifdef DEBUG
 for (int p = 0; p < 8; p++)
@@ -486,6 +549,10 @@ for (int p = 0; p < 8; p++)
         int ntry=0;
         double jitter = z->jitter;
         while(info>0 && ntry<z->maxtries){
+            if (Kcopy == NULL && ntry > 0)   // lean mode: no copy of K, rebuild it
+            {
+                assemble_K(z, params, NULL);
+            }
         #ifdef _OPENMP
         # pragma omp parallel private ( k, li, gi, ljstart, tmppid ) shared ( z )
         #endif
@@ -495,7 +562,10 @@ for (int p = 0; p < 8; p++)
         #endif
                 for (k = 0; k < z->lr * z->lc; k++)
                 {
-                    z->K[k] = Kcopy[k];
+                    if (Kcopy != NULL)
+                    {
+                        z->K[k] = Kcopy[k];
+                    }
                 }
 
         #ifdef _OPENMP
@@ -648,14 +718,14 @@ for (int p = 0; p < 8; p++)
                 {
                     ws2 = ws[q * z->NT + idxi] * ws[q * z->NT + idxi];
                     kk = kappa[q * z->NT + idxi];
-                    a = dldk * z->exps[(li * z->lc + ljstart) * z->NL + q];
+                    a = dldk * kexp(z, theta, li, ljstart, gi, gi, q);
                     var_gradients_TPS[q] += 0; // This makes sure variance is fixed
                     // var_gradients_TPS[q] += (ws2+kk) * a;
                     a *= var[q];  // a is kq in the ppopp21 paper
                     kappa_gradients_TPS[q * z->NT + idxi] += a*kappa[q * z->NT + idxi];
                     for (d = 0; d < z->DI; d++)
                     {
-                        theta_gradients_TPS[q * z->DI + d] += (ws2+kk) * a * (z->dists[(li * z->lc + ljstart) * z->DI + d]) / (theta[q * z->DI + d] * theta[q * z->DI + d]);
+                        theta_gradients_TPS[q * z->DI + d] += (ws2+kk) * a * sqdist(z, li, ljstart, gi, gi, d) / (theta[q * z->DI + d] * theta[q * z->DI + d]);
                     }
                     // If (idxi == idxj) then ws_gradient is supposed to be 2 * ws[] * a
                     // which is exacly what happens in the following two lines anyways
@@ -683,7 +753,7 @@ for (int p = 0; p < 8; p++)
                             kk = 0;
                         }
 						ws2 = ws[q * z->NT + idxi] * ws[q * z->NT + idxj];
-						a = dldk * z->exps[(li * z->lc + lj) * z->NL + q];
+						a = dldk * kexp(z, theta, li, lj, gi, gj, q);
 						var_gradients_TPS[q] += 0; // this makes sure variance is fixed //2. * (ws2+kk) * a;
 						// var_gradients_TPS[q] += 2. * (ws2+kk) * a;
                         a *= var[q];  // a is kq in the ppopp21 paper
@@ -692,7 +762,7 @@ for (int p = 0; p < 8; p++)
                         }
 						for (d = 0; d < z->DI; d++)
 						{
-							theta_gradients_TPS[q * z->DI + d] += 2. * (ws2+kk) * a * (z->dists[(li * z->lc + lj) * z->DI + d]) / (theta[q * z->DI + d] * theta[q * z->DI + d]);
+							theta_gradients_TPS[q * z->DI + d] += 2. * (ws2+kk) * a * sqdist(z, li, lj, gi, gj, d) / (theta[q * z->DI + d] * theta[q * z->DI + d]);
 						}
                         if (idxi == idxj){
                             ws_gradients_TPS[q * z->NT + idxi] += 4*ws[q * z->NT + idxi]*ws[q * z->NT + idxi] * a;
@@ -735,3 +805,533 @@ for (int p = 0; p < 8; p++)
 //MPI_Barrier( MPI_COMM_WORLD );
 //MPI_Barrier( z->mpi_comm );
 
+
+/**************************************************************************************************/
+
+// Inducing-point (sparse) LCM likelihood
+//
+// The M inducing points Z are points of the joint (parameter, task) space, so that Kuu and Kfu are blocks of the
+// same LCM kernel as in fun_jac. With the diagonal noise N = diag(sigma[task of x_i]) and Qff = Kfu Kuu^-1 Kuf:
+//     VFE : F = log N(y | 0, Qff + N) - 0.5 tr(N^-1 (Kff - Qff))        (variational lower bound)
+//     FITC: F = log N(y | 0, Qff + diag(Kff - Qff) + N)
+// Both are computed through P = Kuu + Kuf G^-1 Kfu (G = N for VFE, N + diag(Kff - Qff) for FITC), so that a step
+// costs O(m M^2) time and O(m M) memory. The rows of X are distributed over the processes of mpi_comm; the
+// M x M matrices are small and replicated. The gradients are with respect to the logarithms of the parameters, as in fun_jac.
+
+// LCM kernel entry between a point of task a and a point of task b, given their squared distances
+static double lcm_entry
+(
+    int DI, int NT, int NL,
+    const double* theta, const double* var, const double* kappa, const double* ws,
+    const double* dists, int a, int b
+)
+{
+    int d, q;
+    double sum, bq, k = 0.;
+
+    for (q = 0; q < NL; q++)
+    {
+        sum = 0.;
+        for (d = 0; d < DI; d++)
+        {
+            sum += dists[d] / (theta[q * DI + d] * theta[q * DI + d]) / 2;
+        }
+        bq = ws[q * NT + a] * ws[q * NT + b];
+        if (a == b)
+        {
+            bq += kappa[q * NT + a];
+        }
+        k += bq * var[q] * exp( - sum );
+    }
+
+    return k;
+}
+
+// Add coef * d(entry)/d(log parameters) to grad (var is kept fixed, as in fun_jac)
+static void lcm_entry_gradients
+(
+    int DI, int NT, int NL,
+    const double* theta, const double* var, const double* kappa, const double* ws,
+    const double* dists, int a, int b, double coef,
+    double* grad
+)
+{
+    int d, q;
+    double sum, bq, kq, wab;
+
+    double* theta_grad = grad;
+    double* kappa_grad = theta_grad + NL * DI + NL;
+    double* ws_grad    = kappa_grad + NL * NT + NT;
+
+    for (q = 0; q < NL; q++)
+    {
+        sum = 0.;
+        for (d = 0; d < DI; d++)
+        {
+            sum += dists[d] / (theta[q * DI + d] * theta[q * DI + d]) / 2;
+        }
+        kq = coef * var[q] * exp( - sum );
+        wab = ws[q * NT + a] * ws[q * NT + b];
+        bq = wab;
+        if (a == b)
+        {
+            bq += kappa[q * NT + a];
+            kappa_grad[q * NT + a] += kq * kappa[q * NT + a];
+        }
+        for (d = 0; d < DI; d++)
+        {
+            theta_grad[q * DI + d] += bq * kq * dists[d] / (theta[q * DI + d] * theta[q * DI + d]);
+        }
+        ws_grad[q * NT + a] += kq * wab;
+        ws_grad[q * NT + b] += kq * wab;
+    }
+}
+
+static void symmetrize_lower(int n, double* A)   // copy the lower triangle (column major) to the upper one
+{
+    int i, j;
+    for (j = 0; j < n; j++)
+    {
+        for (i = j + 1; i < n; i++)
+        {
+            A[i * n + j] = A[j * n + i];
+        }
+    }
+}
+
+fun_jac_sparse_struct* initialize_sparse
+(
+    // Dimensions / Sizes
+    int DI,
+    int NT,
+    int NL,
+    int m,
+    int M,
+    int method,
+    // Input arrays
+    double* X,
+    double* Y,
+    double* Z,
+    // MPI related parameters
+    int maxtries,
+    double jitter,
+    MPI_Comm comm
+)
+{
+    int i, j, d;
+    double delta;
+
+    fun_jac_sparse_struct* z = (fun_jac_sparse_struct *) malloc(sizeof(fun_jac_sparse_struct));
+
+    z->DI       = DI;
+    z->NT       = NT;
+    z->NL       = NL;
+    z->nparam   = z->NL * z->DI + z->NL + z->NL * z->NT + z->NT + z->NL * z->NT;
+    z->m        = m;
+    z->M        = M;
+    z->method   = method;
+    z->X        = X;
+    z->Y        = Y;
+    z->Z        = Z;
+    z->maxtries = maxtries;
+    z->jitter   = jitter;
+
+    z->mpi_comm = comm;
+    MPI_Comm_rank (z->mpi_comm, &(z->pid));
+    MPI_Comm_size (z->mpi_comm, &(z->nproc));
+
+    // Block distribution of the rows of X
+    z->lm = m / z->nproc + (z->pid < m % z->nproc ? 1 : 0);
+    z->m0 = z->pid * (m / z->nproc) + MIN(z->pid, m % z->nproc);
+
+    z->dists_fu = (double *) malloc(MAX(z->lm * M * DI, 1) * sizeof(double));
+    z->dists_uu = (double *) malloc(MAX(M * M * DI, 1)     * sizeof(double));
+    z->Kuu      = (double *) malloc(M * M                  * sizeof(double));
+    z->Kuuinv   = (double *) malloc(M * M                  * sizeof(double));
+    z->P        = (double *) malloc(M * M                  * sizeof(double));
+    z->Pinv     = (double *) malloc(M * M                  * sizeof(double));
+    z->Kfu      = (double *) malloc(MAX(z->lm * M, 1)      * sizeof(double));
+    z->V        = (double *) malloc(MAX(z->lm * M, 1)      * sizeof(double));
+    z->W        = (double *) malloc(MAX(z->lm * M, 1)      * sizeof(double));
+    z->buffer   = (double *) malloc((M * M + M + 3)        * sizeof(double));
+
+#ifdef _OPENMP
+# pragma omp parallel for private ( i, j, d, delta )
+#endif
+    for (i = 0; i < z->lm; i++)
+    {
+        for (j = 0; j < M; j++)
+        {
+            for (d = 0; d < DI; d++)
+            {
+                delta = X[(z->m0 + i) * (DI + 1) + d] - Z[j * (DI + 1) + d];
+                z->dists_fu[(i * M + j) * DI + d] = delta * delta;
+            }
+        }
+    }
+#ifdef _OPENMP
+# pragma omp parallel for private ( i, j, d, delta )
+#endif
+    for (i = 0; i < M; i++)
+    {
+        for (j = 0; j < M; j++)
+        {
+            for (d = 0; d < DI; d++)
+            {
+                delta = Z[i * (DI + 1) + d] - Z[j * (DI + 1) + d];
+                z->dists_uu[(i * M + j) * DI + d] = delta * delta;
+            }
+        }
+    }
+
+    return z;
+}
+
+void finalize_sparse
+(
+    // fun_jac_sparse_struct structure
+    fun_jac_sparse_struct* z
+)
+{
+    free(z->dists_fu);
+    free(z->dists_uu);
+    free(z->Kuu);
+    free(z->Kuuinv);
+    free(z->P);
+    free(z->Pinv);
+    free(z->Kfu);
+    free(z->V);
+    free(z->W);
+    free(z->buffer);
+    free(z);
+}
+
+double fun_jac_sparse // negative log likelihood (FITC) or negative variational bound (VFE), and gradients
+(
+    // Input parameters
+    double* params,
+    // fun_jac_sparse_struct structure
+    fun_jac_sparse_struct* z,
+    // Output gradients
+    double* gradients
+)
+{
+    int i, j, k, info, ntry, nbuf;
+    int DI = z->DI, NT = z->NT, NL = z->NL, M = z->M, lm = z->lm, MM = z->M * z->M;
+    char lower = 'L', notrans = 'N', transpose = 'T';
+    double jitter, logdet_Kuu, logdet_P, coef, d_zero = 0.;
+
+    // Unpack hyper-parameters
+
+    double* theta = params;                 // length scales of each kernel k_q
+    double* var   = theta + z->NL * z->DI;  // variance of each kernel k_q
+    double* kappa = var   + z->NL;          // diagonal regularizer added to B_q
+    double* sigma = kappa + z->NL * z->NT;  // diagonal matrix D of variances in LCM
+    double* ws    = sigma + z->NT;          // W_q used to form B_q
+
+    double* Psum    = z->buffer;            // reduced together: Kuf G^-1 Kfu, Kuf G^-1 y, and three sums over the samples
+    double* r       = Psum + MM;
+    double* scalars = r + M;                // sum log G_i, sum y_i^2 / G_i, sum (Kff_ii - Qff_ii) / N_i
+    double* Kuucopy = (double *) malloc(MM * sizeof(double));
+    double* kdiag   = (double *) malloc(MAX(lm, 1) * sizeof(double));
+    double* n       = (double *) malloc(MAX(lm, 1) * sizeof(double));
+    double* qdiag   = (double *) malloc(MAX(lm, 1) * sizeof(double));
+    double* h       = (double *) malloc(MAX(lm, 1) * sizeof(double));
+    double* grad    = (double *) calloc(z->nparam, sizeof(double));
+    double* zeros   = (double *) calloc(MAX(DI, 1), sizeof(double));
+
+    // Kuu, with jittering until it can be factored
+
+#ifdef _OPENMP
+# pragma omp parallel for private ( i, j )
+#endif
+    for (i = 0; i < M; i++)
+    {
+        for (j = 0; j < M; j++)
+        {
+            Kuucopy[i * M + j] = lcm_entry(DI, NT, NL, theta, var, kappa, ws, &(z->dists_uu[(i * M + j) * DI]), (int) z->Z[i * (DI + 1) + DI], (int) z->Z[j * (DI + 1) + DI]);
+        }
+    }
+    info = 1;
+    ntry = 0;
+    jitter = z->jitter;
+    while (info > 0 && ntry < z->maxtries)
+    {
+        for (k = 0; k < MM; k++)
+        {
+            z->Kuu[k] = Kuucopy[k];
+        }
+        for (i = 0; i < M; i++)
+        {
+            z->Kuu[i * M + i] += jitter;
+        }
+        for (k = 0; k < MM; k++)
+        {
+            Kuucopy[k] = z->Kuu[k];   // Kuu including the jitter, as used below
+        }
+        dpotrf_( &lower, &M, z->Kuu, &M, &info );
+        if (info > 0)
+        {
+            for (i = 0; i < M; i++)
+            {
+                Kuucopy[i * M + i] -= jitter;
+            }
+        }
+        jitter *= 10;
+        ntry++;
+    }
+    if (info > 0)
+    {
+        printf("Kuu matrix not positive definite with jittering, consider increasing option['model_max_jitter_try']");
+        exit(0);
+    }
+    logdet_Kuu = 0.;
+    for (i = 0; i < M; i++)
+    {
+        logdet_Kuu += 2. * log(z->Kuu[i * M + i]);
+        for (j = 0; j < M; j++)
+        {
+            z->Kuuinv[i * M + j] = z->Kuu[i * M + j];
+        }
+    }
+    dpotri_( &lower, &M, z->Kuuinv, &M, &info );
+    symmetrize_lower(M, z->Kuuinv);
+
+    // Local rows of Kfu, diag(Kff), V = Kfu Kuu^-1 and diag(Qff)
+
+#ifdef _OPENMP
+# pragma omp parallel for private ( i, j )
+#endif
+    for (i = 0; i < lm; i++)
+    {
+        int ti = (int) z->X[(z->m0 + i) * (DI + 1) + DI];
+        for (j = 0; j < M; j++)
+        {
+            z->Kfu[i * M + j] = lcm_entry(DI, NT, NL, theta, var, kappa, ws, &(z->dists_fu[(i * M + j) * DI]), ti, (int) z->Z[j * (DI + 1) + DI]);
+        }
+        kdiag[i] = lcm_entry(DI, NT, NL, theta, var, kappa, ws, zeros, ti, ti);
+    }
+    if (lm > 0)
+    {
+        // row major lm x M arrays are column major M x lm arrays
+        dgemm_( &notrans, &notrans, &M, &lm, &M, &d_one, z->Kuuinv, &M, z->Kfu, &M, &d_zero, z->V, &M );
+    }
+
+    for (k = 0; k < MM + M + 3; k++)
+    {
+        z->buffer[k] = 0.;
+    }
+#ifdef _OPENMP
+# pragma omp parallel for private ( i, j )
+#endif
+    for (i = 0; i < lm; i++)
+    {
+        int ti = (int) z->X[(z->m0 + i) * (DI + 1) + DI];
+        double lambda = sigma[ti];
+        qdiag[i] = 0.;
+        for (j = 0; j < M; j++)
+        {
+            qdiag[i] += z->Kfu[i * M + j] * z->V[i * M + j];
+        }
+        if (z->method == 1)   // FITC
+        {
+            n[i] = lambda + MAX(kdiag[i] - qdiag[i], 0.);
+        }
+        else                  // VFE
+        {
+            n[i] = lambda;
+        }
+        for (j = 0; j < M; j++)
+        {
+            z->W[i * M + j] = z->Kfu[i * M + j] / sqrt(n[i]);
+        }
+    }
+    for (i = 0; i < lm; i++)
+    {
+        int ti = (int) z->X[(z->m0 + i) * (DI + 1) + DI];
+        double yi = z->Y[z->m0 + i];
+        for (j = 0; j < M; j++)
+        {
+            r[j] += z->Kfu[i * M + j] * yi / n[i];
+        }
+        scalars[0] += log(n[i]);
+        scalars[1] += yi * yi / n[i];
+        scalars[2] += (kdiag[i] - qdiag[i]) / sigma[ti];
+    }
+    if (lm > 0)
+    {
+        dsyrk_( &lower, &notrans, &M, &lm, &d_one, z->W, &M, &d_zero, Psum, &M );
+    }
+    nbuf = MM + M + 3;
+    MPI_Allreduce( MPI_IN_PLACE, z->buffer, nbuf, MPI_DOUBLE, MPI_SUM, z->mpi_comm );
+
+    // P = Kuu + Kuf G^-1 Kfu, beta = P^-1 Kuf G^-1 y
+
+    for (j = 0; j < M; j++)
+    {
+        for (i = j; i < M; i++)
+        {
+            z->P[j * M + i] = Kuucopy[j * M + i] + Psum[j * M + i];
+        }
+    }
+    dpotrf_( &lower, &M, z->P, &M, &info );
+    if (info > 0)
+    {
+        printf("P matrix not positive definite, consider increasing option['model_jitter']");
+        exit(0);
+    }
+    logdet_P = 0.;
+    for (i = 0; i < M; i++)
+    {
+        logdet_P += 2. * log(z->P[i * M + i]);
+        for (j = 0; j < M; j++)
+        {
+            z->Pinv[i * M + j] = z->P[i * M + j];
+        }
+    }
+    dpotri_( &lower, &M, z->Pinv, &M, &info );
+    symmetrize_lower(M, z->Pinv);
+    double* beta = (double *) malloc(M * sizeof(double));
+    for (j = 0; j < M; j++)
+    {
+        beta[j] = r[j];
+    }
+    dpotrs_( &lower, &M, &i_one, z->P, &M, beta, &M, &info );
+
+    double yPy = scalars[1];
+    for (j = 0; j < M; j++)
+    {
+        yPy -= r[j] * beta[j];
+    }
+    double neg_log_marginal_likelihood = 0.5 * (z->m * LOG_2_PI + scalars[0] + logdet_P - logdet_Kuu + yPy);
+    if (z->method == 0)
+    {
+        neg_log_marginal_likelihood += 0.5 * scalars[2];
+    }
+
+    // Gradients with respect to Kfu, diag(Kff) and the noise, accumulated into the parameters row by row:
+    //     dF/dKfu_i = alpha_i beta^T - (P^-1 k_i)^T / G_i - 2 h_i v_i,   dF/dKff_ii = h_i,   dF/dG_i = g_i
+    // with alpha = G^-1 (y - Kfu beta), g_i = 0.5 (alpha_i^2 - 1 / G_i + k_i^T P^-1 k_i / G_i^2),
+    // v_i = Kuu^-1 k_i, and h_i = -0.5 / N_i (VFE) or g_i (FITC)
+
+    if (lm > 0)
+    {
+        dgemm_( &notrans, &notrans, &M, &lm, &M, &d_one, z->Pinv, &M, z->Kfu, &M, &d_zero, z->W, &M );   // W = Kfu P^-1
+    }
+#ifdef _OPENMP
+# pragma omp parallel private ( i, j, coef )
+#endif
+    {
+        double* grad_private = (double *) calloc(z->nparam, sizeof(double));
+        double* sigma_grad = grad_private + NL * DI + NL + NL * NT;
+#ifdef _OPENMP
+# pragma omp for
+#endif
+        for (i = 0; i < lm; i++)
+        {
+            int ti = (int) z->X[(z->m0 + i) * (DI + 1) + DI];
+            double kb = 0., s = 0., alpha, g, dlambda;
+            for (j = 0; j < M; j++)
+            {
+                kb += z->Kfu[i * M + j] * beta[j];
+                s  += z->Kfu[i * M + j] * z->W[i * M + j];
+            }
+            alpha = (z->Y[z->m0 + i] - kb) / n[i];
+            g = 0.5 * (alpha * alpha - 1. / n[i] + s / (n[i] * n[i]));
+            if (z->method == 1)
+            {
+                h[i] = g;
+                dlambda = g;
+            }
+            else
+            {
+                h[i] = -0.5 / sigma[ti];
+                dlambda = g + 0.5 * (kdiag[i] - qdiag[i]) / (sigma[ti] * sigma[ti]);
+            }
+            sigma_grad[ti] += dlambda * sigma[ti];
+            lcm_entry_gradients(DI, NT, NL, theta, var, kappa, ws, zeros, ti, ti, h[i], grad_private);
+            for (j = 0; j < M; j++)
+            {
+                coef = alpha * beta[j] - z->W[i * M + j] / n[i] - 2. * h[i] * z->V[i * M + j];
+                lcm_entry_gradients(DI, NT, NL, theta, var, kappa, ws, &(z->dists_fu[(i * M + j) * DI]), ti, (int) z->Z[j * (DI + 1) + DI], coef, grad_private);
+            }
+        }
+#ifdef _OPENMP
+# pragma omp critical
+#endif
+        {
+            for (k = 0; k < z->nparam; k++)
+            {
+                grad[k] += grad_private[k];
+            }
+        }
+        free(grad_private);
+    }
+
+    // dF/dKuu = -0.5 beta beta^T + 0.5 (Kuu^-1 - P^-1) + sum_i h_i v_i v_i^T, the rows of Kuu are shared among the processes
+
+#ifdef _OPENMP
+# pragma omp parallel for private ( i, j )
+#endif
+    for (i = 0; i < lm; i++)
+    {
+        for (j = 0; j < M; j++)
+        {
+            z->W[i * M + j] = h[i] * z->V[i * M + j];
+        }
+    }
+    for (k = 0; k < MM; k++)
+    {
+        Psum[k] = 0.;
+    }
+    if (lm > 0)
+    {
+        dgemm_( &notrans, &transpose, &M, &M, &lm, &d_one, z->W, &M, z->V, &M, &d_zero, Psum, &M );
+    }
+    MPI_Allreduce( MPI_IN_PLACE, Psum, MM, MPI_DOUBLE, MPI_SUM, z->mpi_comm );
+
+#ifdef _OPENMP
+# pragma omp parallel private ( i, j, coef )
+#endif
+    {
+        double* grad_private = (double *) calloc(z->nparam, sizeof(double));
+#ifdef _OPENMP
+# pragma omp for
+#endif
+        for (i = 0; i < M; i++)
+        {
+            if (i % z->nproc != z->pid)
+            {
+                continue;
+            }
+            for (j = 0; j < M; j++)
+            {
+                coef = -0.5 * beta[i] * beta[j] + 0.5 * (z->Kuuinv[i * M + j] - z->Pinv[i * M + j]) + Psum[i * M + j];
+                lcm_entry_gradients(DI, NT, NL, theta, var, kappa, ws, &(z->dists_uu[(i * M + j) * DI]), (int) z->Z[i * (DI + 1) + DI], (int) z->Z[j * (DI + 1) + DI], coef, grad_private);
+            }
+        }
+#ifdef _OPENMP
+# pragma omp critical
+#endif
+        {
+            for (k = 0; k < z->nparam; k++)
+            {
+                grad[k] += grad_private[k];
+            }
+        }
+        free(grad_private);
+    }
+
+    MPI_Allreduce( grad, gradients, z->nparam, MPI_DOUBLE, MPI_SUM, z->mpi_comm );
+
+    free(Kuucopy);
+    free(kdiag);
+    free(n);
+    free(qdiag);
+    free(h);
+    free(grad);
+    free(zeros);
+    free(beta);
+
+    return neg_log_marginal_likelihood;
+}
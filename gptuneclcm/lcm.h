@@ -105,6 +105,8 @@ typedef struct
     double* buffer;    // buffer for MPI communications and for internal copies
     MPI_Comm mpi_comm; // MPI communicator
 
+    int lean;          // Memory-lean mode: dists, exps and the copy of K for the jitter retries are not stored but recomputed
+
 } fun_jac_struct;
 
 /* LCM routines */
@@ -125,6 +127,7 @@ fun_jac_struct* initialize
     double jitter,
     int nprow,
     int npcol,
+    int lean,
     MPI_Comm comm
 );
 
@@ -144,3 +147,91 @@ double fun_jac // negloglike_and_grads
     double* gradients
 );
 
+
+/* Inducing-point (sparse) LCM likelihood */
+
+// BLAS & LAPACK
+void dgemm_(const char* TRANSA, const char* TRANSB, const int* M, const int* N, const int* K, const double* ALPHA, const double* A, const int* LDA, const double* B, const int* LDB, const double* BETA, double* C, const int* LDC);
+void dsyrk_(const char* UPLO, const char* TRANS, const int* N, const int* K, const double* ALPHA, const double* A, const int* LDA, const double* BETA, double* C, const int* LDC);
+void dpotrf_(const char* UPLO, const int* N, double* A, const int* LDA, int* INFO);
+void dpotrs_(const char* UPLO, const int* N, const int* NRHS, const double* A, const int* LDA, double* B, const int* LDB, int* INFO);
+void dpotri_(const char* UPLO, const int* N, double* A, const int* LDA, int* INFO);
+
+typedef struct
+{
+    // Input dimensions and sizes
+
+    int DI;
+    int NT;
+    int NL;
+    int nparam;
+    int m;             // Total number of samples
+    int M;             // Number of inducing points
+    int method;        // 0: VFE (variational free energy bound), 1: FITC
+
+    // Input arrays
+
+    double* X;
+    double* Y;
+    double* Z;         // Inducing points, stored like X (DI coordinates followed by the task index)
+
+    // Rows of X handled by this process
+
+    int m0;
+    int lm;
+
+    // Work arrays
+
+    double* dists_fu;  // lm * M * DI squared distances between the local samples and the inducing points
+    double* dists_uu;  // M * M * DI squared distances between the inducing points
+    double* Kuu;       // M * M, Cholesky factor of Kuu after fun_jac_sparse
+    double* Kuuinv;    // M * M
+    double* P;         // M * M, Kuu + Kuf N^-1 Kfu (N: diagonal noise), then its Cholesky factor
+    double* Pinv;      // M * M
+    double* Kfu;       // lm * M
+    double* V;         // lm * M, Kfu Kuu^-1
+    double* W;         // lm * M, work array
+    double* buffer;    // M * M + M + 3, buffer for MPI reductions
+
+    int maxtries;      // Max number of jittering
+    double jitter;     // The staring jittering parameter
+    int pid;           // Process ID in communicator mpi_comm
+    int nproc;         // Number of processes in communicator mpi_comm
+    MPI_Comm mpi_comm; // MPI communicator
+
+} fun_jac_sparse_struct;
+
+fun_jac_sparse_struct* initialize_sparse
+(
+    // Dimensions / Sizes
+    int DI,
+    int NT,
+    int NL,
+    int m,
+    int M,
+    int method,
+    // Input arrays
+    double* X,
+    double* Y,
+    double* Z,
+    // MPI related parameters
+    int maxtries,
+    double jitter,
+    MPI_Comm comm
+);
+
+void finalize_sparse
+(
+    // fun_jac_sparse_struct structure
+    fun_jac_sparse_struct* z
+);
+
+double fun_jac_sparse // negative log likelihood (FITC) or negative variational bound (VFE), and gradients
+(
+    // Input parameters
+    double* params,
+    // fun_jac_sparse_struct structure
+    fun_jac_sparse_struct* z,
+    // Output gradients
+    double* gradients
+);